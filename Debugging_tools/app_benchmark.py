@@ -0,0 +1,168 @@
+#!/usr/bin/env python3
+"""
+In-Process App Benchmark
+Runs the whole app against the in-memory SQLite backend (sqlite_backend.py)
+and drives it through Flask's test client with a weighted mix of agent and
+admin requests, so a change can be profiled or timed without a MySQL
+server. Reports per-route request counts, mean and p95 latency and overall
+throughput.
+
+Usage:
+    python Debugging_tools/app_benchmark.py --agents 20 --policies 500 --requests 2000
+    python -m cProfile -s cumtime Debugging_tools/app_benchmark.py --requests 500
+"""
+
+import argparse
+import os
+import random
+import sys
+import time
+from collections import defaultdict
+from datetime import date, timedelta
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, ROOT)
+
+# Must be set before db is imported
+os.environ['DB_BACKEND'] = 'sqlite'
+os.environ.pop('DB_SHARDS', None)
+
+import bcrypt
+
+import db
+from app import app
+from policy_rules import calculate_premium
+from schedule import MODE_MONTHS, add_months
+
+ADMIN_START = 20001
+AGENT_START = 2000001
+PLAN_NO = '102'  # Term Insurance: every mode, terms of 5-40 years
+MODES = list(MODE_MONTHS)
+
+# (name, role, weight, request builder); builders return (method, url, form data)
+WORKLOAD = [
+    ('policies', 'agent', 10, lambda ctx: ('GET', '/policies', None)),
+    ('payments', 'agent', 10, lambda ctx: ('GET', '/payments', None)),
+    ('pay form', 'agent', 6, lambda ctx: ('GET', f"/payments/pay/{ctx['policy']}", None)),
+    ('pay', 'agent', 6, lambda ctx: ('POST', f"/payments/pay/{ctx['policy']}",
+                                     {'amount': ctx['premium'], 'mode': 'Cash'})),
+    ('schedule api', 'agent', 8, lambda ctx: ('GET', f"/api/policies/{ctx['policy']}/schedule?limit=12", None)),
+    ('commission', 'agent', 5, lambda ctx: ('GET', '/reports/commission', None)),
+    ('history', 'agent', 5, lambda ctx: ('GET', '/payments/history', None)),
+    ('dashboard', 'admin', 6, lambda ctx: ('GET', '/dashboard', None)),
+    ('business report', 'admin', 6, lambda ctx: ('GET', '/reports/business?level=month&group=agent', None)),
+    ('kpi api', 'admin', 8, lambda ctx: ('GET', '/api/kpi', None)),
+    ('leaderboard api', 'admin', 6, lambda ctx: ('GET', '/api/leaderboard?window=30', None)),
+    ('plans', 'admin', 4, lambda ctx: ('GET', '/plans', None)),
+]
+
+def seed(conn, admins, agents, policies_per_agent, rng):
+    """Admins, agents and policies with holders, spread over the last three years"""
+    # Benchmark logins never go through bcrypt, so the cheapest cost will do
+    password = bcrypt.hashpw(b'benchmark', bcrypt.gensalt(rounds=4)).decode()
+    cursor = conn.cursor()
+    conn.start_transaction()
+    admin_ids = [str(ADMIN_START + i) for i in range(admins)]
+    cursor.executemany("""INSERT INTO Admin (Admin_id, Branch_id, Name, Mobile, Email, DOB, Designation, Password)
+                          VALUES (%s, %s, %s, %s, %s, %s, 'Manager', %s)""",
+                       [(admin_id, f'BR{i:03d}', f'Admin {admin_id}', f'90{admin_id}000', f'{admin_id}@bench.test',
+                         date(1980, 1, 1), password) for i, admin_id in enumerate(admin_ids)])
+    agent_codes = [str(AGENT_START + i) for i in range(agents)]
+    cursor.executemany("""INSERT INTO Agent (Agency_code, Admin_id, Branch_id, Name, Mobile, Email, Password)
+                          VALUES (%s, %s, %s, %s, %s, %s, %s)""",
+                       [(code, admin_ids[i % admins], f'BR{i % admins:03d}', f'Agent {code}', f'80{code}0',
+                         f'{code}@bench.test', password) for i, code in enumerate(agent_codes)])
+
+    today = date.today()
+    policies, holders, owned = [], [], defaultdict(list)
+    policy_no = 300000000
+    for code in agent_codes:
+        for _ in range(policies_per_agent):
+            policy_no += 1
+            mode, term = rng.choice(MODES), rng.randint(10, 30)
+            sum_assured = rng.randrange(100000, 5000000, 50000)
+            premium = round(calculate_premium(sum_assured, term, mode), 2)
+            doc = today - timedelta(days=rng.randint(0, 3 * 365))
+            fup = doc
+            while fup < today - timedelta(days=rng.randint(0, 90)):
+                fup = add_months(fup, MODE_MONTHS[mode])
+            policies.append((str(policy_no), PLAN_NO, code, premium, doc, fup, mode, term, sum_assured))
+            holders.append((str(policy_no), f'Holder {policy_no}', '1 Test Road', 'Pune', 'Maharashtra', '411001',
+                            'Nominee', 'Spouse', 'Female', 'Engineer', date(1985, 6, 1), 'Graduate'))
+            owned[code].append((str(policy_no), premium))
+    cursor.executemany("""INSERT INTO Policy (Policy_no, Plan_no, Agency_code, Premium, DOC, FUP, Status, Mode, Term, Sum_Assured)
+                          VALUES (%s, %s, %s, %s, %s, %s, 1, %s, %s, %s)""", policies)
+    cursor.executemany("""INSERT INTO Policy_Holder (Policy_no, Name, Address, City, State, Pincode,
+                          Nominee_Name, Nominee_Relation, Gender, Occupation, DOB, Education)
+                          VALUES (%s, %s, %s, %s, %s, %s, %s, %s, %s, %s, %s, %s)""", holders)
+    conn.commit()
+    cursor.close()
+    return admin_ids, owned
+
+def login(client, user_id, role):
+    """Put a user in the client's session without going through the login form"""
+    with client.session_transaction() as sess:
+        sess.update(user_id=user_id, name=f'Bench {user_id}', role=role, csrf_token='benchmark')
+
+def run(requests, admin_ids, owned, rng):
+    """Issue the weighted workload, returns per-route latencies and failures"""
+    clients = {'admin': app.test_client(), 'agent': app.test_client()}
+    weights = [weight for _, _, weight, _ in WORKLOAD]
+    timings, failures = defaultdict(list), defaultdict(int)
+    for _ in range(requests):
+        name, role, _, build = rng.choices(WORKLOAD, weights)[0]
+        if role == 'agent':
+            agent = rng.choice(list(owned))
+            policy, premium = rng.choice(owned[agent])
+            login(clients[role], agent, role)
+            ctx = {'policy': policy, 'premium': premium}
+        else:
+            login(clients[role], rng.choice(admin_ids), role)
+            ctx = {}
+        method, url, data = build(ctx)
+        started = time.perf_counter()
+        response = clients[role].open(url, method=method, data=data)
+        response.get_data()  # streamed pages render while they are read
+        response.close()  # as a WSGI server would: runs the response's close callbacks
+        timings[name].append(time.perf_counter() - started)
+        if response.status_code >= 400:
+            failures[name] += 1
+    return timings, failures
+
+def main():
+    """Command line entry point"""
+    parser = argparse.ArgumentParser(description='Benchmark the app in-process on the SQLite backend')
+    parser.add_argument('--admins', type=int, default=3)
+    parser.add_argument('--agents', type=int, default=20)
+    parser.add_argument('--policies', type=int, default=200, help='Policies per agent')
+    parser.add_argument('--requests', type=int, default=1000)
+    parser.add_argument('--seed', type=int, default=1)
+    args = parser.parse_args()
+
+    rng = random.Random(args.seed)
+    conn = db.get_connection()
+    started = time.perf_counter()
+    admin_ids, owned = seed(conn, args.admins, args.agents, args.policies, rng)
+    conn.close()
+    print(f"Seeded {args.agents} agents, {args.agents * args.policies:,} policies "
+          f"in {time.perf_counter() - started:.1f}s")
+
+    started = time.perf_counter()
+    timings, failures = run(args.requests, admin_ids, owned, rng)
+    elapsed = time.perf_counter() - started
+
+    print(f"{'route':<18}{'count':>7}{'mean ms':>10}{'p95 ms':>10}{'errors':>8}")
+    for name, _, _, _ in WORKLOAD:
+        samples = sorted(timings.get(name, []))
+        if not samples:
+            continue
+        mean = sum(samples) / len(samples) * 1000
+        p95 = samples[min(int(len(samples) * 0.95), len(samples) - 1)] * 1000
+        print(f"{name:<18}{len(samples):>7}{mean:>10.1f}{p95:>10.1f}{failures.get(name, 0):>8}")
+    total_failures = sum(failures.values())
+    print(f"{'✓' if not total_failures else '✗'} {args.requests} requests in {elapsed:.1f}s "
+          f"({args.requests / elapsed:.0f} req/s), {total_failures} errors")
+    return not total_failures
+
+if __name__ == '__main__':
+    sys.exit(0 if main() else 1)
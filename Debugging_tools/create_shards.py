@@ -0,0 +1,78 @@
+#!/usr/bin/env python3
+"""
+Shard Schema Setup
+Creates empty shard databases on the local MySQL server from
+database_setup.sql (schema, functions, views and indexes, no sample
+policies) and copies the reference tables (Admin, Agent, Plan) from the
+home database into them.
+
+Usage:
+    python Debugging_tools/create_shards.py insurance_shard_1 insurance_shard_2
+"""
+
+import argparse
+import os
+import re
+import sys
+
+import mysql.connector
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, ROOT)
+
+import db
+
+SETUP_FILE = os.path.join(ROOT, 'database_setup.sql')
+REFERENCE_TABLES = ['Admin', 'Agent', 'Plan']
+
+def create_shard(cursor, name, home):
+    """Create (or recreate) one shard database and copy reference data into it"""
+    with open(SETUP_FILE, encoding='utf-8') as f:
+        script = re.sub(r'\binsurance_db\b', name, f.read())
+    for statement in db.split_statements(script):
+        # Sample policies belong to the home database only
+        if statement.upper().startswith('INSERT'):
+            continue
+        cursor.execute(statement)
+    for table in REFERENCE_TABLES:
+        cursor.execute(f"INSERT INTO `{name}`.{table} SELECT * FROM `{home}`.{table}")
+
+def main():
+    """Command line entry point"""
+    parser = argparse.ArgumentParser(description='Create local shard databases for testing DB_SHARDS')
+    parser.add_argument('names', nargs='+', help='Database names to create (existing ones are dropped)')
+    parser.add_argument('--first-codes', nargs='+',
+                        help='Lowest agency code per new shard (default: split the current agents evenly)')
+    args = parser.parse_args()
+
+    home = db.db_config['database']
+    try:
+        conn = mysql.connector.connect(**db.db_config)
+        cursor = conn.cursor()
+        for name in args.names:
+            print(f"Creating shard {name}...", end=" ")
+            create_shard(cursor, name, home)
+            conn.commit()
+            print("✓")
+
+        first_codes = args.first_codes
+        if not first_codes:
+            cursor.execute("SELECT Agency_code FROM Agent ORDER BY Agency_code")
+            agents = [row[0] for row in cursor.fetchall()]
+            count = len(args.names) + 1
+            first_codes = [agents[len(agents) * i // count] for i in range(1, count)] if agents else []
+        cursor.close()
+        conn.close()
+    except mysql.connector.Error as e:
+        print(f"✗ Database error: {e}")
+        return False
+
+    if len(first_codes) == len(args.names):
+        spec = ','.join([f'0000000={home}'] + [f'{code}={name}' for code, name in zip(first_codes, args.names)])
+        print("\nAdd to .env to route agents across the shards:")
+        print(f"  DB_SHARDS={spec}")
+        print("Existing policies stay on the home database; move an agent's rows before routing it elsewhere.")
+    return True
+
+if __name__ == '__main__':
+    sys.exit(0 if main() else 1)
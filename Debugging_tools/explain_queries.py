@@ -0,0 +1,486 @@
+#!/usr/bin/env python3
+"""
+Query Plan Regression Check
+Extracts the SQL passed to cursor.execute() in app.py and the modules it
+uses, to the helpers that run a caller's query (QUERY_HELPERS) and the named
+statements in statements.STATEMENTS, runs EXPLAIN FORMAT=JSON for each
+statement against the configured database, and flags full scans,
+filesorts, temporary tables and statements whose estimated rows examined
+exceed the budget. Writes a JSON report that can be compared against the
+report from an earlier commit.
+
+Before anything is explained, the check fails if a module that runs SQL is
+missing from the lists below or a function hands its query argument to
+execute() without being listed as a helper, since its statements would
+drop out of the suite unnoticed. --list only extracts, without a database.
+
+Usage:
+    python Debugging_tools/explain_queries.py --seed-policies 200000
+    python Debugging_tools/explain_queries.py --baseline plans-main.json --output plans.json
+    python Debugging_tools/explain_queries.py --list
+"""
+
+import argparse
+import ast
+import json
+import os
+import random
+import re
+import subprocess
+import sys
+from bisect import bisect_right
+from datetime import date, datetime, timedelta
+
+import mysql.connector
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, ROOT)
+
+import db
+import statements as registered
+from populate import CITIES, FIRST_NAMES, LAST_NAMES, OCCUPATIONS, RELATIONS
+from schedule import due_dates
+
+# Modules whose statements run while serving requests
+DEFAULT_FILES = ['app.py', 'reports.py', 'cube.py', 'jobs.py', 'policy_rules.py', 'bulk_import.py', 'db.py', 'payments.py', 'kpi.py', 'leaderboard.py', 'summary.py',
+                 'statements.py', 'rows.py', 'shards.py', 'audit.py', 'forecast.py', 'timeouts.py']
+# Offline batch tools, checked with --all
+BATCH_FILES = ['reconcile.py', 'archive.py', 'notices.py', 'snapshot.py']
+# Modules that run SQL this check does not cover, and why
+NOT_CHECKED = {'sqlite_backend.py': 'translates statements for SQLite, which has no EXPLAIN FORMAT=JSON'}
+
+# Functions that execute a query their caller passes in: (file, function) -> position of the query argument
+QUERY_HELPERS = {
+    ('rows.py', 'stream_records'): 1,
+    ('reconcile.py', 'stream'): 1,
+    ('jobs.py', '_execute'): 0,
+}
+# Statements registered by name and run with STATEMENTS[name]: file -> (dict name, the dict)
+REGISTRIES = {'statements.py': ('STATEMENTS', registered.STATEMENTS)}
+
+BUDGETS_FILE = os.path.join(os.path.dirname(os.path.abspath(__file__)), 'query_budgets.json')
+
+EXPLAINABLE = ('SELECT', 'UPDATE', 'DELETE', 'INSERT INTO', 'WITH')
+
+PLACEHOLDER = re.compile(r"(\w+)\)?\s*(=|>=|<=|<|>|LIKE)\s*%s|%s", re.IGNORECASE)
+
+#  SQL EXTRACTION
+
+def _resolve(node, names):
+    """Every string an expression can evaluate to, or [] when it is built at run time"""
+    if isinstance(node, ast.Constant) and isinstance(node.value, str):
+        return [node.value]
+    if isinstance(node, ast.Name):
+        return names.get(node.id, [])
+    if isinstance(node, ast.BinOp) and isinstance(node.op, ast.Add):
+        return [l + r for l in _resolve(node.left, names) for r in _resolve(node.right, names)]
+    if isinstance(node, ast.IfExp):
+        return _resolve(node.body, names) + _resolve(node.orelse, names)
+    if (isinstance(node, ast.Call) and isinstance(node.func, ast.Attribute)
+            and node.func.attr == 'format' and not node.args):
+        templates = _resolve(node.func.value, names)
+        values = {}
+        for kw in node.keywords:
+            options = _resolve(kw.value, names)
+            if kw.arg is None or not options:
+                return []
+            values[kw.arg] = options[0]
+        return [t.format(**values) for t in templates]
+    return []
+
+def _string_assignments(body, names):
+    """Collect NAME = <string expression> assignments, keeping every branch's value"""
+    for node in body:
+        for child in ast.walk(node):
+            if (isinstance(child, ast.Assign) and len(child.targets) == 1
+                    and isinstance(child.targets[0], ast.Name)):
+                values = _resolve(child.value, names)
+                if values:
+                    names.setdefault(child.targets[0].id, [])
+                    names[child.targets[0].id] += [v for v in values if v not in names[child.targets[0].id]]
+
+def _query_argument(call, filename):
+    """The expression a call passes as its SQL, None if it runs no query"""
+    func = call.func
+    owner = func.value.id if isinstance(func, ast.Attribute) and isinstance(func.value, ast.Name) else None
+    if owner and f'{owner}.py' in REGISTRIES:
+        position = None  # runs a registered statement by name, see coverage_problems()
+    elif isinstance(func, ast.Attribute) and func.attr in ('execute', 'executemany'):
+        position = 0
+    elif owner:
+        position = QUERY_HELPERS.get((filename if owner == 'self' else f'{owner}.py', func.attr))
+    elif isinstance(func, ast.Name):
+        position = QUERY_HELPERS.get((filename, func.id))
+    else:
+        position = None
+    return call.args[position] if position is not None and len(call.args) > position else None
+
+def _parameters(func):
+    return {a.arg for a in func.args.posonlyargs + func.args.args + func.args.kwonlyargs}
+
+def _passed_through(func, query, filename):
+    """Why a query that is not a literal is still covered, None if it is not"""
+    if isinstance(query, ast.Name) and query.id in _parameters(func) and (filename, func.name) in QUERY_HELPERS:
+        return 'helper'  # each caller's query is extracted where it is called
+    registry = REGISTRIES.get(filename)
+    if registry and isinstance(query, ast.Subscript) and isinstance(query.value, ast.Name) \
+            and query.value.id == registry[0]:
+        return 'registry'  # extracted from the dict itself
+    return None
+
+def registry_statements(filename):
+    """(query_id, function, line, sql) for each named statement a module registers"""
+    if filename not in REGISTRIES:
+        return []
+    dict_name, entries = REGISTRIES[filename]
+    with open(os.path.join(ROOT, filename), encoding='utf-8') as f:
+        tree = ast.parse(f.read(), filename=filename)
+    lines = {}
+    for node in tree.body:
+        if isinstance(node, ast.Assign) and any(isinstance(t, ast.Name) and t.id == dict_name for t in node.targets) \
+                and isinstance(node.value, ast.Dict):
+            lines = {key.value: key.lineno for key in node.value.keys if isinstance(key, ast.Constant)}
+    return [{'id': f"{filename}:{name}", 'function': name, 'line': lines.get(name), 'sql': ' '.join(sql.split())}
+            for name, sql in entries.items()]
+
+def extract_statements(path):
+    """(query_id, function, line, sql) for each statically known query in a file"""
+    with open(path, encoding='utf-8') as f:
+        tree = ast.parse(f.read(), filename=path)
+
+    module_names = {}
+    _string_assignments([n for n in tree.body if isinstance(n, ast.Assign)], module_names)
+
+    filename = os.path.relpath(path, ROOT)
+    statements, skipped = registry_statements(filename), []
+    functions = [n for n in ast.walk(tree) if isinstance(n, (ast.FunctionDef, ast.AsyncFunctionDef))]
+    for func in functions:
+        names = dict(module_names)
+        _string_assignments(func.body, names)
+        calls = sorted(((n, query) for n in ast.walk(func) if isinstance(n, ast.Call)
+                        for query in [_query_argument(n, filename)] if query is not None),
+                       key=lambda item: (item[0].lineno, item[0].col_offset))
+        for ordinal, (call, query) in enumerate(calls, start=1):
+            query_id = f"{filename}:{func.name}:{ordinal}"
+            if _passed_through(func, query, filename):
+                continue
+            sqls = _resolve(query, names)
+            if not sqls:
+                skipped.append({'id': query_id, 'line': call.lineno, 'reason': 'built at run time'})
+            for variant, sql in enumerate(sqls):
+                statements.append({
+                    'id': query_id + (f".{variant + 1}" if len(sqls) > 1 else ''),
+                    'function': func.name,
+                    'line': call.lineno,
+                    'sql': ' '.join(sql.split()),
+                })
+    return statements, skipped
+
+def coverage_problems(files):
+    """Query sources the suite would silently miss: unlisted modules and unknown helpers"""
+    problems = []
+    listed = set(DEFAULT_FILES) | set(BATCH_FILES)
+    for filename in sorted(f for f in os.listdir(ROOT) if f.endswith('.py')):
+        with open(os.path.join(ROOT, filename), encoding='utf-8') as f:
+            tree = ast.parse(f.read(), filename=filename)
+        calls = [n for n in ast.walk(tree) if isinstance(n, ast.Call) and _query_argument(n, filename) is not None]
+        if (calls or filename in REGISTRIES) and filename not in listed and filename not in NOT_CHECKED:
+            problems.append(f"{filename} runs SQL but is not in DEFAULT_FILES, BATCH_FILES or NOT_CHECKED")
+        if filename not in files:
+            continue
+        for func in (n for n in ast.walk(tree) if isinstance(n, (ast.FunctionDef, ast.AsyncFunctionDef))):
+            for call in (n for n in ast.walk(func) if isinstance(n, ast.Call)):
+                query = _query_argument(call, filename)
+                if isinstance(query, ast.Name) and query.id in _parameters(func) \
+                        and not _passed_through(func, query, filename):
+                    problems.append(f"{filename}:{func.name} runs the query its caller passes in; "
+                                    f"add it to QUERY_HELPERS")
+        # A statement run by a name the registry does not have would never be explained
+        for call in (n for n in ast.walk(tree) if isinstance(n, ast.Call) and isinstance(n.func, ast.Attribute)):
+            owner = call.func.value.id if isinstance(call.func.value, ast.Name) else None
+            registry = REGISTRIES.get(f'{owner}.py')
+            if registry and len(call.args) > 1 and isinstance(call.args[1], ast.Constant) \
+                    and call.args[1].value not in registry[1]:
+                problems.append(f"{filename}:{call.lineno} runs '{call.args[1].value}', "
+                                f"which is not in {owner}.{registry[0]}")
+    return problems
+
+#  PARAMETERS
+
+def load_samples(cursor):
+    """Representative parameter values taken from the data, biased towards the busiest agent"""
+    cursor.execute("""SELECT Agency_code FROM Policy GROUP BY Agency_code
+                      ORDER BY COUNT(*) DESC LIMIT 1""")
+    row = cursor.fetchone()
+    agent = row[0] if row else '1000001'
+    cursor.execute("""SELECT p.Policy_no, p.Plan_no, a.Admin_id, a.Branch_id, p.DOC
+                      FROM Policy p JOIN Agent a ON a.Agency_code = p.Agency_code
+                      WHERE p.Agency_code = %s ORDER BY p.Policy_no LIMIT 1""", (agent,))
+    row = cursor.fetchone() or ('100000001', '101', '10001', 'BR001', date.today())
+    policy_no, plan_no, admin_id, branch_id, doc = row
+    today = date.today()
+    return {
+        'policy_no': (policy_no, policy_no, str(int(policy_no) + 1000).zfill(9)),
+        'agency_code': (agent, agent, agent),
+        'owner': (agent, agent, agent),
+        'admin_id': (admin_id, admin_id, admin_id),
+        'branch_id': (branch_id, branch_id, branch_id),
+        'plan_no': (plan_no, plan_no, plan_no),
+        'timestamp': (today, today - timedelta(days=365), today),
+        'doc': (doc, today - timedelta(days=365), today),
+        'day': (today, today - timedelta(days=365), today),
+        'fup': (today, today - timedelta(days=30), today),
+        'status': (1, 0, 1),
+        'mode': ('Yearly', 'Yearly', 'Yearly'),
+        'cube': ('business', 'business', 'business'),
+    }
+
+def parameters(sql, samples):
+    """One value per %s, chosen by the column it is compared with"""
+    params = []
+    for match in PLACEHOLDER.finditer(sql):
+        column, op = (match.group(1) or '').lower(), match.group(2)
+        eq, low, high = samples.get(column, ('1', '1', '1'))
+        params.append(low if op in ('>', '>=') else high if op in ('<', '<=') else eq)
+    return params
+
+#  PLAN CHECKS
+
+def _tables(node):
+    """Yield every table access in a plan in join order"""
+    if isinstance(node, dict):
+        if 'table_name' in node and 'access_type' in node:
+            yield node
+        for value in node.values():
+            yield from _tables(value)
+    elif isinstance(node, list):
+        for item in node:
+            yield from _tables(item)
+
+def _flags(node, key):
+    """True if the key is set anywhere in the plan"""
+    if isinstance(node, dict):
+        return node.get(key) is True or any(_flags(v, key) for v in node.values())
+    if isinstance(node, list):
+        return any(_flags(item, key) for item in node)
+    return False
+
+def _rows_examined(node):
+    """Estimated rows read: each table's rows per scan times the rows joined before it"""
+    total = 0
+    if isinstance(node, dict):
+        for key, value in node.items():
+            if key == 'nested_loop':
+                prefix = 1
+                for entry in value:
+                    table = entry.get('table', {})
+                    total += prefix * table.get('rows_examined_per_scan', 0) + _rows_examined(
+                        {k: v for k, v in table.items() if k != 'table_name'})
+                    prefix *= max(table.get('rows_produced_per_join', 1), 1)
+            elif key == 'table' and isinstance(value, dict) and 'table_name' in value:
+                total += value.get('rows_examined_per_scan', 0) + _rows_examined(
+                    {k: v for k, v in value.items() if k != 'table_name'})
+            else:
+                total += _rows_examined(value)
+    elif isinstance(node, list):
+        total += sum(_rows_examined(item) for item in node)
+    return total
+
+def check_plan(plan, budget):
+    """Findings for one statement's plan"""
+    findings = []
+    allowed = set(budget.get('allow', []))
+    for table in _tables(plan):
+        rows = table.get('rows_examined_per_scan', 0)
+        if table['access_type'] == 'ALL' and rows >= budget['min_scan_rows']:
+            findings.append({'kind': 'full_scan', 'table': table['table_name'], 'rows': rows})
+        elif table['access_type'] == 'index' and rows >= budget['min_scan_rows']:
+            findings.append({'kind': 'full_index_scan', 'table': table['table_name'], 'rows': rows})
+    if _flags(plan, 'using_filesort'):
+        findings.append({'kind': 'filesort'})
+    if _flags(plan, 'using_temporary_table'):
+        findings.append({'kind': 'temporary_table'})
+    examined = _rows_examined(plan)
+    if budget['max_rows'] is not None and examined > budget['max_rows']:
+        findings.append({'kind': 'rows_over_budget', 'rows': examined, 'budget': budget['max_rows']})
+    return [f for f in findings if f['kind'] not in allowed], examined
+
+def finding_key(query_id, finding):
+    return f"{query_id}|{finding['kind']}|{finding.get('table', '')}"
+
+#  SEEDING
+
+def seed(conn, count, batch_size=1000):
+    """Append count synthetic policies with holders and payments so plans reflect a large book"""
+    cursor = conn.cursor()
+    cursor.execute("SELECT Agency_code FROM Agent")
+    agents = [row[0] for row in cursor.fetchall()]
+    cursor.execute("SELECT Plan_no FROM Plan")
+    plans = [row[0] for row in cursor.fetchall()]
+    if not agents or not plans:
+        print("✗ Seeding needs agents and plans; run populate.py first")
+        return False
+    cursor.execute("SELECT GREATEST(COALESCE((SELECT MAX(Policy_no) FROM Policy), 100000000), "
+                   "COALESCE((SELECT MAX(Policy_no) FROM Policy_Archive), 100000000))")
+    next_no = int(cursor.fetchone()[0]) + 1
+    modes = ['Yearly', 'Half-yearly', 'Quarterly', 'Monthly']
+    today = date.today()
+
+    print(f"Seeding {count} policies...")
+    created = 0
+    while created < count:
+        policies, holders, payments = [], [], []
+        for _ in range(min(batch_size, count - created)):
+            policy_no = str(next_no).zfill(9)
+            next_no += 1
+            doc = today - timedelta(days=random.randint(0, 365 * 6))
+            mode, term = random.choice(modes), random.choice([5, 10, 15, 20])
+            sum_assured = random.randint(5, 50) * 100000
+            premium = round(sum_assured / term / {'Yearly': 1, 'Half-yearly': 2, 'Quarterly': 4, 'Monthly': 12}[mode], 2)
+            dates = due_dates(doc, mode, term)
+            due = bisect_right(dates, today)
+            paid = random.randint(int(due * 0.7), due)
+            fup = dates[paid] if paid < len(dates) else None
+            policies.append((policy_no, random.choice(plans), random.choice(agents), premium, doc, fup,
+                             1 if fup else 0, mode, term, sum_assured))
+            city, state, pincode = random.choice(CITIES)
+            holders.append((policy_no, f"{random.choice(FIRST_NAMES)} {random.choice(LAST_NAMES)}",
+                            f"{random.randint(1, 999)} Main Road", city, state, pincode,
+                            random.choice(FIRST_NAMES), random.choice(RELATIONS), random.choice(['Male', 'Female']),
+                            random.choice(OCCUPATIONS), doc - timedelta(days=random.randint(20, 50) * 365), 'Graduate'))
+            payments += [(policy_no, random.choice(['Cash', 'Cheque', 'Online', 'Card']),
+                          datetime.combine(d, datetime.min.time()) + timedelta(days=random.randint(0, 5)), premium)
+                         for d in dates[:paid]]
+        cursor.executemany("""INSERT INTO Policy (Policy_no, Plan_no, Agency_code, Premium, DOC, FUP, Status, Mode, Term, Sum_Assured)
+                              VALUES (%s, %s, %s, %s, %s, %s, %s, %s, %s, %s)""", policies)
+        cursor.executemany("""INSERT INTO Policy_Holder (Policy_no, Name, Address, City, State, Pincode,
+                              Nominee_Name, Nominee_Relation, Gender, Occupation, DOB, Education)
+                              VALUES (%s, %s, %s, %s, %s, %s, %s, %s, %s, %s, %s, %s)""", holders)
+        if payments:
+            cursor.executemany("""INSERT INTO Payment (Policy_no, Payment_Mode, Timestamp, Amount)
+                                  VALUES (%s, %s, %s, %s)""", payments)
+        conn.commit()
+        created += len(policies)
+        print(f"  ✓ {created} policies seeded")
+    cursor.execute("ANALYZE TABLE Policy, Policy_Holder, Payment")
+    cursor.fetchall()
+    cursor.close()
+    return True
+
+#  RUN
+
+def load_budgets(path, max_rows, min_scan_rows):
+    """Default budget plus per-query overrides keyed by query id"""
+    overrides = {}
+    if path and os.path.exists(path):
+        with open(path, encoding='utf-8') as f:
+            overrides = json.load(f)
+    default = {'max_rows': max_rows, 'min_scan_rows': min_scan_rows, 'allow': []}
+    return lambda query_id: {**default, **overrides.get(query_id.split('.')[0], {})}
+
+def git_commit():
+    try:
+        return subprocess.run(['git', 'rev-parse', '--short', 'HEAD'], cwd=ROOT, capture_output=True,
+                              text=True, check=True).stdout.strip()
+    except (OSError, subprocess.CalledProcessError):
+        return None
+
+def run(conn, files, budget_for, baseline_keys=None):
+    """EXPLAIN every extracted statement, returns the report dict"""
+    cursor = conn.cursor()
+    samples = load_samples(cursor)
+    report = {'commit': git_commit(), 'generated_at': datetime.now().isoformat(timespec='seconds'),
+              'queries': [], 'skipped': [], 'failures': 0}
+
+    for name in files:
+        statements, skipped = extract_statements(os.path.join(ROOT, name))
+        report['skipped'] += skipped
+        for stmt in statements:
+            if not stmt['sql'].upper().startswith(EXPLAINABLE) or (
+                    stmt['sql'].upper().startswith('INSERT') and ' SELECT ' not in stmt['sql'].upper()):
+                continue
+            entry = dict(stmt)
+            try:
+                cursor.execute("EXPLAIN FORMAT=JSON " + stmt['sql'], parameters(stmt['sql'], samples))
+                plan = json.loads(cursor.fetchone()[0])
+            except mysql.connector.Error as e:
+                entry.update(status='error', error=str(e), findings=[])
+                report['failures'] += 1
+                report['queries'].append(entry)
+                continue
+
+            findings, examined = check_plan(plan, budget_for(stmt['id']))
+            for finding in findings:
+                finding['new'] = baseline_keys is None or finding_key(stmt['id'], finding) not in baseline_keys
+            failed = any(f['new'] for f in findings)
+            report['failures'] += failed
+            entry.update(status='fail' if failed else 'ok', findings=findings, rows_examined=examined,
+                         query_cost=float(plan.get('query_block', {}).get('cost_info', {}).get('query_cost', 0)))
+            report['queries'].append(entry)
+    cursor.close()
+    return report
+
+def main():
+    """Command line entry point"""
+    parser = argparse.ArgumentParser(description='Check query plans of the application SQL')
+    parser.add_argument('--output', default='query_plans.json', help='Where to write the JSON report')
+    parser.add_argument('--baseline', help='Earlier report; only findings missing from it fail the run')
+    parser.add_argument('--budgets', default=BUDGETS_FILE, help='Per-query budget overrides (JSON)')
+    parser.add_argument('--max-rows', type=int, default=10000, help='Estimated rows examined per statement')
+    parser.add_argument('--min-scan-rows', type=int, default=1000,
+                        help='Full scans of tables smaller than this are not reported')
+    parser.add_argument('--seed-policies', type=int, default=0, help='Seed this many synthetic policies first')
+    parser.add_argument('--all', action='store_true', help='Also check the offline batch tools')
+    parser.add_argument('--list', action='store_true', help='Only list the extracted statements, no database needed')
+    args = parser.parse_args()
+
+    files = DEFAULT_FILES + (BATCH_FILES if args.all else [])
+    problems = coverage_problems(files)
+    for problem in problems:
+        print(f"  ✗ {problem}")
+    if args.list:
+        total = skipped = 0
+        for name in files:
+            statements, missed = extract_statements(os.path.join(ROOT, name))
+            total, skipped = total + len(statements), skipped + len(missed)
+            for stmt in statements:
+                print(f"  {stmt['id']}: {stmt['sql'][:90]}")
+            for entry in missed:
+                print(f"  - {entry['id']} (line {entry['line']}): {entry['reason']}")
+        print(f"\n{total} statements extracted, {skipped} built at run time, {len(problems)} coverage problems")
+        return not problems
+    if problems:
+        print("✗ Some query sources would not be checked")
+        return False
+
+    baseline_keys = None
+    if args.baseline:
+        with open(args.baseline, encoding='utf-8') as f:
+            baseline = json.load(f)
+        baseline_keys = {finding_key(q['id'], f) for q in baseline['queries'] for f in q['findings']}
+
+    try:
+        conn = mysql.connector.connect(**db.db_config)
+    except mysql.connector.Error as e:
+        print(f"✗ Database error: {e}")
+        return False
+    try:
+        if args.seed_policies and not seed(conn, args.seed_policies):
+            return False
+        report = run(conn, files, load_budgets(args.budgets, args.max_rows, args.min_scan_rows), baseline_keys)
+    finally:
+        conn.close()
+
+    with open(args.output, 'w', encoding='utf-8') as f:
+        json.dump(report, f, indent=2, default=str)
+
+    for query in report['queries']:
+        mark = '✓' if query['status'] == 'ok' else '✗'
+        detail = ', '.join(f['kind'] + (f" ({f['table']})" if 'table' in f else '') for f in query['findings'])
+        print(f"  {mark} {query['id']}" + (f" - {query.get('error') or detail}" if detail or query['status'] == 'error' else ''))
+    print(f"\n{len(report['queries'])} statements checked, {len(report['skipped'])} built at run time, "
+          f"{report['failures']} failing. Report written to {args.output}")
+    return report['failures'] == 0
+
+if __name__ == '__main__':
+    sys.exit(0 if main() else 1)
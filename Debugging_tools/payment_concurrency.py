@@ -0,0 +1,214 @@
+#!/usr/bin/env python3
+"""
+Payment Concurrency Check
+Issues a few throw-away monthly policies, then pays them from many threads
+at once (including repeated idempotency keys) and checks that every policy
+ends with exactly one payment per key and the FUP that many installments
+on. Also reports sustained throughput, optionally against a run where all
+payments are serialised on one global lock.
+
+The run happens in a scratch database (<DB_NAME>_payment_check) created
+from database_setup.sql with the reference tables copied in, and dropped
+afterwards, so the test policies and payments never reach the real
+database's cube, audit log or leaderboard. The MySQL user needs CREATE and
+DROP on it.
+
+Usage:
+    python Debugging_tools/payment_concurrency.py --policies 10 --payments 40 --threads 32 --compare
+"""
+
+import argparse
+import os
+import queue
+import random
+import sys
+import threading
+import time
+import uuid
+from datetime import date
+
+import mysql.connector
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, ROOT)
+
+import db
+import payments
+import shards
+from create_shards import create_shard
+from policy_rules import allocate_policy_numbers
+from schedule import installments
+
+PREMIUM = 1000
+TERM = 40  # 480 monthly installments, more than any run pays
+
+def create_policies(conn, agent, count, policy_start):
+    """Issue throw-away monthly policies for the agent, returns (policy_no, first FUP) pairs"""
+    cursor = conn.cursor()
+    conn.start_transaction()
+    cursor.execute("SELECT Plan_no FROM Plan ORDER BY Plan_no LIMIT 1")
+    plan_no = cursor.fetchone()[0]
+    doc = date.today()
+    policy_nos = allocate_policy_numbers(cursor, count, policy_start)
+    cursor.executemany("""INSERT INTO Policy (Policy_no, Plan_no, Agency_code, Premium, DOC, FUP, Status, Mode, Term, Sum_Assured)
+                          VALUES (%s, %s, %s, %s, %s, %s, 1, 'Monthly', %s, %s)""",
+                       [(policy_no, plan_no, agent, PREMIUM, doc, doc, TERM, PREMIUM * 12 * TERM) for policy_no in policy_nos])
+    conn.commit()
+    cursor.close()
+    return [(policy_no, doc) for policy_no in policy_nos]
+
+def create_scratch(shard):
+    """A throw-away copy of the shard's schema and reference data, returns its connection config"""
+    name = f"{db.db_config['database']}_payment_check"
+    conn = mysql.connector.connect(**shard.config)
+    cursor = conn.cursor()
+    try:
+        create_shard(cursor, name, shard.config['database'])
+        conn.commit()
+    finally:
+        cursor.close()
+        conn.close()
+    return dict(shard.config, database=name)
+
+def drop_scratch(config):
+    conn = mysql.connector.connect(**{key: value for key, value in config.items() if key != 'database'})
+    cursor = conn.cursor()
+    try:
+        cursor.execute(f"DROP DATABASE IF EXISTS `{config['database']}`")
+    finally:
+        cursor.close()
+        conn.close()
+
+def run(config, agent, tasks, threads, serialize):
+    """Pay every (policy_no, key) task from a pool of threads, returns (results, errors, seconds)"""
+    work = queue.Queue()
+    for task in tasks:
+        work.put(task)
+    results, errors = [], []
+    lock = threading.Lock()
+
+    def worker():
+        conn = mysql.connector.connect(**config)
+        cursor = conn.cursor()
+        try:
+            while True:
+                try:
+                    policy_no, key = work.get_nowait()
+                except queue.Empty:
+                    return
+                try:
+                    if serialize:
+                        cursor.execute("SELECT GET_LOCK('premium_payments', 60)")
+                        cursor.fetchall()
+                        # The lock belongs to the session; end the statement's transaction before paying
+                        conn.commit()
+                    try:
+                        payment = payments.record_payment(conn, policy_no, agent, PREMIUM, 'Online', key=key)
+                    finally:
+                        if serialize:
+                            cursor.execute("SELECT RELEASE_LOCK('premium_payments')")
+                            cursor.fetchall()
+                            conn.commit()
+                    with lock:
+                        results.append((policy_no, key, payment))
+                except (payments.PaymentError, mysql.connector.Error) as e:
+                    with lock:
+                        errors.append((policy_no, key, e))
+        finally:
+            cursor.close()
+            conn.close()
+
+    started = time.perf_counter()
+    pool = [threading.Thread(target=worker) for _ in range(threads)]
+    for t in pool:
+        t.start()
+    for t in pool:
+        t.join()
+    return results, errors, time.perf_counter() - started
+
+def verify(conn, policies, tasks, results):
+    """Check payment counts and FUP per policy, returns the number of mismatches"""
+    cursor = conn.cursor()
+    keys = {}
+    for policy_no, key in tasks:
+        keys.setdefault(policy_no, set()).add(key)
+    duplicates = sum(1 for _, _, payment in results if payment.duplicate)
+
+    mismatches = 0
+    for policy_no, first_fup in policies:
+        cursor.execute("SELECT COUNT(*) FROM Payment WHERE Policy_no = %s", (policy_no,))
+        paid = cursor.fetchone()[0]
+        cursor.execute("SELECT FUP FROM Policy WHERE Policy_no = %s", (policy_no,))
+        fup = cursor.fetchone()[0]
+        expected_paid = len(keys.get(policy_no, ()))
+        schedule = list(installments(first_fup, 'Monthly', TERM, start=first_fup))
+        expected_fup = schedule[expected_paid] if expected_paid < len(schedule) else None
+        if paid != expected_paid or fup != expected_fup:
+            mismatches += 1
+            print(f"  ✗ {policy_no}: {paid} payments (expected {expected_paid}), FUP {fup} (expected {expected_fup})")
+    cursor.close()
+    print(f"  ✓ {duplicates} repeated submits answered from their idempotency key")
+    return mismatches
+
+def main():
+    """Command line entry point"""
+    parser = argparse.ArgumentParser(description='Pay policies concurrently and check FUP stays correct')
+    parser.add_argument('--agent', help='Agency code to issue the test policies under (default: first agent)')
+    parser.add_argument('--policies', type=int, default=10, help='Test policies to issue')
+    parser.add_argument('--payments', type=int, default=40, help='Distinct payments per policy')
+    parser.add_argument('--repeat', type=float, default=0.2, help='Share of payments submitted twice')
+    parser.add_argument('--threads', type=int, default=32)
+    parser.add_argument('--compare', action='store_true', help='Also run with one global lock for comparison')
+    parser.add_argument('--keep', action='store_true', help='Keep the scratch database afterwards')
+    args = parser.parse_args()
+
+    try:
+        home = shards.connect(shards.SHARDS[0])
+        cursor = home.cursor()
+        cursor.execute("SELECT Agency_code FROM Agent ORDER BY Agency_code LIMIT 1")
+        row = cursor.fetchone()
+        cursor.close()
+        home.close()
+    except mysql.connector.Error as e:
+        print(f"✗ Database error: {e}")
+        return False
+    agent = args.agent or (row[0] if row else None)
+    if not agent:
+        print("✗ No agent to issue test policies under; run populate.py first")
+        return False
+    shard = shards.shard_for(agent)
+    try:
+        config = create_scratch(shard)
+    except mysql.connector.Error as e:
+        print(f"✗ Could not create the scratch database: {e}")
+        return False
+    print(f"Running in scratch database {config['database']}")
+
+    ok = True
+    conn = mysql.connector.connect(**config)
+    try:
+        modes = [('row lock', False)] + ([('global lock', True)] if args.compare else [])
+        for label, serialize in modes:
+            policies = create_policies(conn, agent, args.policies, shard.policy_start)
+            tasks = [(policy_no, uuid.uuid4().hex) for policy_no, _ in policies for _ in range(args.payments)]
+            tasks += random.sample(tasks, int(len(tasks) * args.repeat))
+            random.shuffle(tasks)
+
+            print(f"\n{label}: {len(tasks)} submits over {len(policies)} policies from {args.threads} threads")
+            results, errors, seconds = run(config, agent, tasks, args.threads, serialize)
+            for policy_no, _, e in errors[:5]:
+                print(f"  ✗ {policy_no}: {e}")
+            mismatches = verify(conn, policies, tasks, results)
+            ok = ok and not errors and not mismatches
+            print(f"  {'✓' if not mismatches else '✗'} {len(policies) - mismatches}/{len(policies)} policies with correct FUP")
+            print(f"  ✓ {len(results) / seconds:,.0f} payments/s ({len(errors)} failed) in {seconds:.2f}s")
+    finally:
+        conn.close()
+        if args.keep:
+            print(f"Scratch database {config['database']} kept")
+        else:
+            drop_scratch(config)
+    return ok
+
+if __name__ == '__main__':
+    sys.exit(0 if main() else 1)
@@ -0,0 +1,160 @@
+#!/usr/bin/env python3
+"""
+Prepared Statement Benchmark
+Runs the login lookup and the payment statements (statements.py) from many
+threads against MySQL, once as plain text queries and once with prepared
+cursors, and reports queries per second for each. Every thread borrows a
+connection from a db.SessionPool per request, as the app does, so the
+prepared run also shows statements staying prepared across requests: the
+server's Com_stmt_prepare count should end near one per statement and
+connection. Payments run inside a transaction that is rolled back, so the
+data is left as it was (apart from Payment_id auto-increment gaps).
+
+Usage:
+    python Debugging_tools/prepared_benchmark.py --threads 8 --seconds 10
+"""
+
+import argparse
+import os
+import random
+import sys
+import threading
+import time
+from datetime import datetime
+
+import mysql.connector
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, ROOT)
+
+import db
+import shards
+import statements
+
+STATUS_COUNTERS = ('Com_stmt_prepare', 'Com_stmt_execute', 'Com_select', 'Questions')
+
+def load_keys(conn, limit):
+    """Sample admin ids, agent codes and active (policy_no, premium) pairs to run the statements with"""
+    cursor = conn.cursor()
+    keys = {}
+    cursor.execute("SELECT Admin_id FROM Admin LIMIT %s", (limit,))
+    keys['admins'] = [row[0] for row in cursor.fetchall()]
+    cursor.execute("SELECT Agency_code FROM Agent LIMIT %s", (limit,))
+    keys['agents'] = [row[0] for row in cursor.fetchall()]
+    cursor.execute("SELECT Policy_no, Premium FROM Policy WHERE Status = 1 AND FUP IS NOT NULL LIMIT %s", (limit,))
+    keys['policies'] = cursor.fetchall()
+    cursor.close()
+    conn.commit()
+    return keys
+
+def login(conn, keys, rng):
+    """One login lookup; 1 statement"""
+    if rng.random() < 0.5 and keys['admins']:
+        statements.fetch_one(conn, 'admin_login', (rng.choice(keys['admins']),))
+    else:
+        statements.fetch_one(conn, 'agent_login', (rng.choice(keys['agents']),))
+    return 1
+
+def payment(conn, keys, rng):
+    """The statements of one payment, rolled back; 4 statements"""
+    policy_no, premium = rng.choice(keys['policies'])
+    conn.start_transaction()
+    try:
+        statements.fetch_one(conn, 'lock_policy', (policy_no,))
+        statements.execute(conn, 'insert_payment', (policy_no, 'Cash', datetime.now(), premium))
+        next_fup = statements.fetch_one(conn, 'next_fup', (policy_no,))['Next_FUP']
+        statements.execute(conn, 'advance_fup', (next_fup, 1 if next_fup else 0, policy_no))
+    finally:
+        conn.rollback()
+    return 4
+
+PATHS = {'login': login, 'payment': payment}
+
+def server_status(config):
+    """The server's statement counters"""
+    conn = mysql.connector.connect(**config)
+    cursor = conn.cursor()
+    cursor.execute("SHOW GLOBAL STATUS WHERE Variable_name IN (%s, %s, %s, %s)", STATUS_COUNTERS)
+    status = {name: int(value) for name, value in cursor.fetchall()}
+    cursor.close()
+    conn.close()
+    return status
+
+def run(config, path, keys, threads, seconds, prepared):
+    """Drive one path from every thread for `seconds`, returns (requests, queries, errors, elapsed)"""
+    statements.PREPARED = prepared
+    pool = db.SessionPool(pool_name=f"bench_{path}_{'prepared' if prepared else 'text'}_{os.getpid()}",
+                          pool_size=threads, **config)
+    stop = time.monotonic() + seconds
+    totals = {'requests': 0, 'queries': 0, 'errors': 0}
+    lock = threading.Lock()
+
+    def worker(seed):
+        rng = random.Random(seed)
+        requests = queries = errors = 0
+        while time.monotonic() < stop:
+            conn = pool.get_connection()
+            try:
+                queries += PATHS[path](conn, keys, rng)
+                requests += 1
+            except mysql.connector.Error:
+                errors += 1
+            finally:
+                conn.close()
+        with lock:
+            totals['requests'] += requests
+            totals['queries'] += queries
+            totals['errors'] += errors
+
+    started = time.monotonic()
+    workers = [threading.Thread(target=worker, args=(seed,)) for seed in range(threads)]
+    for thread in workers:
+        thread.start()
+    for thread in workers:
+        thread.join()
+    return totals['requests'], totals['queries'], totals['errors'], time.monotonic() - started
+
+def main():
+    """Command line entry point"""
+    parser = argparse.ArgumentParser(description='Compare text and prepared statements on the login and payment paths')
+    parser.add_argument('--threads', type=int, default=8)
+    parser.add_argument('--seconds', type=float, default=10.0, help='Duration of each run')
+    parser.add_argument('--paths', nargs='+', choices=list(PATHS), default=list(PATHS))
+    parser.add_argument('--sample', type=int, default=1000, help='Ids and policies sampled to run the statements with')
+    args = parser.parse_args()
+
+    if db.BACKEND != 'mysql':
+        print("✗ Prepared statements are a MySQL feature; unset DB_BACKEND")
+        return False
+    config = shards.SHARDS[0].config
+    try:
+        conn = mysql.connector.connect(**config)
+        keys = load_keys(conn, args.sample)
+        conn.close()
+    except mysql.connector.Error as e:
+        print(f"✗ Database error: {e}")
+        return False
+    if not keys['agents'] or not keys['policies']:
+        print("✗ No agents or active policies to run the statements with; run populate.py first")
+        return False
+
+    ok = True
+    print(f"{'path':<10}{'mode':<10}{'queries/s':>12}{'requests/s':>12}{'prepares':>10}{'errors':>8}")
+    for path in args.paths:
+        rates = {}
+        for prepared in (False, True):
+            before = server_status(config)
+            requests, queries, errors, elapsed = run(config, path, keys, args.threads, args.seconds, prepared)
+            after = server_status(config)
+            # Global counters: other clients of the server add to them too
+            prepares = after['Com_stmt_prepare'] - before['Com_stmt_prepare']
+            rates[prepared] = queries / elapsed
+            ok = ok and not errors
+            print(f"{path:<10}{'prepared' if prepared else 'text':<10}{queries / elapsed:>12,.0f}"
+                  f"{requests / elapsed:>12,.0f}{prepares:>10,}{errors:>8}")
+        print(f"  {'✓' if rates[True] >= rates[False] else '✗'} {path}: prepared runs at "
+              f"{rates[True] / rates[False]:.2f}x the text rate")
+    return ok
+
+if __name__ == '__main__':
+    sys.exit(0 if main() else 1)
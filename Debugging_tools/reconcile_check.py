@@ -0,0 +1,80 @@
+#!/usr/bin/env python3
+"""
+Reconciliation Check
+Runs reconcile_policy() on policies as the app issues and pays them: first
+FUP set FIRST_DUE_DAYS after DOC, then stepped the way SEL() steps it for
+every payment. A freshly issued policy, one paid up to date and one paid to
+maturity must reconcile; one with missed installments must be in arrears by
+exactly that many. Needs no database.
+
+Usage:
+    python Debugging_tools/reconcile_check.py
+"""
+
+import os
+import sys
+from datetime import date, timedelta
+from decimal import Decimal
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, ROOT)
+
+from reconcile import reconcile_policy
+from schedule import MODE_MONTHS, add_months, first_due, maturity_date
+
+PREMIUM = Decimal('1000.00')
+TERM = 5
+# Month ends and a leap day, where DATE_ADD clamps the day
+DOCS = [date(2024, 1, 31), date(2024, 2, 29), date(2023, 8, 31), date(2024, 6, 15)]
+
+def pay(doc, mode, term, count):
+    """FUP and Status after `count` payments, stepped like SEL()"""
+    fup, maturity = first_due(doc), maturity_date(doc, term)
+    for _ in range(count):
+        fup = add_months(fup, MODE_MONTHS[mode])
+        if fup >= maturity:
+            return None, 0
+    return fup, 1
+
+def due_by(doc, mode, term, as_of):
+    """Installments billed by as_of, counted by stepping FUP"""
+    count, fup = 0, first_due(doc)
+    while fup is not None and fup <= as_of:
+        count += 1
+        fup, _ = pay(doc, mode, term, count)
+    return count
+
+def check(label, doc, mode, as_of, paid, expect_arrears):
+    fup, status = pay(doc, mode, TERM, paid)
+    policy = ('100000001', '1000001', doc, mode, TERM, PREMIUM, fup, status)
+    row = reconcile_policy(policy, paid, PREMIUM * paid, as_of)
+    issues = row['Issues'] if row else ''
+    arrears = row['Arrears_count'] if row else 0
+    passed = issues == ('arrears' if expect_arrears else '') and arrears == expect_arrears
+    if not passed:
+        print(f"  ✗ {label}: {mode} policy of {doc}, {paid} paid as of {as_of}: "
+              f"issues '{issues}', {arrears} in arrears (expected {expect_arrears})")
+    return passed
+
+def main():
+    """Command line entry point"""
+    ok = True
+    checked = 0
+    for doc in DOCS:
+        for mode in MODE_MONTHS:
+            cases = [('freshly issued', doc, 0, 0)]
+            for as_of in (doc + timedelta(days=400), doc + timedelta(days=1000)):
+                due = due_by(doc, mode, TERM, as_of)
+                cases.append(('paid up to date', as_of, due, 0))
+                if due >= 2:
+                    cases.append(('two installments missed', as_of, due - 2, 2))
+            maturity = maturity_date(doc, TERM)
+            cases.append(('paid to maturity', maturity, due_by(doc, mode, TERM, maturity), 0))
+            for label, as_of, paid, arrears in cases:
+                ok = check(label, doc, mode, as_of, paid, arrears) and ok
+                checked += 1
+    print(f"✓ {checked} policies reconciled as expected" if ok else "✗ Some policies did not reconcile as expected")
+    return ok
+
+if __name__ == '__main__':
+    sys.exit(0 if main() else 1)
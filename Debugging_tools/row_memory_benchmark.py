@@ -0,0 +1,155 @@
+#!/usr/bin/env python3
+"""
+Row Memory Benchmark
+Compares peak RSS of the /policies and /payments views when rows are
+fetched as dictionaries, as compact records, or streamed as records while
+the template renders. Each run happens in a fresh process so peak RSS is
+not inherited from the previous one.
+
+Usage:
+    python Debugging_tools/row_memory_benchmark.py --agent 1000001
+    python Debugging_tools/row_memory_benchmark.py --synthetic 50000
+"""
+
+import argparse
+import json
+import os
+import resource
+import subprocess
+import sys
+import time
+from datetime import date, datetime, timedelta
+from decimal import Decimal
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, ROOT)
+
+MODES = ['dict', 'records', 'stream']
+
+# Same statements as the routes in app.py
+VIEWS = {
+    'policies': {
+        'template': 'policies.html',
+        'query': """SELECT p.*, pl.Name as Plan_Name, ph.Name as Holder_Name
+                    FROM Policy p
+                    JOIN Plan pl ON p.Plan_no = pl.Plan_no
+                    LEFT JOIN Policy_Holder ph ON p.Policy_no = ph.Policy_no
+                    WHERE p.Agency_code = %s ORDER BY p.Policy_no DESC""",
+        'columns': ('Policy_no', 'Plan_no', 'Agency_code', 'Premium', 'DOC', 'FUP', 'Status', 'Mode',
+                    'Term', 'Sum_Assured', 'Created_at', 'Plan_Name', 'Holder_Name'),
+    },
+    'payments': {
+        'template': 'payments.html',
+        'query': """SELECT p.Policy_no, p.Premium, p.FUP, p.Status, ph.Name as Holder_Name
+                    FROM Policy p
+                    JOIN Policy_Holder ph ON p.Policy_no = ph.Policy_no
+                    WHERE p.Agency_code = %s AND p.Status = 1 AND p.FUP IS NOT NULL
+                    ORDER BY p.FUP""",
+        'columns': ('Policy_no', 'Premium', 'FUP', 'Status', 'Holder_Name'),
+    },
+}
+
+def peak_rss_kb():
+    """Peak resident set size of this process in KB"""
+    peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    return peak // 1024 if sys.platform == 'darwin' else peak
+
+def synthetic_rows(view, count):
+    """Generated result tuples shaped like the view's query"""
+    today = date.today()
+    for i in range(count):
+        values = {
+            'Policy_no': str(100000001 + i).zfill(9), 'Plan_no': '101', 'Agency_code': '1000001',
+            'Premium': Decimal('12345.67'), 'DOC': today - timedelta(days=i % 2000),
+            'FUP': today + timedelta(days=i % 365), 'Status': 1, 'Mode': 'Yearly', 'Term': 20,
+            'Sum_Assured': Decimal('500000.00'), 'Created_at': datetime.now(),
+            'Plan_Name': 'Term Life Insurance', 'Holder_Name': f'Holder {i}',
+        }
+        yield tuple(values[c] for c in VIEWS[view]['columns'])
+
+def run_one(view, mode, agent, synthetic):
+    """Fetch and render one view in this process, returns the measurements"""
+    import app
+    import db
+    import rows
+    from flask import render_template
+
+    baseline = peak_rss_kb()
+    started = time.perf_counter()
+    spec = VIEWS[view]
+    conn = cursor = None
+
+    if synthetic:
+        data = synthetic_rows(view, synthetic)
+        if mode == 'dict':
+            data = [dict(zip(spec['columns'], row)) for row in data]
+        else:
+            make = rows.record_type(spec['columns'])._make
+            data = (make(row) for row in data) if mode == 'stream' else [make(row) for row in data]
+    else:
+        import mysql.connector
+        conn = mysql.connector.connect(**db.db_config)
+        cursor = conn.cursor(dictionary=(mode == 'dict'))
+        cursor.execute(spec['query'], (agent,))
+        if mode == 'dict':
+            data = cursor.fetchall()
+        elif mode == 'records':
+            data = rows.fetch_records(cursor)
+        else:
+            data = rows.iter_records(cursor)
+    fetched = peak_rss_kb()
+
+    with app.app.test_request_context():
+        html = render_template(spec['template'], policies=data)
+    if cursor is not None:
+        cursor.close()
+        conn.close()
+
+    return {
+        'view': view,
+        'mode': mode,
+        'bytes': len(html),
+        'seconds': round(time.perf_counter() - started, 3),
+        'fetch_kb': fetched - baseline,
+        'peak_kb': peak_rss_kb() - baseline,
+    }
+
+def main():
+    """Command line entry point"""
+    parser = argparse.ArgumentParser(description='Compare peak RSS of dict rows and compact records')
+    parser.add_argument('--agent', default='1000001', help='Agency code whose pages are rendered')
+    parser.add_argument('--synthetic', type=int, default=0,
+                        help='Render this many generated rows instead of querying the database')
+    parser.add_argument('--views', nargs='+', default=list(VIEWS), choices=list(VIEWS))
+    parser.add_argument('--json', help='Also write the results to this file')
+    parser.add_argument('--worker', nargs=2, metavar=('VIEW', 'MODE'), help=argparse.SUPPRESS)
+    args = parser.parse_args()
+
+    if args.worker:
+        print(json.dumps(run_one(args.worker[0], args.worker[1], args.agent, args.synthetic)))
+        return True
+
+    source = f"{args.synthetic} synthetic rows" if args.synthetic else f"agent {args.agent}"
+    print(f"Row memory benchmark ({source})")
+    print(f"  {'view':<10}{'mode':<10}{'fetch MB':>10}{'peak MB':>10}{'seconds':>10}{'page KB':>10}")
+    results = []
+    for view in args.views:
+        for mode in MODES:
+            cmd = [sys.executable, os.path.abspath(__file__), '--agent', args.agent,
+                   '--synthetic', str(args.synthetic), '--worker', view, mode]
+            proc = subprocess.run(cmd, capture_output=True, text=True)
+            if proc.returncode != 0:
+                print(f"  ✗ {view}/{mode} failed: {proc.stderr.strip().splitlines()[-1] if proc.stderr else ''}")
+                return False
+            r = json.loads(proc.stdout.strip().splitlines()[-1])
+            results.append(r)
+            print(f"  {view:<10}{mode:<10}{r['fetch_kb'] / 1024:>10.1f}{r['peak_kb'] / 1024:>10.1f}"
+                  f"{r['seconds']:>10.2f}{r['bytes'] / 1024:>10.0f}")
+
+    if args.json:
+        with open(args.json, 'w', encoding='utf-8') as f:
+            json.dump(results, f, indent=2)
+    return True
+
+if __name__ == '__main__':
+    sys.exit(0 if main() else 1)
@@ -0,0 +1,66 @@
+#!/usr/bin/env python3
+"""
+Schedule Cache Check
+Calls upcoming() and remaining() the way the pay page and the schedule API
+do, for policies whose FUP was set by first_due() and stepped by payments,
+and checks that they are answered from the cached due_dates() calendar:
+installments() must not be called once the calendar is cached, and the
+results must match dates generated from FUP itself. Needs no database.
+
+Usage:
+    python Debugging_tools/schedule_check.py
+"""
+
+import os
+import sys
+from datetime import date
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, ROOT)
+
+import schedule
+
+TERM = 10
+# Month ends and a leap day, where DATE_ADD clamps the day
+DOCS = [date(2024, 1, 31), date(2024, 2, 29), date(2023, 8, 31), date(2024, 6, 15)]
+
+def expected(doc, mode, fup):
+    """Upcoming dates generated from FUP without the cache"""
+    return list(schedule.installments(doc, mode, TERM, start=fup))
+
+def main():
+    """Command line entry point"""
+    generate = schedule.installments
+    generated = []
+
+    def counting(*args, **kwargs):
+        generated.append(args)
+        return generate(*args, **kwargs)
+
+    ok = True
+    checked = 0
+    for doc in DOCS:
+        for mode in schedule.MODE_MONTHS:
+            dates = schedule.due_dates(doc, mode, TERM)  # cached the way the first lookup would
+            # Freshly issued, part paid and on the last installment
+            for paid in (0, len(dates) // 2, len(dates) - 1):
+                fup = dates[paid] if paid else schedule.first_due(doc)
+                want = expected(doc, mode, fup)
+                schedule.installments = counting
+                try:
+                    upcoming = list(schedule.upcoming(doc, mode, TERM, fup))
+                    remaining = schedule.remaining(doc, mode, TERM, fup)
+                finally:
+                    schedule.installments = generate
+                passed = not generated and upcoming == want and remaining == len(want)
+                if not passed:
+                    print(f"  ✗ {mode} policy of {doc} with FUP {fup}: "
+                          f"{len(generated)} uncached calendar(s), {remaining} remaining (expected {len(want)})")
+                ok = ok and passed
+                generated.clear()
+                checked += 1
+    print(f"✓ {checked} schedules answered from the cache" if ok else "✗ Some schedules were not answered from the cache")
+    return ok
+
+if __name__ == '__main__':
+    sys.exit(0 if main() else 1)
@@ -0,0 +1,150 @@
+#!/usr/bin/env python3
+"""
+Transaction Check
+Runs the code paths that read before they start a transaction on a
+connection with autocommit off, as mysql-connector leaves it: any SELECT
+opens a transaction, and start_transaction() then raises "Transaction
+already in progress" until it is committed or rolled back. Each check runs
+one path on a connection that has just read, the way the app calls it.
+Throw-away policies are removed afterwards, so run it against a test
+database; with --sqlite it runs on the in-memory backend, which follows the
+same rules.
+
+Usage:
+    python Debugging_tools/transaction_check.py
+    python Debugging_tools/transaction_check.py --sqlite
+"""
+
+import argparse
+import os
+import sys
+import uuid
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, ROOT)
+
+# Must be set before db is imported
+if '--sqlite' in sys.argv:
+    os.environ['DB_BACKEND'] = 'sqlite'
+    os.environ.pop('DB_SHARDS', None)
+
+import mysql.connector
+
+import bulk_import
+import cube
+import payments
+import shards
+
+PLAN_NO = '102'  # Term Insurance: every mode, terms of 5-40 years
+
+def applicants(count):
+    """CSV rows of valid applicants for PLAN_NO"""
+    return [{'plan_no': PLAN_NO, 'term': '20', 'sum_assured': '500000', 'mode': 'Monthly',
+             'name': f'Check Holder {n}', 'dob': '1990-01-01', 'gender': 'Female', 'occupation': 'Engineer',
+             'education': 'Graduate', 'address': '1 Test Road', 'city': 'Pune', 'state': 'Maharashtra',
+             'pincode': '411001', 'nominee_name': 'Nominee', 'nominee_relation': 'Spouse'} for n in range(count)]
+
+def read_first(conn):
+    """Leave the connection inside the transaction a plain SELECT opens"""
+    cursor = conn.cursor()
+    cursor.execute("SELECT COUNT(*) FROM Plan")
+    cursor.fetchall()
+    cursor.close()
+
+def remove_policies(conn, policy_nos):
+    """Delete throw-away policies with their holders, payments and idempotency keys"""
+    if not policy_nos:
+        return
+    cursor = conn.cursor()
+    placeholders = ', '.join(['%s'] * len(policy_nos))
+    for table in ('Payment_Request', 'Payment', 'Policy_Holder', 'Policy'):
+        cursor.execute(f"DELETE FROM {table} WHERE Policy_no IN ({placeholders})", policy_nos)
+    conn.commit()
+    cursor.close()
+
+def check_cube(conn, agent):
+    """The cube refresh reads its watermark before it takes the cube lock"""
+    read_first(conn)
+    cube.refresh(conn)
+    cursor = conn.cursor()
+    cursor.execute("SELECT MAX(Policy_no) FROM Policy")
+    latest = cursor.fetchone()[0] or ''
+    watermark = cube.watermark(cursor)
+    cursor.close()
+    conn.commit()
+    return watermark == latest, f'cube watermark {watermark or "-"}, latest policy {latest or "-"}'
+
+def check_import(conn, agent):
+    """A bulk import reads the plans before its first chunk's transaction"""
+    read_first(conn)
+    result = bulk_import.import_policies(conn, applicants(3), agent, chunk_size=2,
+                                         policy_start=shards.shard_for(agent).policy_start)
+    policy_nos = [str(n) for n in range(int(result.first_policy_no), int(result.last_policy_no) + 1)] \
+        if result.imported else []
+    remove_policies(conn, policy_nos)
+    return result.imported == 3, f'{result.imported}/3 policies issued, {result.failed} rejected'
+
+def check_payment(conn, agent):
+    """A repeated payment key is answered from a lookup; the next payment on the connection still goes through"""
+    result = bulk_import.import_policies(conn, applicants(1), agent, policy_start=shards.shard_for(agent).policy_start)
+    if not result.imported:
+        return False, 'could not issue a policy to pay'
+    policy_no = result.first_policy_no
+    try:
+        cursor = conn.cursor()
+        cursor.execute("SELECT Premium FROM Policy WHERE Policy_no = %s", (policy_no,))
+        premium = cursor.fetchone()[0]
+        cursor.close()
+        conn.commit()
+        key = uuid.uuid4().hex
+        first = payments.record_payment(conn, policy_no, agent, premium, 'Cash', key=key)
+        repeated = payments.record_payment(conn, policy_no, agent, premium, 'Cash', key=key)
+        second = payments.record_payment(conn, policy_no, agent, premium, 'Cash', key=uuid.uuid4().hex)
+    finally:
+        remove_policies(conn, [policy_no])
+    passed = repeated.duplicate and not second.duplicate and second.payment_id != first.payment_id
+    return passed, f'payments {first.payment_id}, {repeated.payment_id} (repeated key), {second.payment_id}'
+
+CHECKS = [
+    ('cube refresh', check_cube),
+    ('bulk import', check_import),
+    ('payment', check_payment),
+]
+
+def main():
+    """Command line entry point"""
+    parser = argparse.ArgumentParser(description='Check code paths that start a transaction after reading')
+    parser.add_argument('--agent', help='Agency code to issue the test policies under (default: first agent)')
+    parser.add_argument('--sqlite', action='store_true', help='Run on the in-memory SQLite backend')
+    args = parser.parse_args()
+
+    try:
+        home = shards.connect(shards.SHARDS[0])
+        cursor = home.cursor()
+        cursor.execute("SELECT Agency_code FROM Agent ORDER BY Agency_code LIMIT 1")
+        row = cursor.fetchone()
+        cursor.close()
+        home.close()
+    except mysql.connector.Error as e:
+        print(f"✗ Database error: {e}")
+        return False
+    agent = args.agent or (row[0] if row else None)
+    if not agent:
+        print("✗ No agent to issue test policies under; run populate.py first")
+        return False
+
+    ok = True
+    for name, check in CHECKS:
+        conn = shards.get_connection(agent)
+        try:
+            passed, detail = check(conn, agent)
+        except mysql.connector.Error as e:
+            passed, detail = False, f'database error: {e}'
+        finally:
+            conn.close()
+        ok = ok and passed
+        print(f"{'✓' if passed else '✗'} {name}: {detail}")
+    return ok
+
+if __name__ == '__main__':
+    sys.exit(0 if main() else 1)
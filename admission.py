@@ -0,0 +1,176 @@
+"""
+Admission Control
+Limits how much of each kind of work a process runs at once, so a burst of
+heavy admin reports cannot take every database connection while payments
+and logins wait behind them. Every route belongs to a lane (critical,
+standard or heavy) and counts with a weight, roughly the connections it
+holds. The critical lane keeps ADMISSION_RESERVED slots the other lanes can
+never use, and requests waiting in a higher-priority lane are admitted
+first. A request that finds its lane's queue full, or would wait longer
+than its lane allows, is turned away so the client can retry later.
+"""
+
+import os
+import threading
+import time
+from collections import namedtuple
+
+import db
+
+CAPACITY = int(os.getenv('ADMISSION_CAPACITY', db.POOL_SIZE))
+RESERVED = int(os.getenv('ADMISSION_RESERVED', 2))
+HEAVY_SLOTS = int(os.getenv('ADMISSION_HEAVY_SLOTS', 2))
+HEAVY_QUEUE = int(os.getenv('ADMISSION_HEAVY_QUEUE', 1))
+
+# priority: lower is admitted first; limit: weight the lane may run at once; queue: requests
+# that may wait; wait: seconds a request waits before it is shed; reserved: may use reserved slots
+Lane = namedtuple('Lane', 'name priority limit queue wait retry_after reserved')
+
+LANES = [
+    Lane('critical', 0, CAPACITY, 64, 10.0, 2, True),
+    Lane('standard', 1, CAPACITY, 32, 5.0, 5, False),
+    Lane('heavy', 2, HEAVY_SLOTS, HEAVY_QUEUE, 10.0, 15, False),
+]
+
+DEFAULT_ROUTE = ('standard', 1)
+
+# Endpoint -> (lane, weight); endpoints not listed run in the standard lane with weight 1
+ROUTES = {
+    'login': ('critical', 1),
+    'pay_premium': ('critical', 1),
+    'business_report': ('heavy', 2),  # cube refresh plus the slice query on every shard
+    'export_business_report': ('heavy', 1),
+    'forecast_report': ('heavy', 2),  # reads every active policy on every shard when not cached
+    'export_forecast': ('heavy', 2),
+    'commission_report': ('heavy', 1),
+    'payment_history': ('heavy', 1),
+    'agent_leaderboard': ('heavy', 1),
+    'api_leaderboard': ('heavy', 1),
+    'api_analytics': ('heavy', 1),
+    'import_policies': ('heavy', 1),
+}
+
+# Not admission controlled: static files, and the KPI stream, which has its own limit
+EXEMPT = {'static', 'kpi_stream'}
+
+class Overloaded(Exception):
+    """A request was shed; retry_after is the suggested wait in seconds"""
+
+    def __init__(self, lane, reason):
+        super().__init__(f'{lane.name} lane {reason}')
+        self.lane = lane.name
+        self.retry_after = lane.retry_after
+
+class LaneState:
+    """A lane's live counts and running totals"""
+
+    def __init__(self, lane):
+        self.lane = lane
+        self.in_flight = 0
+        self.waiting = 0
+        self.admitted = 0
+        self.queued = 0
+        self.shed = 0
+        self.timed_out = 0
+        self.wait_total = 0.0
+        self.wait_max = 0.0
+
+    def as_dict(self):
+        return {
+            'priority': self.lane.priority,
+            'limit': self.lane.limit,
+            'queue_limit': self.lane.queue,
+            'in_flight': self.in_flight,
+            'waiting': self.waiting,
+            'admitted': self.admitted,
+            'queued': self.queued,
+            'shed': self.shed,
+            'timed_out': self.timed_out,
+            'avg_wait_ms': round(self.wait_total * 1000 / self.queued, 1) if self.queued else 0.0,
+            'max_wait_ms': round(self.wait_max * 1000, 1),
+        }
+
+class Ticket:
+    """An admitted request's share of the capacity, released once"""
+
+    def __init__(self, controller, state, weight):
+        self.controller = controller
+        self.state = state
+        self.weight = weight
+        self.released = False
+
+    def release(self):
+        if not self.released:
+            self.released = True
+            self.controller.release(self.state, self.weight)
+
+class AdmissionController:
+    """Weighted slots shared by the lanes of one process"""
+
+    def __init__(self, lanes=LANES, capacity=CAPACITY, reserved=RESERVED):
+        self.capacity = capacity
+        self.reserved = min(reserved, capacity - 1)
+        self.lanes = {lane.name: LaneState(lane) for lane in lanes}
+        self.used = 0
+        self.changed = threading.Condition()
+
+    def _fits(self, state, weight):
+        limit = self.capacity if state.lane.reserved else self.capacity - self.reserved
+        if state.in_flight + weight > state.lane.limit or self.used + weight > limit:
+            return False
+        # Requests waiting in a higher-priority lane go first
+        return not any(other.waiting for other in self.lanes.values() if other.lane.priority < state.lane.priority)
+
+    def admit(self, lane, weight=1):
+        """Wait for room in the lane, returns a Ticket; raises Overloaded if the request is shed"""
+        state = self.lanes[lane]
+        weight = min(weight, state.lane.limit)
+        with self.changed:
+            if not self._fits(state, weight):
+                if state.waiting >= state.lane.queue:
+                    state.shed += 1
+                    raise Overloaded(state.lane, 'queue is full')
+                started = time.monotonic()
+                state.waiting += 1
+                try:
+                    admitted = self.changed.wait_for(lambda: self._fits(state, weight), state.lane.wait)
+                finally:
+                    state.waiting -= 1
+                    # Lower-priority lanes may have been held back only by this request
+                    self.changed.notify_all()
+                waited = time.monotonic() - started
+                if not admitted:
+                    state.timed_out += 1
+                    raise Overloaded(state.lane, f'wait exceeded {state.lane.wait:g}s')
+                state.queued += 1
+                state.wait_total += waited
+                state.wait_max = max(state.wait_max, waited)
+            state.in_flight += weight
+            state.admitted += 1
+            self.used += weight
+        return Ticket(self, state, weight)
+
+    def release(self, state, weight):
+        with self.changed:
+            state.in_flight -= weight
+            self.used -= weight
+            self.changed.notify_all()
+
+    def metrics(self):
+        """Per-lane counts and wait times for this process"""
+        with self.changed:
+            return {
+                'pid': os.getpid(),
+                'capacity': self.capacity,
+                'reserved': self.reserved,
+                'in_use': self.used,
+                'lanes': {name: state.as_dict() for name, state in self.lanes.items()},
+            }
+
+def route_for(endpoint):
+    """(lane, weight) for an endpoint, None if it is not admission controlled"""
+    if endpoint is None or endpoint in EXEMPT:
+        return None
+    return ROUTES.get(endpoint, DEFAULT_ROUTE)
+
+controller = AdmissionController()
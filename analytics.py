@@ -0,0 +1,232 @@
+#!/usr/bin/env python3
+"""
+Snapshot Analytics
+Business aggregates, commission totals, collections and overdue counts
+computed with vectorized NumPy operations over a snapshot written by
+snapshot.py. Columns are opened with mmap_mode='r', so every worker process
+maps the same files and shares their pages through the OS page cache
+instead of holding its own copy, and nothing touches the live database.
+
+Usage:
+    python analytics.py business --level month --group agent
+    python analytics.py overdue --by agent
+"""
+
+import argparse
+import json
+import os
+import sys
+import threading
+from datetime import date, datetime
+
+import snapshot
+from cube import DIMENSIONS
+from policy_rules import COMMISSION_RATE
+
+try:
+    import numpy as np
+except ImportError:  # analytics snapshots are optional; the app runs without numpy
+    np = None
+
+# Period units for business(), by report level
+LEVEL_UNITS = {'year': 'Y', 'month': 'M', 'day': 'D'}
+
+# Where each business dimension's code comes from: a policy column, or an agent column joined on Agency_code
+DIMENSION_SOURCES = {
+    'branch': ('agent', 'Branch_id'),
+    'admin': ('agent', 'Admin_id'),
+    'agent': ('policy', 'Agency_code'),
+    'plan': ('policy', 'Plan_no'),
+    'mode': ('policy', 'Mode'),
+}
+
+class SnapshotUnavailable(RuntimeError):
+    """No snapshot to read, or numpy is not installed"""
+
+class Snapshot:
+    """Read-only, memory-mapped view of one snapshot directory"""
+
+    def __init__(self, path):
+        self.path = path
+        with open(os.path.join(path, 'manifest.json'), encoding='utf-8') as f:
+            self.manifest = json.load(f)
+        with open(os.path.join(path, 'dictionaries.json'), encoding='utf-8') as f:
+            self.dictionaries = json.load(f)
+        self._codes = {}
+        self.tables = {
+            name: {column: np.load(os.path.join(path, info['file']), mmap_mode='r')
+                   for column, info in table['columns'].items()}
+            for name, table in self.manifest['tables'].items()
+        }
+
+    @property
+    def created(self):
+        return self.manifest['created']
+
+    def code(self, column, value):
+        """Dictionary code of a string value, or -1 if the snapshot never saw it"""
+        codes = self._codes.get(column)
+        if codes is None:
+            codes = self._codes[column] = {value: code for code, value in enumerate(self.dictionaries[column])}
+        return codes.get(value, -1)
+
+    def labels(self, column, codes):
+        """Strings for an array of dictionary codes"""
+        values = self.dictionaries[column]
+        return [values[code] for code in codes.tolist()]
+
+    def joined(self, column):
+        """An agent column lined up with the policy rows (via Agency_code codes)"""
+        agent = self.tables['agent']
+        lookup = np.full(len(self.dictionaries['Agency_code']), self.code(column, ''), dtype=np.int32)
+        lookup[agent['Agency_code']] = agent[column]
+        return lookup[self.tables['policy']['Agency_code']]
+
+_open = {}
+_open_lock = threading.Lock()
+
+def open_snapshot(out_dir=None):
+    """The current snapshot under out_dir, opened once per process per snapshot"""
+    if np is None:
+        raise SnapshotUnavailable('numpy is required for analytics snapshots (pip install numpy)')
+    link = os.path.join(out_dir or snapshot.SNAPSHOT_DIR, snapshot.CURRENT)
+    path = os.path.realpath(link)
+    if not os.path.exists(os.path.join(path, 'manifest.json')):
+        raise SnapshotUnavailable(f'No analytics snapshot at {link}; run snapshot.py first')
+    with _open_lock:
+        current = _open.get(out_dir)
+        if current is None or current.path != path:
+            # The previous snapshot's maps are released once no request holds it any more
+            current = _open[out_dir] = Snapshot(path)
+        return current
+
+def to_days(value):
+    """A date (or YYYY-MM-DD string) as stored: days since 1970-01-01"""
+    if isinstance(value, str):
+        value = datetime.strptime(value, '%Y-%m-%d').date()
+    return value.toordinal() - snapshot.EPOCH_ORDINAL
+
+def commissions(policy):
+    """COM(Premium, Term) for every policy row, rounded half up to the paisa like MySQL DECIMAL"""
+    cents = np.rint(policy['Premium'] * 100).astype(np.int64)
+    # premium × term × 0.05 in ten-thousandths, exactly
+    scaled = cents * policy['Term'] * int(COMMISSION_RATE * 100)
+    return ((scaled + 50) // 100) / 100
+
+def dimension(snap, group):
+    """(dictionary column, codes per policy row) for a business dimension"""
+    table, column = DIMENSION_SOURCES[group]
+    codes = snap.joined(column) if table == 'agent' else snap.tables['policy'][column]
+    return column, codes
+
+def business(snap, level='year', group=None, start=None, end=None, filters=None):
+    """Policy count, premium and commission per period (and group), newest period first.
+
+    The same rows cube.query() returns for the business report, over the
+    policies in the snapshot.
+    """
+    policy = snap.tables['policy']
+    doc = policy['DOC']
+    mask = np.ones(len(doc), dtype=bool)
+    if start:
+        mask &= doc >= to_days(start)
+    if end:
+        mask &= doc <= to_days(end)
+    for dim, value in (filters or {}).items():
+        column, codes = dimension(snap, dim)
+        mask &= codes == snap.code(column, value)
+
+    unit = LEVEL_UNITS[level]
+    periods = doc[mask].astype('datetime64[D]').astype(f'datetime64[{unit}]').astype(np.int64)
+    if group:
+        column, codes = dimension(snap, group)
+        width = len(snap.dictionaries[column])
+        keys = periods * width + codes[mask]
+    else:
+        width, keys = 1, periods
+    keys, inverse = np.unique(keys, return_inverse=True)
+    counts = np.bincount(inverse, minlength=len(keys))
+    premium = np.bincount(inverse, weights=policy['Premium'][mask], minlength=len(keys))
+    commission = np.bincount(inverse, weights=commissions(policy)[mask], minlength=len(keys))
+
+    labels = np.datetime_as_string((keys // width).astype(f'datetime64[{unit}]'), unit=unit)
+    dims = snap.labels(column, keys % width) if group else [None] * len(keys)
+    data = []
+    for label, dim, count, premium_total, commission_total in zip(labels.tolist(), dims, counts.tolist(),
+                                                                  premium.tolist(), commission.tolist()):
+        row = {'Period': label, 'Policy_Count': count,
+               'Premium_Total': round(premium_total, 2), 'Total_Commission': round(commission_total, 2)}
+        if group:
+            row['Dimension'] = dim
+        data.append(row)
+    data.sort(key=lambda row: str(row.get('Dimension') or ''))
+    return sorted(data, key=lambda row: row['Period'], reverse=True)
+
+def commission_totals(snap, by='agent'):
+    """Total commission over all policies per agent (or other business dimension)"""
+    column, codes = dimension(snap, by)
+    totals = np.bincount(codes, weights=commissions(snap.tables['policy']), minlength=len(snap.dictionaries[column]))
+    present = np.flatnonzero(np.bincount(codes, minlength=len(totals)))
+    return dict(zip(snap.labels(column, present), np.round(totals[present], 2).tolist()))
+
+def overdue(snap, as_of=None, by=None):
+    """Active policies whose FUP is before as_of (default today); per dimension if `by` is given"""
+    policy = snap.tables['policy']
+    fup = policy['FUP']
+    mask = (policy['Status'] == 1) & (fup != snapshot.DATE_NULL) & (fup < to_days(as_of or date.today()))
+    if not by:
+        return int(np.count_nonzero(mask))
+    column, codes = dimension(snap, by)
+    counts = np.bincount(codes[mask], minlength=len(snap.dictionaries[column]))
+    present = np.flatnonzero(counts)
+    return dict(zip(snap.labels(column, present), counts[present].tolist()))
+
+def collections(snap, level='month', start=None, end=None):
+    """Premium collected (payment count and amount) per period, newest first"""
+    payment = snap.tables['payment']
+    days = payment['Timestamp'] // 86400
+    mask = np.ones(len(days), dtype=bool)
+    if start:
+        mask &= days >= to_days(start)
+    if end:
+        mask &= days <= to_days(end)
+    unit = LEVEL_UNITS[level]
+    periods = days[mask].astype('datetime64[D]').astype(f'datetime64[{unit}]')
+    keys, inverse = np.unique(periods, return_inverse=True)
+    counts = np.bincount(inverse, minlength=len(keys))
+    amounts = np.bincount(inverse, weights=payment['Amount'][mask], minlength=len(keys))
+    data = [{'Period': label, 'Payment_Count': count, 'Amount_Total': round(amount, 2)}
+            for label, count, amount in zip(np.datetime_as_string(keys, unit=unit).tolist(),
+                                            counts.tolist(), amounts.tolist())]
+    return data[::-1]
+
+def main():
+    """Command line entry point"""
+    parser = argparse.ArgumentParser(description='Run analytics over the current snapshot')
+    parser.add_argument('report', choices=['business', 'commission', 'overdue', 'collections'])
+    parser.add_argument('--dir', default=snapshot.SNAPSHOT_DIR, help='Snapshot directory (default: ANALYTICS_DIR)')
+    parser.add_argument('--level', choices=list(LEVEL_UNITS), default='year')
+    parser.add_argument('--group', '--by', dest='group', choices=list(DIMENSIONS))
+    parser.add_argument('--start', help='YYYY-MM-DD')
+    parser.add_argument('--end', help='YYYY-MM-DD')
+    args = parser.parse_args()
+
+    try:
+        snap = open_snapshot(args.dir)
+    except SnapshotUnavailable as e:
+        print(f"✗ {e}")
+        return False
+    print(f"Snapshot of {snap.created}")
+    if args.report == 'business':
+        result = business(snap, args.level, args.group, args.start, args.end)
+    elif args.report == 'commission':
+        result = commission_totals(snap, args.group or 'agent')
+    elif args.report == 'overdue':
+        result = overdue(snap, by=args.group)
+    else:
+        result = collections(snap, args.level, args.start, args.end)
+    print(json.dumps(result, indent=2))
+    return True
+
+if __name__ == '__main__':
+    sys.exit(0 if main() else 1)
@@ -1,40 +1,226 @@
-from flask import Flask, render_template, request, redirect, url_for, session, flash, jsonify
+from flask import (Flask, Response, render_template, stream_template, request, redirect, url_for, session, flash,
+                   jsonify, send_from_directory, g)
 import bcrypt
 import mysql.connector
-from mysql.connector import pooling
 from datetime import datetime, timedelta
+import io
 import os
 from dotenv import load_dotenv
 from functools import wraps
 import secrets
+import threading
+
+from payments import PaymentError, record_payment
+from policy_rules import allocate_policy_numbers, calculate_age, calculate_premium, validate_policy
+import admission
+import analytics
+import audit
+import bulk_import
+import cube
+import db
+import forecast
+import jobs
+import kpi
+import leaderboard
+import profiler
+import report_cache
+import reports
+import rows
+import schedule
+import shards
+import signals
+import statements
+import summary
+import timeouts
 
 load_dotenv()
 
 app = Flask(__name__)
 app.secret_key = os.getenv('SECRET_KEY', secrets.token_hex(32))
 
-# Database Connection Pool
-db_config = {
-    'host': os.getenv('DB_HOST', 'localhost'),
-    'user': os.getenv('DB_USER', 'root'),
-    'password': os.getenv('DB_PASS', ''),
-    'database': os.getenv('DB_NAME', 'claude_db'),
-    'pool_name': 'insurance_pool',
-    'pool_size': 10
-}
-
-try:
-    connection_pool = pooling.MySQLConnectionPool(**db_config)
-except mysql.connector.Error as e:
-    print(f"Error creating connection pool: {e}")
-    connection_pool = None
-
 def get_db_connection():
-    """Get database connection from pool"""
-    if connection_pool:
-        return connection_pool.get_connection()
+    """Get database connection from this process's pool"""
+    return db.get_connection()
+
+def get_agent_connection():
+    """Connection to the shard holding the logged-in agent's policies"""
+    return shards.get_connection(session['user_id'])
+
+# Streamed pages are sent to the client in chunks of roughly this many characters
+STREAM_CHUNK_SIZE = 8192
+STREAM_TIMEOUT_NOTICE = ('<div class="alert alert-warning">This list took too long to load and was cut short. '
+                         'Please try again shortly.</div>')
+
+def stream_page(template, **context):
+    """Render a template as a streamed response; record streams in the context are closed at the end"""
+    pieces = stream_template(template, **context)
+    budget = g.get('budget')
+
+    def generate():
+        buffer, size = [], 0
+        try:
+            for piece in pieces:
+                buffer.append(piece)
+                size += len(piece)
+                if size >= STREAM_CHUNK_SIZE:
+                    yield ''.join(buffer)
+                    buffer, size = [], 0
+        except mysql.connector.Error as e:
+            if not timeouts.is_timeout(e):
+                raise
+            # Too late for the timeout page: end what was sent with a notice instead
+            timeouts.watchdog.report(budget)
+            buffer.append(STREAM_TIMEOUT_NOTICE)
+        if buffer:
+            yield ''.join(buffer)
+
+    response = Response(generate(), mimetype='text/html')
+    # Keep nginx from buffering the whole page before passing it on
+    response.headers['X-Accel-Buffering'] = 'no'
+    for value in context.values():
+        if hasattr(value, 'close'):
+            response.call_on_close(value.close)
+    return response
+
+# Where uploaded bulk import files are kept
+IMPORT_DIR = os.getenv('IMPORT_DIR', 'imports')
+
+# Background jobs for long reports and bulk imports
+job_runner = jobs.JobRunner(
+    get_db_connection,
+    workers=int(os.getenv('JOB_WORKERS', 2)),
+    result_dir=os.getenv('JOB_DIR', 'jobs')
+)
+job_runner.register('business_report', reports.business_report_job)
+job_runner.register('policy_import', bulk_import.import_job)
+job_runner.register('shard_copy', shards.copy_job, max_attempts=shards.COPY_ATTEMPTS,
+                    retry_seconds=shards.COPY_RETRY_SECONDS)
+
+# Cheap reads that pull the hot tables into the server's buffer pool
+WARM_UP_QUERIES = [
+    "SELECT Plan_no, Name FROM Plan ORDER BY Plan_no",
+    "SELECT Admin_id, Name FROM Admin",
+    "SELECT Agency_code, Name FROM Agent",
+    "SELECT COUNT(*) FROM Policy WHERE FUP IS NOT NULL AND Status = 1",
+]
+
+_process_lock = threading.Lock()
+_initialized_pid = None
+
+def warm_up():
+    """Fill the pool, prime the database caches and compile templates before taking traffic"""
+    db.warm_up()
+    conn = get_db_connection()
+    if conn:
+        cursor = conn.cursor()
+        try:
+            for query in WARM_UP_QUERIES:
+                cursor.execute(query)
+                cursor.fetchall()
+        except mysql.connector.Error as e:
+            print(f"Warm-up query failed: {e}")
+        cursor.close()
+        conn.close()
+    for shard, _, error in shards.fan_out(lambda shard, shard_conn: cube.refresh(shard_conn)):
+        if error:
+            print(f"Cube refresh on {shard.name} failed: {error}")
+    kpi.board.reconcile()
+    leaderboard.board.reload()
+    for name in app.jinja_env.list_templates():
+        app.jinja_env.get_template(name)
+
+def create_app():
+    """Start this process's background workers and warm it up, once per process"""
+    global _initialized_pid
+    with _process_lock:
+        if _initialized_pid != os.getpid():
+            _initialized_pid = os.getpid()
+            job_runner.start()
+            audit.log.start()
+            profiler.requests.start()
+            timeouts.watchdog.start()
+            warm_up()
+    return app
+
+@app.before_request
+def ensure_started():
+    # Servers that don't call create_app() (e.g. plain `gunicorn app:app`) start on first request
+    if _initialized_pid != os.getpid():
+        create_app()
+
+@app.before_request
+def admit_request():
+    # Heavy reports wait or are shed before they can take the connections payments need
+    route = admission.route_for(request.endpoint)
+    if route is None:
+        return None
+    try:
+        g.admission = admission.controller.admit(*route)
+    except admission.Overloaded as e:
+        if request.path.startswith('/api/'):
+            response = jsonify({'error': 'Server busy, try again shortly', 'lane': e.lane})
+        else:
+            response = Response(render_template('503.html', retry_after=e.retry_after))
+        response.status_code = 503
+        response.headers['Retry-After'] = str(e.retry_after)
+        return response
     return None
 
+@app.before_request
+def start_budget():
+    # Started once admitted: time spent queued for a lane is not counted
+    g.budget = timeouts.watchdog.begin(request.endpoint)
+
+@app.before_request
+def start_profiling():
+    # A lookup in an empty dict unless an admin has started a profiling run
+    if request.endpoint in profiler.requests.targets:
+        g.profile = profiler.requests.begin(request.endpoint)
+
+def timeout_response(budget):
+    """The answer to a request whose statements ran past its budget"""
+    timeouts.watchdog.report(budget)
+    if request.path.startswith('/api/'):
+        response = jsonify({'error': 'The request took too long and was stopped'})
+    else:
+        # Drop what the view flashed about the failed query; the page says it instead
+        session.pop('_flashes', None)
+        response = Response(render_template('timeout.html', seconds=budget.seconds if budget else 0))
+    response.status_code = 504
+    return response
+
+@app.after_request
+def release_admission_on_close(response):
+    budget = g.pop('budget', None)
+    if budget:
+        if budget.timed_out and not budget.reported:
+            # The view handled the interrupted query itself; answer with the timeout page anyway
+            response.close()
+            response = timeout_response(budget)
+        # Connections the request never returned go back to the pool once the response is sent
+        response.call_on_close(lambda: timeouts.watchdog.end(budget))
+    # Streamed pages hold their connection until the last chunk is sent
+    ticket = g.pop('admission', None)
+    if ticket:
+        response.call_on_close(ticket.release)
+    profile = g.pop('profile', None)
+    if profile:
+        response.call_on_close(lambda: profiler.requests.end(profile))
+    return response
+
+@app.teardown_request
+def release_admission(exc):
+    ticket = g.pop('admission', None)
+    if ticket:
+        ticket.release()
+    profile = g.pop('profile', None)
+    if profile:
+        profiler.requests.end(profile)
+    timeouts.watchdog.detach()
+    budget = g.pop('budget', None)
+    if budget:
+        timeouts.watchdog.end(budget)
+
 def login_required(role=None):
     """Decorator to protect routes"""
     def decorator(f):
@@ -73,22 +259,17 @@ def login():
             flash('Database connection error', 'danger')
             return render_template('login.html')
         
-        cursor = conn.cursor(dictionary=True)
-        
         # Determine if Admin or Agent
         if len(user_id) == 5:
-            query = "SELECT Admin_id as id, Name, Password, 'admin' as role FROM Admin WHERE Admin_id = %s"
+            statement = 'admin_login'
         elif len(user_id) == 7:
-            query = "SELECT Agency_code as id, Name, Password, 'agent' as role FROM Agent WHERE Agency_code = %s"
+            statement = 'agent_login'
         else:
             flash('Invalid User ID format', 'danger')
-            cursor.close()
             conn.close()
             return render_template('login.html')
         
-        cursor.execute(query, (user_id,))
-        user = cursor.fetchone()
-        cursor.close()
+        user = statements.fetch_one(conn, statement, (user_id,))
         conn.close()
         
         if user and bcrypt.checkpw(password.encode('utf-8'), user['Password'].encode('utf-8')):
@@ -155,6 +336,7 @@ def register(role):
                 
                 cursor.close()
                 conn.close()
+                copy_to_shards('Admin', admin_id)
                 
                 # Show success page with generated ID
                 return render_template('registration_success.html', 
@@ -187,6 +369,7 @@ def register(role):
                 
                 cursor.close()
                 conn.close()
+                copy_to_shards('Agent', agency_code)
                 
                 # Show success page with generated code
                 return render_template('registration_success.html',
@@ -210,6 +393,20 @@ def register(role):
     conn.close()
     return render_template('register.html', role=role, admins=admins)
 
+def copy_to_shards(table, key):
+    """Copy a reference-data row to the other shards; those it does not reach are retried as a job"""
+    for shard, error in shards.broadcast(table, key):
+        queue_shard_copy(shard, table, key)
+        flash(f'Not copied to shard {shard.name} yet ({str(error)}); it will be retried in the background', 'warning')
+
+def queue_shard_copy(shard, table, key):
+    """Queue a background copy of a reference-data row to a shard that is missing it"""
+    try:
+        job_runner.submit('shard_copy', {'shard': shard.name, 'table': table, 'key': key},
+                          session.get('user_id') or key)
+    except mysql.connector.Error as e:
+        flash(f'Could not queue the copy of {table} {key} to shard {shard.name}: {str(e)}', 'danger')
+
 def get_admins(cursor):
     """Helper function to get all admins for agent registration"""
     cursor.execute("SELECT Admin_id, Name, Branch_id FROM Admin ORDER BY Admin_id")
@@ -223,22 +420,82 @@ def logout():
 
 #  DASHBOARD 
 
+# Each open KPI stream holds a worker thread, so only a few per process stay open;
+# past the cap a dashboard gets the counters once and reconnects later
+KPI_MAX_STREAMS = int(os.getenv('KPI_MAX_STREAMS', 2))
+KPI_STREAM_SECONDS = int(os.getenv('KPI_STREAM_SECONDS', 120))
+KPI_HEARTBEAT_SECONDS = 15
+KPI_BUSY_RETRY_MS = 10000
+_kpi_streams = threading.BoundedSemaphore(KPI_MAX_STREAMS)
+
 @app.route('/dashboard')
 @login_required()
 def dashboard():
-    return render_template('dashboard.html')
+    counters = kpi.board.refresh() if session.get('role') == 'admin' else None
+    # One aggregate over the user's (or their agents') policies, cached until a write changes it
+    try:
+        (numbers, warnings), summary_at = summary.for_user(session['role'], session['user_id'])
+    except mysql.connector.Error as e:
+        flash(f'Could not load your summary: {str(e)}', 'warning')
+        numbers, warnings, summary_at = None, [], None
+    for warning in warnings:
+        flash(f'Summary may be incomplete: {warning}', 'warning')
+    return render_template('dashboard.html', kpi=counters, summary=numbers, summary_at=summary_at)
+
+@app.route('/api/kpi')
+@login_required(role='admin')
+def api_kpi():
+    return jsonify(kpi.board.refresh())
+
+@app.route('/api/metrics')
+@login_required(role='admin')
+def api_metrics():
+    # Per process: each worker reports its own lanes
+    return jsonify({'admission': admission.controller.metrics(), 'report_cache': report_cache.business.metrics(),
+                    'timeouts': timeouts.watchdog.metrics()})
+
+@app.route('/api/kpi/stream')
+@login_required(role='admin')
+def kpi_stream():
+    headers = {'Cache-Control': 'no-cache', 'X-Accel-Buffering': 'no'}
+    if not _kpi_streams.acquire(blocking=False):
+        return Response(kpi.event(kpi.board.refresh(), retry=KPI_BUSY_RETRY_MS),
+                        mimetype='text/event-stream', headers=headers)
+    response = Response(kpi.stream(kpi.board, KPI_STREAM_SECONDS, KPI_HEARTBEAT_SECONDS),
+                        mimetype='text/event-stream', headers=headers)
+    # Runs even if the client leaves before the stream starts
+    response.call_on_close(_kpi_streams.release)
+    return response
 
 #  PLAN MANAGEMENT (ADMIN) 
 
 @app.route('/plans')
 @login_required(role='admin')
 def plans():
-    conn = get_db_connection()
-    cursor = conn.cursor(dictionary=True)
-    cursor.execute("SELECT * FROM Plan ORDER BY Plan_no")
-    plans = cursor.fetchall()
-    cursor.close()
-    conn.close()
+    def fetch_plans(shard, conn):
+        cursor = conn.cursor(dictionary=True)
+        cursor.execute("SELECT * FROM Plan ORDER BY Plan_no")
+        result = cursor.fetchall()
+        cursor.close()
+        return result
+    
+    # Every shard keeps a copy of the plans; list them all and point out any that drifted
+    merged, missing = {}, {}
+    results = shards.fan_out(fetch_plans)
+    for shard, result, error in results:
+        if error:
+            flash(f'Shard {shard.name} unavailable: {str(error)}', 'danger')
+            continue
+        for plan in result:
+            merged.setdefault(plan['Plan_no'], plan)
+    for shard, result, error in results:
+        if not error:
+            for plan_no in merged.keys() - {plan['Plan_no'] for plan in result}:
+                missing.setdefault(plan_no, []).append(shard.name)
+    for plan_no, names in sorted(missing.items()):
+        flash(f"Plan {plan_no} is missing on shard(s): {', '.join(names)}", 'warning')
+    
+    plans = [merged[plan_no] for plan_no in sorted(merged)]
     return render_template('plans.html', plans=plans)
 
 @app.route('/plans/add', methods=['GET', 'POST'])
@@ -284,9 +541,11 @@ def add_plan():
             
             cursor.execute(query, values)
             conn.commit()
+            audit.log.record('plan_added', session['user_id'], request.form.get('plan_no'), **request.form.to_dict())
             flash('Plan added successfully', 'success')
             cursor.close()
             conn.close()
+            copy_to_shards('Plan', request.form.get('plan_no'))
             return redirect(url_for('plans'))
         except mysql.connector.Error as e:
             conn.rollback()
@@ -323,9 +582,11 @@ def edit_plan(plan_no):
             
             cursor.execute(query, values)
             conn.commit()
+            audit.log.record('plan_edited', session['user_id'], plan_no, **request.form.to_dict())
             flash('Plan updated successfully', 'success')
             cursor.close()
             conn.close()
+            copy_to_shards('Plan', plan_no)
             return redirect(url_for('plans'))
         except mysql.connector.Error as e:
             conn.rollback()
@@ -342,23 +603,18 @@ def edit_plan(plan_no):
 @app.route('/policies')
 @login_required(role='agent')
 def policies():
-    conn = get_db_connection()
-    cursor = conn.cursor(dictionary=True)
     query = """SELECT p.*, pl.Name as Plan_Name, ph.Name as Holder_Name 
                FROM Policy p 
                JOIN Plan pl ON p.Plan_no = pl.Plan_no 
                LEFT JOIN Policy_Holder ph ON p.Policy_no = ph.Policy_no
                WHERE p.Agency_code = %s ORDER BY p.Policy_no DESC"""
-    cursor.execute(query, (session['user_id'],))
-    policies = cursor.fetchall()
-    cursor.close()
-    conn.close()
-    return render_template('policies.html', policies=policies)
+    policies = rows.stream_records(get_agent_connection(), query, (session['user_id'],))
+    return stream_page('policies.html', policies=policies)
 
 @app.route('/policies/add', methods=['GET', 'POST'])
 @login_required(role='agent')
 def add_policy():
-    conn = get_db_connection()
+    conn = get_agent_connection()
     cursor = conn.cursor(dictionary=True)
     
     if request.method == 'POST':
@@ -369,12 +625,27 @@ def add_policy():
         # Get DOB and calculate age
         dob_str = request.form.get('dob')
         dob = datetime.strptime(dob_str, '%Y-%m-%d')
-        today = datetime.today()
-        age = today.year - dob.year - ((today.month, today.day) < (dob.month, dob.day))
+        age = calculate_age(dob)
         
         # Fetch Plan details
-        cursor.execute("SELECT * FROM Plan WHERE Plan_no = %s", (plan_no,))
-        plan = cursor.fetchone()
+        plan = statements.fetch_one(conn, 'plan', (plan_no,))
+        
+        # The agent and plan rows must have reached this shard, or the insert fails its foreign keys
+        shard = shards.shard_for(session['user_id'])
+        try:
+            missing = shards.missing_references(shard, conn, [('Agent', session['user_id'])] +
+                                                ([] if plan else [('Plan', plan_no)]))
+        except mysql.connector.Error as e:
+            missing = []
+            flash(f'Could not check shard {shard.name}: {str(e)}', 'warning')
+        if missing:
+            for table, key in missing:
+                queue_shard_copy(shard, table, key)
+            flash(f"{', '.join(f'{table} {key}' for table, key in missing)} has not been copied to this agent's "
+                  f"database ({shard.name}) yet. The copy has been queued again; please retry in a minute.", 'danger')
+            cursor.close()
+            conn.close()
+            return redirect(url_for('add_policy'))
         
         if not plan:
             flash('Invalid Plan selected', 'danger')
@@ -383,28 +654,7 @@ def add_policy():
             return redirect(url_for('add_policy'))
         
         # Validation
-        errors = []
-        
-        # Age check
-        if age < plan['Min_Age'] or age > plan['Max_Age']:
-            errors.append(f"Age must be between {plan['Min_Age']} and {plan['Max_Age']}")
-        
-        # Term check
-        if plan['T3'] and plan['T4']:  # Specific type
-            valid_terms = [plan['T1'], plan['T2'], plan['T3'], plan['T4']]
-            if term not in valid_terms:
-                errors.append(f"Term must be one of: {', '.join(map(str, valid_terms))}")
-        else:  # Range type
-            if term < plan['T1'] or term > plan['T2']:
-                errors.append(f"Term must be between {plan['T1']} and {plan['T2']}")
-        
-        # Sum Assured check
-        if sum_assured < plan['Min_SA'] or sum_assured > plan['Max_SA']:
-            errors.append(f"Sum Assured must be between {plan['Min_SA']} and {plan['Max_SA']}")
-        
-        # Maturity check
-        if age + term > plan['MMA']:
-            errors.append(f"Age + Term cannot exceed Maturity Age of {plan['MMA']}")
+        errors = validate_policy(plan, age, term, sum_assured)
         
         if errors:
             for error in errors:
@@ -415,26 +665,20 @@ def add_policy():
         
         # Calculate Premium (simplified)
         mode = request.form.get('mode')
-        premium = sum_assured / term
-        if mode == 'Half-yearly':
-            premium = premium / 2
-        elif mode == 'Quarterly':
-            premium = premium / 4
-        elif mode == 'Monthly':
-            premium = premium / 12
+        premium = calculate_premium(sum_assured, term, mode)
         
         # Transaction
         try:
+            # The plan lookup opened a read transaction (autocommit is off); end it before starting ours
+            conn.rollback()
             conn.start_transaction()
             
             # Generate Policy Number
-            cursor.execute("SELECT MAX(CAST(Policy_no AS UNSIGNED)) as max_no FROM Policy")
-            result = cursor.fetchone()
-            policy_no = str((result['max_no'] or 100000000) + 1).zfill(9)
+            policy_no = allocate_policy_numbers(cursor, start=shards.shard_for(session['user_id']).policy_start)[0]
             
             # Insert Policy
             doc = datetime.now().strftime('%Y-%m-%d')
-            fup = (datetime.now() + timedelta(days=30)).strftime('%Y-%m-%d')
+            fup = schedule.first_due(datetime.now()).strftime('%Y-%m-%d')
             
             policy_query = """INSERT INTO Policy (Policy_no, Plan_no, Agency_code, Premium, DOC, FUP, Status, Mode, Term, Sum_Assured)
                               VALUES (%s, %s, %s, %s, %s, %s, 1, %s, %s, %s)"""
@@ -464,6 +708,8 @@ def add_policy():
             cursor.execute("SELECT * FROM Policy_Holder WHERE Policy_no = %s", (policy_no,))
             if cursor.fetchone():
                 conn.commit()
+                signals.policies_issued.send(session['user_id'], policies=[
+                    {'policy_no': policy_no, 'premium': premium, 'term': term}])
                 flash(f'Policy {policy_no} created successfully!', 'success')
             else:
                 conn.rollback()
@@ -484,88 +730,79 @@ def add_policy():
     conn.close()
     return render_template('add_policy.html', plans=plans)
 
+@app.route('/policies/import', methods=['GET', 'POST'])
+@login_required(role='agent')
+def import_policies():
+    if request.method == 'POST':
+        upload = request.files.get('csv_file')
+        if not upload or not upload.filename:
+            flash('Please choose a CSV file to import', 'danger')
+            return redirect(url_for('import_policies'))
+        
+        # Keep the upload on disk so the import job can resume from it
+        os.makedirs(IMPORT_DIR, exist_ok=True)
+        path = os.path.abspath(os.path.join(
+            IMPORT_DIR, f"{session['user_id']}-{datetime.now().strftime('%Y%m%d%H%M%S')}.csv"))
+        upload.save(path)
+        
+        try:
+            job_id = job_runner.submit('policy_import', {'path': path, 'agency_code': session['user_id']},
+                                       session['user_id'])
+        except mysql.connector.Error as e:
+            flash(f'Could not start import: {str(e)}', 'danger')
+            return redirect(url_for('import_policies'))
+        
+        flash('Import started. You can leave this page and check back later.', 'info')
+        return redirect(url_for('job_status', job_id=job_id))
+    
+    return render_template('import_policies.html', columns=bulk_import.COLUMNS)
+
 #  PAYMENT MANAGEMENT 
 
 @app.route('/payments')
 @login_required(role='agent')
 def payments():
-    conn = get_db_connection()
-    cursor = conn.cursor(dictionary=True)
     query = """SELECT p.Policy_no, p.Premium, p.FUP, p.Status, ph.Name as Holder_Name
                FROM Policy p
                JOIN Policy_Holder ph ON p.Policy_no = ph.Policy_no
                WHERE p.Agency_code = %s AND p.Status = 1 AND p.FUP IS NOT NULL
                ORDER BY p.FUP"""
-    cursor.execute(query, (session['user_id'],))
-    policies = cursor.fetchall()
-    cursor.close()
-    conn.close()
-    return render_template('payments.html', policies=policies)
+    policies = rows.stream_records(get_agent_connection(), query, (session['user_id'],))
+    return stream_page('payments.html', policies=policies)
 
 @app.route('/payments/pay/<policy_no>', methods=['GET', 'POST'])
 @login_required(role='agent')
 def pay_premium(policy_no):
-    conn = get_db_connection()
+    conn = get_agent_connection()
     cursor = conn.cursor(dictionary=True)
     
     if request.method == 'POST':
         amount = float(request.form.get('amount'))
         mode = request.form.get('mode')
+        # A repeated submit (double click, retried request) carries the same key
+        key = request.headers.get('Idempotency-Key') or request.form.get('idempotency_key') or None
+        cursor.close()
         
-        # Fetch Policy
-        cursor.execute("SELECT * FROM Policy WHERE Policy_no = %s", (policy_no,))
-        policy = cursor.fetchone()
-        
-        if not policy:
-            flash('Policy not found', 'danger')
-            cursor.close()
-            conn.close()
-            return redirect(url_for('payments'))
-        
-        # Validation
-        if policy['Agency_code'] != session['user_id']:
-            flash('Unauthorized access to this policy', 'danger')
-            cursor.close()
-            conn.close()
-            return redirect(url_for('payments'))
-        
-        if policy['FUP'] is None:
-            flash('Policy is matured or inactive', 'warning')
-            cursor.close()
+        try:
+            payment = record_payment(conn, policy_no, session['user_id'], amount, mode, key=key,
+                                     expected_fup=request.form.get('expected_fup') or None)
+        except PaymentError as e:
             conn.close()
-            return redirect(url_for('payments'))
-        
-        if amount < policy['Premium']:
-            flash(f'Payment amount must be at least {policy["Premium"]}', 'danger')
-            cursor.close()
+            flash(str(e), e.category)
+            return redirect(url_for('pay_premium', policy_no=policy_no) if e.retry else url_for('payments'))
+        except mysql.connector.Error as e:
             conn.close()
+            flash(f'Payment failed: {str(e)}', 'danger')
             return redirect(url_for('pay_premium', policy_no=policy_no))
         
-        # Record Payment
-        try:
-            payment_query = """INSERT INTO Payment (Policy_no, Payment_Mode, Timestamp, Amount)
-                               VALUES (%s, %s, %s, %s)"""
-            cursor.execute(payment_query, (policy_no, mode, datetime.now(), amount))
-            
-            # Update FUP using SEL function
-            cursor.execute("UPDATE Policy SET FUP = SEL(Policy_no) WHERE Policy_no = %s", (policy_no,))
-            
-            # Check if policy matured
-            cursor.execute("SELECT FUP FROM Policy WHERE Policy_no = %s", (policy_no,))
-            updated_policy = cursor.fetchone()
-            
-            if updated_policy['FUP'] is None:
-                cursor.execute("UPDATE Policy SET Status = 0 WHERE Policy_no = %s", (policy_no,))
-            
-            conn.commit()
+        conn.close()
+        if payment.duplicate:
+            flash('This payment was already recorded', 'info')
+        elif payment.matured:
+            flash('Payment recorded successfully. All premiums are paid.', 'success')
+        else:
             flash('Payment recorded successfully', 'success')
-            cursor.close()
-            conn.close()
-            return redirect(url_for('payments'))
-            
-        except mysql.connector.Error as e:
-            conn.rollback()
-            flash(f'Payment failed: {str(e)}', 'danger')
+        return redirect(url_for('payments'))
     
     # GET request
     cursor.execute("""SELECT p.*, ph.Name as Holder_Name 
@@ -575,50 +812,276 @@ def pay_premium(policy_no):
     policy = cursor.fetchone()
     cursor.close()
     conn.close()
-    return render_template('pay_premium.html', policy=policy)
+    upcoming = schedule.policy_schedule(policy, limit=12) if policy else None
+    return render_template('pay_premium.html', policy=policy, schedule=upcoming,
+                           idempotency_key=secrets.token_urlsafe(24))
+
+@app.route('/api/policies/<policy_no>/schedule')
+@login_required(role='agent')
+def api_policy_schedule(policy_no):
+    conn = get_agent_connection()
+    cursor = conn.cursor(dictionary=True)
+    cursor.execute("SELECT * FROM Policy WHERE Policy_no = %s", (policy_no,))
+    policy = cursor.fetchone()
+    cursor.close()
+    conn.close()
+
+    if not policy or policy['Agency_code'] != session['user_id']:
+        return jsonify({'error': 'Policy not found'}), 404
+
+    limit = request.args.get('limit', type=int)
+    data = schedule.policy_schedule(policy, limit=limit if limit and limit > 0 else None)
+    data['premium'] = float(data['premium'])
+    data['maturity_date'] = data['maturity_date'].isoformat()
+    for item in data['installments']:
+        item['due_date'] = item['due_date'].isoformat()
+        item['amount'] = float(item['amount'])
+    return jsonify(data)
+
+@app.route('/payments/history')
+@login_required(role='agent')
+def payment_history():
+    # Default to the current year so only one Payment partition is read
+    today = datetime.today()
+    try:
+        start = datetime.strptime(request.args.get('start') or f'{today.year}-01-01', '%Y-%m-%d')
+        end = datetime.strptime(request.args.get('end') or today.strftime('%Y-%m-%d'), '%Y-%m-%d')
+    except ValueError:
+        flash('Dates must be in YYYY-MM-DD format', 'danger')
+        return redirect(url_for('payment_history'))
+    include_archive = request.args.get('archive') == '1'
+    
+    conn = get_agent_connection()
+    cursor = conn.cursor(dictionary=True)
+    history = reports.payment_history(cursor, session['user_id'], start, end + timedelta(days=1), include_archive)
+    cursor.close()
+    conn.close()
+    
+    return render_template('payment_history.html', payments=history, start=start.strftime('%Y-%m-%d'),
+                           end=end.strftime('%Y-%m-%d'), include_archive=include_archive)
 
 #  REPORTS 
 
 @app.route('/reports/commission')
 @login_required(role='agent')
 def commission_report():
-    conn = get_db_connection()
-    cursor = conn.cursor(dictionary=True)
-    
     query = """SELECT Policy_no, Premium, Term, COM(Premium, Term) as Commission 
                FROM Policy WHERE Agency_code = %s"""
-    cursor.execute(query, (session['user_id'],))
-    policies = cursor.fetchall()
-    
-    total_commission = sum(p['Commission'] for p in policies)
-    
-    cursor.close()
-    conn.close()
-    return render_template('commission_report.html', policies=policies, total=total_commission)
+    # The total is summed as rows are rendered and written after the table
+    policies = rows.RunningTotal(rows.stream_records(get_agent_connection(), query, (session['user_id'],)),
+                                 'Commission')
+    return stream_page('commission_report.html', policies=policies)
 
 @app.route('/reports/business')
 @login_required(role='admin')
 def business_report():
-    conn = get_db_connection()
-    cursor = conn.cursor(dictionary=True)
+    slice_ = cube.parse_slice(request.args)
     
-    report_type = request.args.get('type', 'yearly')
+    # Each shard folds in its newest policies and answers the slice; the merged result is cached
+    # and served while a background refresh recomputes it once it is stale
+    (data, warnings), computed_at = report_cache.business.get(report_cache.slice_key(slice_),
+                                                              lambda: reports.business_slice(slice_))
+    for warning in warnings:
+        flash(f'Report may be incomplete: {warning}', 'warning')
     
-    if report_type == 'yearly':
-        query = """SELECT YEAR(DOC) as Period, COUNT(*) as Policy_Count, 
-                   SUM(COM(Premium, Term)) as Total_Commission
-                   FROM Policy GROUP BY YEAR(DOC) ORDER BY Period DESC"""
-    else:  # monthly
-        query = """SELECT DATE_FORMAT(DOC, '%Y-%m') as Period, COUNT(*) as Policy_Count,
-                   SUM(COM(Premium, Term)) as Total_Commission
-                   FROM Policy GROUP BY DATE_FORMAT(DOC, '%Y-%m') ORDER BY Period DESC"""
+    drill_level = cube.DRILL_DOWN.get(slice_['level'])
+    drill = {}
+    if drill_level:
+        for row in data:
+            start, end = cube.period_bounds(slice_['level'], row['Period'])
+            drill[row['Period']] = url_for('business_report', level=drill_level, group=slice_['group'],
+                                           start=start.isoformat(), end=end.isoformat(), **slice_['filters'])
     
-    cursor.execute(query)
-    data = cursor.fetchall()
-    cursor.close()
-    conn.close()
-    
-    return render_template('business_report.html', data=data, report_type=report_type)
+    return render_template('business_report.html', data=data, report=slice_, drill=drill,
+                           dimensions=cube.DIMENSIONS, levels=list(cube.LEVELS), computed_at=computed_at)
+
+def leaderboard_args():
+    """Validated window, metric and limit from the query string, or None"""
+    board = {
+        'window': request.args.get('window', 30, type=int),
+        'metric': request.args.get('metric', 'commission'),
+        'limit': request.args.get('limit', leaderboard.DEFAULT_LIMIT, type=int),
+    }
+    if (board['window'] not in leaderboard.WINDOWS or board['metric'] not in leaderboard.METRICS
+            or not 1 <= board['limit'] <= leaderboard.MAX_LIMIT):
+        return None
+    return board
+
+@app.route('/reports/leaderboard')
+@login_required(role='admin')
+def agent_leaderboard():
+    board = leaderboard_args()
+    if not board:
+        flash('Invalid leaderboard selection', 'warning')
+        return redirect(url_for('agent_leaderboard'))
+    agents = leaderboard.board.top(board['window'], board['metric'], board['limit'])
+    return render_template('leaderboard.html', agents=agents, board=board, windows=leaderboard.WINDOWS,
+                           metrics=leaderboard.METRICS, loaded_at=leaderboard.board.loaded_at)
+
+@app.route('/api/leaderboard')
+@login_required(role='admin')
+def api_leaderboard():
+    board = leaderboard_args()
+    if not board:
+        return jsonify({'error': f'window must be one of {list(leaderboard.WINDOWS)}, metric one of '
+                                 f'{list(leaderboard.METRICS)}, limit 1-{leaderboard.MAX_LIMIT}'}), 400
+    return jsonify(dict(board, agents=leaderboard.board.top(board['window'], board['metric'], board['limit']),
+                        loaded_at=leaderboard.board.loaded_at))
+
+@app.route('/api/analytics/<report>')
+@login_required(role='admin')
+def api_analytics(report):
+    # Served from the memory-mapped snapshot (snapshot.py), never from the live tables
+    try:
+        snap = analytics.open_snapshot()
+    except analytics.SnapshotUnavailable as e:
+        return jsonify({'error': str(e)}), 503
+    group = request.args.get('group') if request.args.get('group') in cube.DIMENSIONS else None
+    if report == 'business':
+        data = analytics.business(snap, **cube.parse_slice(request.args))
+    elif report == 'commission':
+        data = analytics.commission_totals(snap, group or 'agent')
+    elif report == 'overdue':
+        data = analytics.overdue(snap, by=group)
+    elif report == 'collections':
+        slice_ = cube.parse_slice(request.args)
+        data = analytics.collections(snap, slice_['level'], slice_['start'], slice_['end'])
+    else:
+        return jsonify({'error': 'Unknown report'}), 404
+    return jsonify({'snapshot': snap.created, 'data': data})
+
+@app.route('/reports/business/export', methods=['POST'])
+@login_required(role='admin')
+def export_business_report():
+    params = {key: value for key, value in request.form.items() if value}
+    try:
+        job_id = job_runner.submit('business_report', params, session['user_id'])
+    except mysql.connector.Error as e:
+        flash(f'Could not start export: {str(e)}', 'danger')
+        return redirect(url_for('business_report', **params))
+    return redirect(url_for('job_status', job_id=job_id))
+
+def forecast_args(default_by=None, default_period='year'):
+    """Grouping (None for the whole company) and period from the query string, else the defaults"""
+    by = request.args.get('by', default_by) or None
+    period = request.args.get('period', default_period)
+    return (by if by is None or by in forecast.GROUPINGS else default_by,
+            period if period in forecast.PERIODS else default_period)
+
+@app.route('/reports/forecast')
+@login_required(role='admin')
+def forecast_report():
+    by, period = forecast_args()
+    # Projected from every shard's active policies; served from the cache while it refreshes
+    try:
+        projection, computed_at = forecast.cache.get(forecast.FORECAST_YEARS, forecast.project)
+    except forecast.ForecastUnavailable as e:
+        flash(str(e), 'danger')
+        return redirect(url_for('dashboard'))
+    for warning in projection.warnings:
+        flash(f'Forecast may be incomplete: {warning}', 'warning')
+    return render_template('forecast.html', rows=projection.rows(by, period), totals=projection.totals(),
+                           by=by, period=period, groupings=list(forecast.GROUPINGS),
+                           years=forecast.FORECAST_YEARS, computed_at=computed_at)
+
+@app.route('/reports/forecast/export')
+@login_required(role='admin')
+def export_forecast():
+    by, period = forecast_args('plan_branch', 'month')
+    try:
+        projection, computed_at = forecast.cache.get(forecast.FORECAST_YEARS, forecast.project)
+    except forecast.ForecastUnavailable as e:
+        flash(str(e), 'danger')
+        return redirect(url_for('dashboard'))
+    # An export must be complete, unlike the page which can show what it has
+    if projection.warnings:
+        flash(f"Could not export forecast: {'; '.join(projection.warnings)}", 'danger')
+        return redirect(url_for('forecast_report', by=by, period=period))
+    output = io.StringIO()
+    projection.write_csv(output, by, period)
+    filename = f"forecast-{computed_at[:10]}-{by or 'company'}-{period}.csv"
+    return Response(output.getvalue(), mimetype='text/csv',
+                    headers={'Content-Disposition': f'attachment; filename={filename}'})
+
+#  PROFILING (ADMIN) 
+
+# Not offered for profiling: static files and the profiling pages themselves
+PROFILING_EXEMPT = {'static', 'profiling', 'profile_result'}
+
+@app.route('/admin/profiling', methods=['GET', 'POST'])
+@login_required(role='admin')
+def profiling():
+    endpoints = sorted(endpoint for endpoint in app.view_functions if endpoint not in PROFILING_EXEMPT)
+    if request.method == 'POST':
+        if request.form.get('action') == 'stop':
+            profiler.requests.stop_run()
+            flash('Profiling stopped', 'success')
+            return redirect(url_for('profiling'))
+        chosen = [endpoint for endpoint in request.form.getlist('endpoints') if endpoint in endpoints]
+        try:
+            run = profiler.requests.start_run(chosen, float(request.form.get('percent', 10)) / 100,
+                                              request.form.get('mode', 'sample'),
+                                              float(request.form.get('minutes', 10)))
+        except ValueError as e:
+            flash(f'Could not start profiling: {str(e)}', 'danger')
+            return redirect(url_for('profiling'))
+        flash(f'Profiling run {run.id} started', 'success')
+        return redirect(url_for('profiling'))
+    profiler.requests.poll()
+    return render_template('profiling.html', endpoints=endpoints, active=profiler.requests.run,
+                           runs=profiler.runs(), modes=profiler.MODES, max_minutes=profiler.MAX_MINUTES)
+
+@app.route('/admin/profiling/<run_id>/<target>')
+@login_required(role='admin')
+def profile_result(run_id, target):
+    run = profiler.load_run(run_id)
+    if not run or target not in run.endpoints:
+        return render_template('404.html'), 404
+    if request.args.get('download'):
+        filename, data = profiler.export(run, target)
+        return Response(data, mimetype='application/octet-stream' if run.mode == 'cprofile' else 'text/plain',
+                        headers={'Content-Disposition': f'attachment; filename={filename}'})
+    return Response(profiler.summary(run, target), mimetype='text/plain')
+
+#  BACKGROUND JOBS 
+
+def get_own_job(job_id):
+    """Fetch a job if it belongs to the logged in user"""
+    job = job_runner.get(job_id)
+    if not job or job['Owner'] != session['user_id']:
+        return None
+    return job
+
+@app.route('/jobs')
+@login_required()
+def job_list():
+    return render_template('jobs.html', jobs=job_runner.list_for(session['user_id']) or [])
+
+@app.route('/jobs/<int:job_id>')
+@login_required()
+def job_status(job_id):
+    job = get_own_job(job_id)
+    if not job:
+        flash('Job not found', 'danger')
+        return redirect(url_for('job_list'))
+    return render_template('job.html', job=jobs.as_status(job))
+
+@app.route('/api/jobs/<int:job_id>')
+@login_required()
+def api_job_status(job_id):
+    job = get_own_job(job_id)
+    if not job:
+        return jsonify({'error': 'Job not found'}), 404
+    return jsonify(jobs.as_status(job))
+
+@app.route('/jobs/<int:job_id>/download')
+@login_required()
+def job_download(job_id):
+    job = get_own_job(job_id)
+    if not job or job['Status'] != jobs.DONE or not job['Result_path']:
+        flash('No result available for this job', 'warning')
+        return redirect(url_for('job_list'))
+    return send_from_directory(job_runner.result_dir, job['Result_path'], as_attachment=True)
 
 #  ERROR HANDLERS 
 
@@ -628,7 +1091,9 @@ def not_found(e):
 
 @app.errorhandler(500)
 def server_error(e):
+    if timeouts.is_timeout(getattr(e, 'original_exception', None)):
+        return timeout_response(g.get('budget'))
     return render_template('500.html'), 500
 
 if __name__ == '__main__':
-    app.run(debug=False, host='0.0.0.0', port=5000)
\ No newline at end of file
+    create_app().run(debug=False, host='0.0.0.0', port=5000)
\ No newline at end of file
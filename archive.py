@@ -0,0 +1,158 @@
+#!/usr/bin/env python3
+"""
+Cold Archival
+Moves fully matured policies (Status = 0, FUP IS NULL) with their holder and
+payments into the archive tables in small transactions, and maintains the
+yearly partitions of the Payment table. Every shard is processed in turn; a
+shard that cannot be reached is reported and the rest carry on.
+"""
+
+import argparse
+import sys
+import time
+from datetime import datetime
+
+import mysql.connector
+
+import shards
+
+DEFAULT_CHUNK_SIZE = 500
+
+POLICY_COLUMNS = "Policy_no, Plan_no, Agency_code, Premium, DOC, FUP, Status, Mode, Term, Sum_Assured, Created_at"
+HOLDER_COLUMNS = ("Policy_no, Name, Address, City, State, Pincode, Nominee_Name, Nominee_Relation, "
+                  "Gender, Occupation, DOB, Education")
+PAYMENT_COLUMNS = "Payment_id, Policy_no, Payment_Mode, Timestamp, Amount"
+
+def matured_batches(cursor, chunk_size=DEFAULT_CHUNK_SIZE):
+    """Yield lists of matured policy numbers, walking the primary key so each batch is an index range read"""
+    last = ''
+    while True:
+        cursor.execute("""SELECT Policy_no FROM Policy
+                          WHERE Policy_no > %s AND Status = 0 AND FUP IS NULL
+                          ORDER BY Policy_no LIMIT %s""", (last, chunk_size))
+        batch = [row[0] for row in cursor.fetchall()]
+        if not batch:
+            return
+        yield batch
+        last = batch[-1]
+
+def archive_chunk(conn, cursor, policy_nos):
+    """Copy a batch of policies to the archive and delete them from the live tables, atomically"""
+    placeholders = ', '.join(['%s'] * len(policy_nos))
+    conn.start_transaction()
+    try:
+        # Lock the batch and re-check it, in case a policy changed since it was listed
+        cursor.execute(f"""SELECT Policy_no FROM Policy WHERE Policy_no IN ({placeholders})
+                           AND Status = 0 AND FUP IS NULL FOR UPDATE""", policy_nos)
+        policy_nos = [row[0] for row in cursor.fetchall()]
+        if not policy_nos:
+            conn.rollback()
+            return 0, 0
+        placeholders = ', '.join(['%s'] * len(policy_nos))
+
+        cursor.execute(f"""INSERT INTO Payment_Archive ({PAYMENT_COLUMNS})
+                           SELECT {PAYMENT_COLUMNS} FROM Payment WHERE Policy_no IN ({placeholders})""", policy_nos)
+        payments = cursor.rowcount
+        cursor.execute(f"""INSERT INTO Policy_Holder_Archive ({HOLDER_COLUMNS})
+                           SELECT {HOLDER_COLUMNS} FROM Policy_Holder WHERE Policy_no IN ({placeholders})""", policy_nos)
+        cursor.execute(f"""INSERT INTO Policy_Archive ({POLICY_COLUMNS})
+                           SELECT {POLICY_COLUMNS} FROM Policy WHERE Policy_no IN ({placeholders})""", policy_nos)
+
+        # Payment has no foreign key to cascade from, so its rows go first
+        cursor.execute(f"DELETE FROM Payment WHERE Policy_no IN ({placeholders})", policy_nos)
+        # A matured policy takes no more payments, so its idempotency keys can go too
+        cursor.execute(f"DELETE FROM Payment_Request WHERE Policy_no IN ({placeholders})", policy_nos)
+        cursor.execute(f"DELETE FROM Policy WHERE Policy_no IN ({placeholders})", policy_nos)
+        conn.commit()
+    except mysql.connector.Error:
+        conn.rollback()
+        raise
+    return len(policy_nos), payments
+
+def archive_matured(shard, conn, chunk_size=DEFAULT_CHUNK_SIZE, progress=None):
+    """Archive every matured policy on a shard, one chunk per transaction. Returns (policies, payments) moved."""
+    # Separate connection for listing so its reads never hold locks in the archiving transaction
+    list_conn = shards.connect(shard)
+    list_cursor = list_conn.cursor()
+    cursor = conn.cursor()
+    policies = payments = 0
+    try:
+        for batch in matured_batches(list_cursor, chunk_size):
+            moved, moved_payments = archive_chunk(conn, cursor, batch)
+            policies += moved
+            payments += moved_payments
+            if progress:
+                progress(policies, payments)
+    finally:
+        list_cursor.close()
+        list_conn.close()
+        cursor.close()
+    return policies, payments
+
+def payment_partitions(cursor):
+    """Names and upper bounds of the Payment table's partitions"""
+    cursor.execute("""SELECT PARTITION_NAME, PARTITION_DESCRIPTION FROM information_schema.PARTITIONS
+                      WHERE TABLE_SCHEMA = DATABASE() AND TABLE_NAME = 'Payment'
+                      ORDER BY PARTITION_ORDINAL_POSITION""")
+    return cursor.fetchall()
+
+def add_payment_partitions(cursor, through_year):
+    """Split yearly partitions off the catch-all pmax partition up to through_year"""
+    existing = {name for name, _ in payment_partitions(cursor)}
+    added = []
+    for year in range(datetime.now().year, through_year + 1):
+        name = f'p{year}'
+        if name in existing:
+            continue
+        cursor.execute(f"""ALTER TABLE Payment REORGANIZE PARTITION pmax INTO (
+                           PARTITION {name} VALUES LESS THAN ({year + 1}),
+                           PARTITION pmax VALUES LESS THAN MAXVALUE)""")
+        added.append(name)
+    return added
+
+def main():
+    """Command line entry point"""
+    parser = argparse.ArgumentParser(description='Archive matured policies and maintain Payment partitions')
+    parser.add_argument('--chunk-size', type=int, default=DEFAULT_CHUNK_SIZE)
+    parser.add_argument('--partitions-through', type=int, metavar='YEAR',
+                        help='Make sure Payment has a partition for every year up to YEAR')
+    parser.add_argument('--skip-archive', action='store_true', help='Only maintain partitions')
+    args = parser.parse_args()
+
+    started = time.monotonic()
+    total_policies = total_payments = 0
+    unavailable = []
+    for shard in shards.SHARDS:
+        print(f"Shard {shard.name}:")
+        conn = None
+        try:
+            conn = shards.connect(shard)
+            if args.partitions_through:
+                cursor = conn.cursor()
+                added = add_payment_partitions(cursor, args.partitions_through)
+                cursor.close()
+                print(f"  ✓ Added partitions: {', '.join(added)}" if added else "  ✓ Payment partitions are up to date")
+
+            if not args.skip_archive:
+                def report(policies, payments):
+                    print(f"  ✓ {policies} policies, {payments} payments archived")
+
+                policies, payments = archive_matured(shard, conn, args.chunk_size, report)
+                total_policies += policies
+                total_payments += payments
+        except mysql.connector.Error as e:
+            print(f"  ✗ {shard.name} unavailable: {e}")
+            unavailable.append(shard.name)
+        finally:
+            if conn:
+                conn.close()
+
+    if not args.skip_archive:
+        print(f"Done in {time.monotonic() - started:.1f}s: {total_policies} policies and "
+              f"{total_payments} payments archived")
+    if unavailable:
+        print(f"✗ Not processed: {', '.join(unavailable)}")
+    return not unavailable
+
+if __name__ == '__main__':
+    sys.exit(0 if main() else 1)
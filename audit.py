@@ -0,0 +1,260 @@
+"""
+Audit Log
+Compliance record of plan changes, policy issuance and payments in the
+Audit_Log table. Writers only put the event on a bounded in-memory queue; a
+background thread in each process writes the queue out in batches with one
+executemany per batch, so auditing adds no database round trip to a request.
+When the database is unreachable, or too slow to keep up and the queue
+fills, events are appended to a local spill file instead and replayed once
+writes succeed again. Every event carries a unique id, so a replay that is
+interrupted and repeated never records an event twice.
+"""
+
+import atexit
+import glob
+import json
+import os
+import queue
+import threading
+import time
+import uuid
+from datetime import datetime
+
+import mysql.connector
+
+import db
+import signals
+
+QUEUE_SIZE = int(os.getenv('AUDIT_QUEUE_SIZE', 10000))
+FLUSH_SECONDS = float(os.getenv('AUDIT_FLUSH_SECONDS', 1.0))
+SPILL_DIR = os.getenv('AUDIT_SPILL_DIR', 'audit_spill')
+BATCH_SIZE = 500
+# How often spilled events are offered to the database again
+REPLAY_SECONDS = 30
+# How long an exiting process waits for the queue to be written before spilling the rest
+STOP_SECONDS = 5
+
+INSERT_QUERY = """INSERT INTO Audit_Log (Event_id, Event, Actor, Subject, Details, Occurred_at)
+                  VALUES (%s, %s, %s, %s, %s, %s)
+                  ON DUPLICATE KEY UPDATE Event_id = Event_id"""
+
+def encode(event):
+    """A queued event as an Audit_Log row"""
+    event_id, name, actor, subject, details, occurred = event
+    return event_id, name, actor, subject, json.dumps(details, default=str, sort_keys=True), occurred
+
+def spill_owner(path):
+    """Process id in a spill or replay file name (spill-<pid>.jsonl, replay-<pid>-<n>.jsonl)"""
+    return int(os.path.basename(path).split('-')[1].split('.')[0])
+
+def is_alive(pid):
+    try:
+        os.kill(pid, 0)
+    except ProcessLookupError:
+        return False
+    except PermissionError:
+        pass
+    return True
+
+class AuditLog:
+    """Bounded queue of events, a writer thread and the spill file behind it"""
+
+    def __init__(self, get_connection=db.get_connection, spill_dir=SPILL_DIR, queue_size=QUEUE_SIZE,
+                 batch_size=BATCH_SIZE, flush_seconds=FLUSH_SECONDS):
+        self.get_connection = get_connection
+        self.spill_dir = os.path.abspath(spill_dir)
+        self.queue_size = queue_size
+        self.batch_size = batch_size
+        self.flush_seconds = flush_seconds
+        self.written = 0
+        self.spilled = 0
+        self.replayed = 0
+        self._pid = None
+        self._queue = None
+        self._writing = []
+        self._thread = None
+        self._stopped = threading.Event()
+        self._start_lock = threading.Lock()
+        self._spill_lock = threading.Lock()
+
+    #  LIFECYCLE
+
+    def start(self):
+        """Start this process's writer thread (again after a fork)"""
+        with self._start_lock:
+            if self._pid == os.getpid() and self._thread and self._thread.is_alive():
+                return
+            first = self._pid is None
+            self._pid = os.getpid()
+            # Anything queued in the parent before a fork is the parent's to write
+            self._queue = queue.Queue(self.queue_size)
+            self._stopped = threading.Event()
+            self._spill_lock = threading.Lock()
+            self._thread = threading.Thread(target=self._run, name='audit-writer', daemon=True)
+            self._thread.start()
+            if first:
+                atexit.register(self.stop)
+
+    def stop(self, timeout=STOP_SECONDS):
+        """Write out what is queued; whatever is left after timeout goes to the spill file"""
+        if self._pid != os.getpid() or not self._thread:
+            return
+        self._stopped.set()
+        self._thread.join(timeout)
+        # A batch still being written may or may not commit; its event ids make spilling it too harmless
+        left = list(self._writing) if self._thread.is_alive() else []
+        while True:
+            try:
+                left.append(encode(self._queue.get_nowait()))
+            except queue.Empty:
+                break
+        if left:
+            self.spill(left)
+
+    def pending(self):
+        """Events queued in this process and not yet written"""
+        return self._queue.qsize() if self._pid == os.getpid() else 0
+
+    #  RECORDING
+
+    def record(self, event, actor, subject, **details):
+        """Queue an event; never waits on the database"""
+        if self._pid != os.getpid():
+            self.start()
+        item = (uuid.uuid4().hex, event, actor, str(subject), details, datetime.now())
+        try:
+            self._queue.put_nowait(item)
+        except queue.Full:
+            # The database is not keeping up; keep the event on local disk instead of waiting
+            self.spill([encode(item)])
+
+    def _take(self):
+        """The next batch: up to batch_size events, collected for at most flush_seconds"""
+        batch, deadline = [], None
+        while len(batch) < self.batch_size:
+            timeout = 0.2 if deadline is None else deadline - time.monotonic()
+            if timeout <= 0:
+                break
+            try:
+                batch.append(self._queue.get(timeout=min(timeout, 0.2)))
+            except queue.Empty:
+                if self._stopped.is_set() or (deadline is None and not batch):
+                    break
+                continue
+            if deadline is None:
+                deadline = time.monotonic() + self.flush_seconds
+        return batch
+
+    def _run(self):
+        replayed_at = time.monotonic()
+        self.replay()
+        while not self._stopped.is_set() or not self._queue.empty():
+            batch = self._take()
+            if batch:
+                rows = self._writing = [encode(event) for event in batch]
+                try:
+                    self.insert(rows)
+                    self.written += len(rows)
+                except mysql.connector.Error as e:
+                    print(f"Audit write failed, spilling {len(rows)} events: {e}")
+                    self.spill(rows)
+                self._writing = []
+            if not self._stopped.is_set() and time.monotonic() - replayed_at >= REPLAY_SECONDS:
+                replayed_at = time.monotonic()
+                self.replay()
+
+    #  DATABASE
+
+    def insert(self, rows):
+        """Write rows to Audit_Log in one transaction"""
+        conn = self.get_connection()
+        if not conn:
+            raise mysql.connector.Error('Database connection error')
+        cursor = conn.cursor()
+        try:
+            cursor.executemany(INSERT_QUERY, rows)
+            conn.commit()
+        except mysql.connector.Error:
+            conn.rollback()
+            raise
+        finally:
+            cursor.close()
+            conn.close()
+
+    #  SPILL FILE
+
+    @property
+    def spill_path(self):
+        return os.path.join(self.spill_dir, f'spill-{os.getpid()}.jsonl')
+
+    def spill(self, rows):
+        """Append rows to this process's spill file and force them to disk"""
+        with self._spill_lock:
+            os.makedirs(self.spill_dir, exist_ok=True)
+            with open(self.spill_path, 'a', encoding='utf-8') as f:
+                for event_id, name, actor, subject, details, occurred in rows:
+                    f.write(json.dumps([event_id, name, actor, subject, details, occurred.isoformat()]) + '\n')
+                f.flush()
+                os.fsync(f.fileno())
+        self.spilled += len(rows)
+
+    def _claim(self):
+        """Spill files to replay: this process's own, and any left by processes that have exited"""
+        pid = os.getpid()
+        claimed = []
+        for path in sorted(glob.glob(os.path.join(self.spill_dir, '*-*.jsonl'))):
+            owner = spill_owner(path)
+            if os.path.basename(path).startswith('replay-'):
+                if owner == pid or not is_alive(owner):
+                    claimed.append(path)
+                continue
+            if owner != pid and is_alive(owner):
+                # Still being appended to by its process
+                continue
+            target = os.path.join(self.spill_dir, f'replay-{pid}-{time.time_ns()}.jsonl')
+            with self._spill_lock:
+                try:
+                    os.rename(path, target)
+                except FileNotFoundError:
+                    continue  # another process claimed it first
+            claimed.append(target)
+        return claimed
+
+    def replay(self):
+        """Write spilled events to the database; files stay for the next try if it fails"""
+        if not os.path.isdir(self.spill_dir):
+            return 0
+        replayed = 0
+        for path in self._claim():
+            try:
+                with open(path, encoding='utf-8') as f:
+                    rows = [json.loads(line) for line in f if line.strip()]
+                for start in range(0, len(rows), self.batch_size):
+                    self.insert([(event_id, name, actor, subject, details, datetime.fromisoformat(occurred))
+                                 for event_id, name, actor, subject, details, occurred
+                                 in rows[start:start + self.batch_size]])
+            except mysql.connector.Error as e:
+                print(f"Audit replay of {os.path.basename(path)} failed: {e}")
+                break
+            except FileNotFoundError:
+                continue  # replayed by another process
+            try:
+                os.remove(path)
+            except FileNotFoundError:
+                pass
+            replayed += len(rows)
+        self.replayed += replayed
+        return replayed
+
+log = AuditLog()
+
+@signals.policies_issued.connect
+def _on_policies_issued(agency_code, policies):
+    for policy in policies:
+        log.record('policy_issued', agency_code, policy['policy_no'],
+                   premium=policy['premium'], term=policy['term'])
+
+@signals.payment_recorded.connect
+def _on_payment_recorded(agency_code, payment):
+    log.record('payment_recorded', agency_code, payment.policy_no, payment_id=payment.payment_id,
+               amount=payment.amount, previous_fup=payment.previous_fup, next_fup=payment.next_fup)
@@ -0,0 +1,326 @@
+#!/usr/bin/env python3
+"""
+Bulk Policy Import
+Streams a CSV of applicants, validates each row against plan rules and issues
+policies in chunked transactions using executemany
+"""
+
+import argparse
+import csv
+import os
+import sys
+import time
+from datetime import datetime
+
+import mysql.connector
+from dotenv import load_dotenv
+
+import audit  # records issued policies, also when run from the command line
+import shards
+import signals
+from policy_rules import POLICY_NO_START, allocate_policy_numbers, calculate_age, calculate_premium, validate_policy
+from schedule import first_due
+
+# CSV columns, named after the fields of the policy form
+COLUMNS = [
+    'plan_no', 'term', 'sum_assured', 'mode', 'name', 'dob', 'gender', 'occupation',
+    'education', 'address', 'city', 'state', 'pincode', 'nominee_name', 'nominee_relation'
+]
+REQUIRED = ['plan_no', 'term', 'sum_assured', 'mode', 'name', 'dob', 'gender', 'address',
+            'city', 'state', 'pincode', 'nominee_name', 'nominee_relation']
+MODES = {'Yearly', 'Half-yearly', 'Quarterly', 'Monthly'}
+GENDERS = {'Male', 'Female', 'Other'}
+ERROR_COLUMNS = ['line', 'error'] + COLUMNS
+
+DEFAULT_CHUNK_SIZE = 1000
+
+POLICY_QUERY = """INSERT INTO Policy (Policy_no, Plan_no, Agency_code, Premium, DOC, FUP, Status, Mode, Term, Sum_Assured)
+                  VALUES (%s, %s, %s, %s, %s, %s, 1, %s, %s, %s)"""
+
+HOLDER_QUERY = """INSERT INTO Policy_Holder (Policy_no, Name, Address, City, State, Pincode,
+                  Nominee_Name, Nominee_Relation, Gender, Occupation, DOB, Education)
+                  VALUES (%s, %s, %s, %s, %s, %s, %s, %s, %s, %s, %s, %s)"""
+
+class ImportResult:
+    """Running totals of an import"""
+
+    def __init__(self):
+        self.processed = 0
+        self.imported = 0
+        self.failed = 0
+        self.first_policy_no = None
+        self.last_policy_no = None
+        self.started = time.monotonic()
+
+    @property
+    def elapsed(self):
+        return time.monotonic() - self.started
+
+    @property
+    def rate(self):
+        """Imported policies per minute"""
+        return self.imported * 60 / self.elapsed if self.elapsed else 0.0
+
+    def as_dict(self):
+        return {
+            'processed': self.processed,
+            'imported': self.imported,
+            'failed': self.failed,
+            'first_policy_no': self.first_policy_no,
+            'last_policy_no': self.last_policy_no,
+            'elapsed': round(self.elapsed, 2),
+            'per_minute': round(self.rate),
+        }
+
+def load_plans(cursor):
+    """All plans keyed by Plan_no, fetched once per import"""
+    cursor.execute("SELECT * FROM Plan")
+    return {plan['Plan_no']: plan for plan in cursor.fetchall()}
+
+def parse_row(row, plans, today):
+    """Validate one CSV row, returns (application, errors)"""
+    missing = [col for col in REQUIRED if not (row.get(col) or '').strip()]
+    if missing:
+        return None, [f"Missing value for: {', '.join(missing)}"]
+
+    plan = plans.get(row['plan_no'].strip())
+    if not plan:
+        return None, ['Invalid Plan selected']
+
+    try:
+        term = int(row['term'])
+        sum_assured = float(row['sum_assured'])
+        dob = datetime.strptime(row['dob'].strip(), '%Y-%m-%d')
+    except ValueError as e:
+        return None, [f'Invalid value: {e}']
+
+    mode = row['mode'].strip()
+    if mode not in MODES:
+        return None, [f"Mode must be one of: {', '.join(sorted(MODES))}"]
+    if row['gender'].strip() not in GENDERS:
+        return None, [f"Gender must be one of: {', '.join(sorted(GENDERS))}"]
+
+    errors = validate_policy(plan, calculate_age(dob, today), term, sum_assured)
+    if errors:
+        return None, errors
+
+    application = {
+        'plan_no': plan['Plan_no'],
+        'term': term,
+        'sum_assured': sum_assured,
+        'mode': mode,
+        'premium': calculate_premium(sum_assured, term, mode),
+        'dob': dob.strftime('%Y-%m-%d'),
+    }
+    for col in ('name', 'address', 'city', 'state', 'pincode', 'nominee_name',
+                'nominee_relation', 'gender', 'occupation', 'education'):
+        application[col] = (row.get(col) or '').strip()
+    return application, []
+
+def insert_chunk(conn, cursor, applications, agency_code, doc, fup, before_commit=None, policy_start=POLICY_NO_START):
+    """Issue one chunk of validated applications in a single transaction"""
+    conn.start_transaction()
+    try:
+        policy_nos = allocate_policy_numbers(cursor, len(applications), policy_start)
+        cursor.executemany(POLICY_QUERY, [
+            (policy_no, a['plan_no'], agency_code, a['premium'], doc, fup, a['mode'], a['term'], a['sum_assured'])
+            for policy_no, a in zip(policy_nos, applications)
+        ])
+        cursor.executemany(HOLDER_QUERY, [
+            (policy_no, a['name'], a['address'], a['city'], a['state'], a['pincode'],
+             a['nominee_name'], a['nominee_relation'], a['gender'], a['occupation'], a['dob'], a['education'])
+            for policy_no, a in zip(policy_nos, applications)
+        ])
+        if before_commit:
+            before_commit(cursor)
+        conn.commit()
+    except mysql.connector.Error:
+        conn.rollback()
+        raise
+    signals.policies_issued.send(agency_code, policies=[
+        {'policy_no': policy_no, 'premium': a['premium'], 'term': a['term']}
+        for policy_no, a in zip(policy_nos, applications)
+    ])
+    return policy_nos
+
+def import_policies(conn, rows, agency_code, chunk_size=DEFAULT_CHUNK_SIZE, error_writer=None, progress=None,
+                    skip=0, checkpoint=None, policy_start=POLICY_NO_START):
+    """Import applicant rows (dicts keyed by COLUMNS) for an agent.
+
+    Rows are validated as they stream in and issued in chunks of
+    `chunk_size`, each in its own transaction. Rejected rows are written to
+    `error_writer` (a csv.DictWriter over ERROR_COLUMNS) and `progress` is
+    called with the running ImportResult after every chunk.
+
+    To resume an interrupted import pass the number of rows already handled
+    as `skip`. `checkpoint(cursor, rows_handled)` runs inside each chunk's
+    transaction, so the saved resume point commits together with the policies.
+    `policy_start` is the floor of the shard's policy number block.
+    """
+    result = ImportResult()
+    cursor = conn.cursor(dictionary=True)
+    plans = load_plans(cursor)
+    # Autocommit is off, so reading the plans opened a transaction; each chunk starts its own
+    conn.commit()
+
+    today = datetime.today()
+    doc = today.strftime('%Y-%m-%d')
+    fup = first_due(today).strftime('%Y-%m-%d')
+
+    def reject(line, row, error):
+        result.failed += 1
+        if error_writer:
+            record = {col: row.get(col, '') for col in COLUMNS}
+            record.update(line=line, error=error)
+            error_writer.writerow(record)
+
+    saved = skip
+
+    def flush(pending):
+        nonlocal saved
+        applications = [a for _, _, a in pending]
+        handled = skip + result.processed
+        before_commit = (lambda cur: checkpoint(cur, handled)) if checkpoint else None
+        try:
+            policy_nos = insert_chunk(conn, cursor, applications, agency_code, doc, fup, before_commit, policy_start)
+        except mysql.connector.Error as e:
+            for line, row, _ in pending:
+                reject(line, row, f'Database error: {e}')
+        else:
+            saved = handled
+            result.imported += len(policy_nos)
+            result.first_policy_no = result.first_policy_no or policy_nos[0]
+            result.last_policy_no = policy_nos[-1]
+        if progress:
+            progress(result)
+
+    pending = []
+    # Line 1 is the CSV header
+    for line, row in enumerate(rows, start=2):
+        if line - 2 < skip:
+            continue
+        result.processed += 1
+        application, errors = parse_row(row, plans, today)
+        if errors:
+            reject(line, row, '; '.join(errors))
+            continue
+        pending.append((line, row, application))
+        if len(pending) >= chunk_size:
+            flush(pending)
+            pending = []
+
+    if pending:
+        flush(pending)
+    if skip + result.processed > saved:
+        # Rows rejected after the last chunk, already in the error file, move the resume point too
+        if checkpoint:
+            checkpoint(cursor, skip + result.processed)
+            conn.commit()
+        if progress:
+            progress(result)
+
+    cursor.close()
+    return result
+
+def trim_errors(error_path, handled):
+    """Drop rejected rows past a resume point from an error file; the resumed import rejects them again"""
+    if not os.path.exists(error_path):
+        return
+    work = error_path + '.tmp'
+    with open(error_path, newline='', encoding='utf-8') as src, open(work, 'w', newline='', encoding='utf-8') as dst:
+        writer = csv.DictWriter(dst, fieldnames=ERROR_COLUMNS, extrasaction='ignore')
+        writer.writeheader()
+        # Line 1 is the CSV header, so row n of the upload is line n + 2
+        writer.writerows(record for record in csv.DictReader(src) if int(record['line']) < handled + 2)
+    os.replace(work, error_path)
+
+def import_csv(conn, csv_file, agency_code, error_file=None, chunk_size=DEFAULT_CHUNK_SIZE, progress=None,
+               skip=0, checkpoint=None, policy_start=POLICY_NO_START):
+    """Import from an open text stream, writing rejected rows to error_file"""
+    reader = csv.DictReader(csv_file)
+    error_writer = None
+    if error_file is not None:
+        error_writer = csv.DictWriter(error_file, fieldnames=ERROR_COLUMNS, extrasaction='ignore')
+        if not skip:
+            error_writer.writeheader()
+    return import_policies(conn, reader, agency_code, chunk_size, error_writer, progress, skip, checkpoint,
+                           policy_start)
+
+def import_job(ctx, conn):
+    """Background job: import an uploaded CSV, resuming after the last committed chunk.
+
+    When the agent's policies live on another shard than the Job table, the
+    resume point is saved right after each chunk commits instead of inside
+    its transaction, so a crash in between can re-issue that one chunk.
+    """
+    csv_path = ctx.params['path']
+    agency_code = ctx.params['agency_code']
+    error_path = ctx.result_path('errors.csv')
+    shard = shards.shard_for(agency_code)
+    local = shards.is_home(shard)
+
+    resume_from = ctx.checkpoint
+    if resume_from:
+        # Rows rejected after the saved checkpoint are read and written again
+        trim_errors(error_path, resume_from)
+
+    with open(csv_path, newline='', encoding='utf-8-sig') as f:
+        total = max(sum(1 for _ in f) - 1, 0)
+    ctx.progress(resume_from, total, 'Importing', force=True)
+
+    def report(result):
+        if not local:
+            ctx.checkpoint = resume_from + result.processed
+            ctx.runner.update(ctx.job_id, Checkpoint=ctx.checkpoint)
+        ctx.progress(resume_from + result.processed, total,
+                     f'{result.imported} issued, {result.failed} rejected')
+
+    shard_conn = conn if local else shards.connect(shard)
+    try:
+        with open(csv_path, newline='', encoding='utf-8-sig') as csv_file, \
+                open(error_path, 'a' if resume_from else 'w', newline='', encoding='utf-8') as error_file:
+            result = import_csv(shard_conn, csv_file, agency_code, error_file, progress=report, skip=resume_from,
+                                checkpoint=ctx.save_checkpoint if local else None, policy_start=shard.policy_start)
+    finally:
+        if not local:
+            shard_conn.close()
+
+    ctx.progress(total, total, f'{result.imported} issued, {result.failed} rejected', force=True)
+
+def main():
+    """Command line entry point"""
+    load_dotenv()
+
+    parser = argparse.ArgumentParser(description='Bulk issue policies from a CSV of applicants')
+    parser.add_argument('csv_path', help='CSV file with columns: ' + ', '.join(COLUMNS))
+    parser.add_argument('--agent', required=True, help='Agency code the policies are issued under')
+    parser.add_argument('--chunk-size', type=int, default=DEFAULT_CHUNK_SIZE)
+    parser.add_argument('--errors', help='Where to write rejected rows (default: <csv>.errors.csv)')
+    args = parser.parse_args()
+
+    error_path = args.errors or os.path.splitext(args.csv_path)[0] + '.errors.csv'
+
+    # Policies are issued on the shard that holds the agent
+    shard = shards.shard_for(args.agent)
+    conn = mysql.connector.connect(**shard.config)
+
+    def report(result):
+        print(f"  ✓ {result.processed} rows read, {result.imported} issued, "
+              f"{result.failed} rejected ({result.rate:,.0f} policies/min)")
+
+    print(f"Importing {args.csv_path} for agent {args.agent}...")
+    with open(args.csv_path, newline='', encoding='utf-8-sig') as csv_file, \
+            open(error_path, 'w', newline='', encoding='utf-8') as error_file:
+        result = import_csv(conn, csv_file, args.agent, error_file, args.chunk_size, report,
+                            policy_start=shard.policy_start)
+    conn.close()
+
+    print(f"Done in {result.elapsed:.1f}s: {result.imported} issued, {result.failed} rejected")
+    if result.imported:
+        print(f"Policy numbers {result.first_policy_no} - {result.last_policy_no}")
+    if result.failed:
+        print(f"Rejected rows written to {error_path}")
+    return result.failed == 0
+
+if __name__ == '__main__':
+    sys.exit(0 if main() else 1)
@@ -0,0 +1,162 @@
+"""
+Business Cube
+Pre-aggregated policy business per day, branch, admin, agent, plan and mode.
+The cube is refreshed incrementally from policies issued since the last
+refresh, so a report slice reads a few cube rows instead of scanning Policy.
+"""
+
+from datetime import date, datetime, timedelta
+
+import mysql.connector
+
+DIMENSIONS = {
+    'branch': 'Branch_id',
+    'admin': 'Admin_id',
+    'agent': 'Agency_code',
+    'plan': 'Plan_no',
+    'mode': 'Mode',
+}
+
+LEVELS = {
+    'year': "DATE_FORMAT(Day, '%Y')",
+    'month': "DATE_FORMAT(Day, '%Y-%m')",
+    'day': "DATE_FORMAT(Day, '%Y-%m-%d')",
+}
+DRILL_DOWN = {'year': 'month', 'month': 'day'}
+
+AGGREGATE = """SELECT p.DOC, a.Branch_id, COALESCE(a.Admin_id, ''), p.Agency_code, p.Plan_no, p.Mode,
+               COUNT(*), SUM(p.Premium), SUM(p.Sum_Assured), SUM(COM(p.Premium, p.Term))
+               FROM {source} p JOIN Agent a ON a.Agency_code = p.Agency_code
+               WHERE p.Policy_no > %s AND p.Policy_no <= %s
+               GROUP BY p.DOC, a.Branch_id, a.Admin_id, p.Agency_code, p.Plan_no, p.Mode"""
+
+UPSERT = """INSERT INTO Business_Cube (Day, Branch_id, Admin_id, Agency_code, Plan_no, Mode,
+            Policy_Count, Premium_Total, Sum_Assured_Total, Commission_Total)
+            {select}
+            ON DUPLICATE KEY UPDATE
+                Policy_Count = Policy_Count + VALUES(Policy_Count),
+                Premium_Total = Premium_Total + VALUES(Premium_Total),
+                Sum_Assured_Total = Sum_Assured_Total + VALUES(Sum_Assured_Total),
+                Commission_Total = Commission_Total + VALUES(Commission_Total)"""
+
+CUBE_NAME = 'business'
+
+def watermark(cursor, lock=False):
+    """Highest Policy_no already folded into the cube"""
+    cursor.execute("SELECT Last_policy_no FROM Cube_State WHERE Cube = %s" + (" FOR UPDATE" if lock else ""),
+                   (CUBE_NAME,))
+    row = cursor.fetchone()
+    return row[0] if row else ''
+
+def refresh(conn, rebuild=False):
+    """Fold policies issued since the last refresh into the cube, returns the new watermark.
+
+    Policy numbers are allocated under a lock on the highest key, so they
+    commit in order and everything up to the current maximum can be folded
+    in safely. A rebuild starts over from live and archived policies.
+    """
+    cursor = conn.cursor()
+    try:
+        cursor.execute("SELECT MAX(Policy_no) FROM Policy")
+        latest = cursor.fetchone()[0] or ''
+        current = watermark(cursor)
+        if not rebuild and latest <= current:
+            return latest
+        # The first build also has to pick up policies that were archived before the cube existed
+        rebuild = rebuild or not current
+
+        # Autocommit is off, so the checks above opened a read transaction
+        conn.rollback()
+        conn.start_transaction()
+        # Serialise refreshes; a concurrent one may already have done the work
+        last = '' if rebuild else watermark(cursor, lock=True)
+        if rebuild:
+            watermark(cursor, lock=True)
+            cursor.execute("DELETE FROM Business_Cube")
+            cursor.execute(UPSERT.format(select=AGGREGATE.format(source='Policy_Archive')), ('', '999999999'))
+        if latest > last:
+            cursor.execute(UPSERT.format(select=AGGREGATE.format(source='Policy')), (last, latest))
+        cursor.execute("""INSERT INTO Cube_State (Cube, Last_policy_no, Refreshed_at) VALUES (%s, %s, NOW())
+                          ON DUPLICATE KEY UPDATE Last_policy_no = GREATEST(Last_policy_no, VALUES(Last_policy_no)),
+                          Refreshed_at = NOW()""", (CUBE_NAME, latest))
+        conn.commit()
+        return latest
+    except mysql.connector.Error:
+        conn.rollback()
+        raise
+    finally:
+        cursor.close()
+
+def parse_slice(args):
+    """Validated slice parameters from a request's query string"""
+    level = args.get('level') or {'monthly': 'month'}.get(args.get('type'), 'year')
+    if level not in LEVELS:
+        level = 'year'
+    group = args.get('group') if args.get('group') in DIMENSIONS else None
+    start = _parse_date(args.get('start'))
+    end = _parse_date(args.get('end'))
+    filters = {dim: args.get(dim) for dim in DIMENSIONS if args.get(dim)}
+    return {'level': level, 'group': group, 'start': start, 'end': end, 'filters': filters}
+
+def _parse_date(value):
+    try:
+        return datetime.strptime(value, '%Y-%m-%d').date() if value else None
+    except ValueError:
+        return None
+
+def query(cursor, level='year', group=None, start=None, end=None, filters=None):
+    """Policy count, premium and commission per period (and per group), newest first"""
+    period = LEVELS[level]
+    columns = [f"{period} as Period"]
+    group_by = [period]
+    if group:
+        columns.append(f"{DIMENSIONS[group]} as Dimension")
+        group_by.append(DIMENSIONS[group])
+
+    where, params = [], []
+    if start:
+        where.append("Day >= %s")
+        params.append(start)
+    if end:
+        where.append("Day <= %s")
+        params.append(end)
+    for dim, value in (filters or {}).items():
+        where.append(f"{DIMENSIONS[dim]} = %s")
+        params.append(value)
+
+    sql = f"""SELECT {', '.join(columns)}, SUM(Policy_Count) as Policy_Count,
+              SUM(Premium_Total) as Premium_Total, SUM(Commission_Total) as Total_Commission
+              FROM Business_Cube
+              {'WHERE ' + ' AND '.join(where) if where else ''}
+              GROUP BY {', '.join(group_by)}
+              ORDER BY Period DESC{', Dimension' if group else ''}"""
+    cursor.execute(sql, params)
+    return cursor.fetchall()
+
+def period_bounds(level, period):
+    """First and last day covered by a period label, used to drill down into it"""
+    if level == 'year':
+        year = int(period)
+        return date(year, 1, 1), date(year, 12, 31)
+    if level == 'month':
+        first = datetime.strptime(period, '%Y-%m').date()
+        following = (first.replace(day=28) + timedelta(days=4)).replace(day=1)
+        return first, following - timedelta(days=1)
+    day = datetime.strptime(period, '%Y-%m-%d').date()
+    return day, day
+
+def merge(parts):
+    """Combine query() results from several shards, summing rows for the same period (and group)"""
+    merged = {}
+    for rows in parts:
+        for row in rows:
+            key = (row['Period'], row.get('Dimension'))
+            if key not in merged:
+                merged[key] = dict(row)
+                continue
+            total = merged[key]
+            for measure in ('Policy_Count', 'Premium_Total', 'Total_Commission'):
+                total[measure] = (total[measure] or 0) + (row[measure] or 0)
+    # Same order as query(): newest period first, then by group
+    data = sorted(merged.values(), key=lambda row: str(row.get('Dimension') or ''))
+    return sorted(data, key=lambda row: row['Period'], reverse=True)
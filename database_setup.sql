@@ -100,15 +100,154 @@ CREATE TABLE Policy_Holder (
 ) ENGINE=InnoDB;
 
 -- Payment Table
+-- Range-partitioned by year so date-bounded queries only read the partitions they need.
+-- MySQL does not allow foreign keys on partitioned tables, and every unique key must
+-- include the partitioning column: Policy_no integrity is kept by the application and
+-- payments are deleted explicitly when a policy is archived.
 CREATE TABLE Payment (
-    Payment_id INT AUTO_INCREMENT PRIMARY KEY,
+    Payment_id INT AUTO_INCREMENT,
     Policy_no CHAR(9) NOT NULL,
     Payment_Mode VARCHAR(50) NOT NULL,
     Timestamp DATETIME NOT NULL,
     Amount DECIMAL(12,2) NOT NULL,
-    FOREIGN KEY (Policy_no) REFERENCES Policy(Policy_no) ON DELETE CASCADE,
+    PRIMARY KEY (Payment_id, Timestamp),
     INDEX idx_policy (Policy_no),
     INDEX idx_timestamp (Timestamp)
+) ENGINE=InnoDB
+PARTITION BY RANGE (YEAR(Timestamp)) (
+    PARTITION p2022 VALUES LESS THAN (2023),
+    PARTITION p2023 VALUES LESS THAN (2024),
+    PARTITION p2024 VALUES LESS THAN (2025),
+    PARTITION p2025 VALUES LESS THAN (2026),
+    PARTITION p2026 VALUES LESS THAN (2027),
+    PARTITION p2027 VALUES LESS THAN (2028),
+    PARTITION pmax VALUES LESS THAN MAXVALUE
+);
+
+-- ==================== ARCHIVE TABLES ====================
+-- Fully matured policies (Status = 0, FUP IS NULL) are moved here by archive.py
+-- together with their holder and payments, keeping the live tables small.
+
+CREATE TABLE Policy_Archive (
+    Policy_no CHAR(9) PRIMARY KEY,
+    Plan_no CHAR(3) NOT NULL,
+    Agency_code CHAR(7) NOT NULL,
+    Premium DECIMAL(12,2) NOT NULL,
+    DOC DATE NOT NULL,
+    FUP DATE,
+    Status TINYINT DEFAULT 0,
+    Mode ENUM('Yearly', 'Half-yearly', 'Quarterly', 'Monthly') NOT NULL,
+    Term INT NOT NULL,
+    Sum_Assured DECIMAL(12,2) NOT NULL,
+    Created_at TIMESTAMP NULL,
+    Archived_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
+    INDEX idx_archive_agent (Agency_code),
+    INDEX idx_archive_doc (DOC)
+) ENGINE=InnoDB;
+
+CREATE TABLE Policy_Holder_Archive (
+    Policy_no CHAR(9) PRIMARY KEY,
+    Name VARCHAR(100) NOT NULL,
+    Address VARCHAR(255) NOT NULL,
+    City VARCHAR(50) NOT NULL,
+    State VARCHAR(50) NOT NULL,
+    Pincode VARCHAR(10) NOT NULL,
+    Nominee_Name VARCHAR(100) NOT NULL,
+    Nominee_Relation VARCHAR(50) NOT NULL,
+    Gender ENUM('Male', 'Female', 'Other') NOT NULL,
+    Occupation VARCHAR(100),
+    DOB DATE NOT NULL,
+    Education VARCHAR(100)
+) ENGINE=InnoDB;
+
+CREATE TABLE Payment_Archive (
+    Payment_id INT NOT NULL,
+    Policy_no CHAR(9) NOT NULL,
+    Payment_Mode VARCHAR(50) NOT NULL,
+    Timestamp DATETIME NOT NULL,
+    Amount DECIMAL(12,2) NOT NULL,
+    PRIMARY KEY (Payment_id, Timestamp),
+    INDEX idx_archive_policy (Policy_no),
+    INDEX idx_archive_timestamp (Timestamp)
+) ENGINE=InnoDB;
+
+-- ==================== REPORTING CUBE ====================
+-- Policy business pre-aggregated per issue day and dimension, maintained by cube.py.
+-- Rows are folded in incrementally from policies newer than Cube_State.Last_policy_no.
+
+CREATE TABLE Business_Cube (
+    Day DATE NOT NULL,
+    Branch_id VARCHAR(20) NOT NULL,
+    Admin_id CHAR(5) NOT NULL DEFAULT '',
+    Agency_code CHAR(7) NOT NULL,
+    Plan_no CHAR(3) NOT NULL,
+    Mode ENUM('Yearly', 'Half-yearly', 'Quarterly', 'Monthly') NOT NULL,
+    Policy_Count INT NOT NULL DEFAULT 0,
+    Premium_Total DECIMAL(16,2) NOT NULL DEFAULT 0,
+    Sum_Assured_Total DECIMAL(18,2) NOT NULL DEFAULT 0,
+    Commission_Total DECIMAL(16,2) NOT NULL DEFAULT 0,
+    PRIMARY KEY (Day, Agency_code, Plan_no, Mode),
+    INDEX idx_cube_branch (Branch_id, Day),
+    INDEX idx_cube_admin (Admin_id, Day),
+    INDEX idx_cube_agent (Agency_code, Day),
+    INDEX idx_cube_plan (Plan_no, Day)
+) ENGINE=InnoDB;
+
+CREATE TABLE Cube_State (
+    Cube VARCHAR(50) PRIMARY KEY,
+    Last_policy_no CHAR(9) NOT NULL DEFAULT '',
+    Refreshed_at DATETIME
+) ENGINE=InnoDB;
+
+-- Payment Request Table
+-- Client idempotency keys: a repeated payment submit finds its key here and gets the
+-- payment that was already recorded instead of paying twice.
+CREATE TABLE Payment_Request (
+    Request_key VARCHAR(64) PRIMARY KEY,
+    Policy_no CHAR(9) NOT NULL,
+    Payment_id INT,
+    Created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
+    INDEX idx_request_policy (Policy_no),
+    INDEX idx_request_created (Created_at)
+) ENGINE=InnoDB;
+
+-- Audit Log Table
+-- Plan changes, policy issuance and payments, written in batches by audit.py
+CREATE TABLE Audit_Log (
+    Audit_id BIGINT AUTO_INCREMENT PRIMARY KEY,
+    Event_id CHAR(32) NOT NULL COMMENT 'Unique per event, so replays never record it twice',
+    Event VARCHAR(30) NOT NULL,
+    Actor VARCHAR(7) NOT NULL COMMENT 'Admin_id or Agency_code',
+    Subject VARCHAR(20) NOT NULL COMMENT 'Plan_no or Policy_no',
+    Details TEXT NOT NULL COMMENT 'JSON encoded event fields',
+    Occurred_at DATETIME(6) NOT NULL,
+    Logged_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
+    UNIQUE KEY uq_audit_event (Event_id),
+    INDEX idx_audit_subject (Subject, Occurred_at),
+    INDEX idx_audit_actor (Actor, Occurred_at)
+) ENGINE=InnoDB;
+
+-- Background Job Table
+CREATE TABLE Job (
+    Job_id INT AUTO_INCREMENT PRIMARY KEY,
+    Kind VARCHAR(50) NOT NULL,
+    Params TEXT NOT NULL COMMENT 'JSON encoded job parameters',
+    Owner VARCHAR(7) NOT NULL COMMENT 'Admin_id or Agency_code of the requester',
+    Status ENUM('queued', 'running', 'done', 'failed') NOT NULL DEFAULT 'queued',
+    Progress INT NOT NULL DEFAULT 0,
+    Total INT,
+    Message VARCHAR(255),
+    `Checkpoint` INT NOT NULL DEFAULT 0 COMMENT 'Resume point saved by the job',
+    Result_path VARCHAR(255),
+    Attempts INT NOT NULL DEFAULT 0,
+    Worker VARCHAR(100),
+    Heartbeat DATETIME,
+    Created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
+    Started_at DATETIME,
+    Finished_at DATETIME,
+    Run_after DATETIME COMMENT 'Not claimed before this time, set when a failed job is retried later',
+    INDEX idx_job_status (Status, Job_id),
+    INDEX idx_job_owner (Owner, Job_id)
 ) ENGINE=InnoDB;
 
 -- ==================== STORED FUNCTIONS ====================
@@ -247,6 +386,8 @@ ORDER BY pm.Timestamp DESC;
 CREATE INDEX idx_policy_fup_status ON Policy(FUP, Status);
 CREATE INDEX idx_payment_timestamp ON Payment(Timestamp);
 CREATE INDEX idx_policy_doc_year ON Policy((YEAR(DOC)));
+-- Covers the dashboard summary aggregates (summary.py), so they never read Policy rows
+CREATE INDEX idx_policy_agent_summary ON Policy(Agency_code, Status, FUP, Premium, Term);
 
 -- ==================== GRANTS ====================
 -- Grant privileges (adjust username/password as needed)
@@ -0,0 +1,190 @@
+"""
+Database Connections
+Per-process MySQL connection pool. The pool is created lazily on first use,
+rebuilt in every forked worker, and retried in the background with backoff
+while the database is unreachable. With DB_BACKEND=sqlite connections come
+from sqlite_backend.py instead, so the app runs without a MySQL server.
+"""
+
+import functools
+import os
+import re
+import threading
+import time
+
+import mysql.connector
+from mysql.connector import pooling
+from dotenv import load_dotenv
+
+import timeouts
+
+load_dotenv()
+
+db_config = {
+    'host': os.getenv('DB_HOST', 'localhost'),
+    'user': os.getenv('DB_USER', 'root'),
+    'password': os.getenv('DB_PASS', ''),
+    'database': os.getenv('DB_NAME', 'claude_db'),
+}
+POOL_SIZE = int(os.getenv('DB_POOL_SIZE', 10))
+# 'mysql', or 'sqlite' for tests, profiles and benchmarks
+BACKEND = os.getenv('DB_BACKEND', 'mysql').lower()
+
+# Backoff between pool creation attempts while the database is down
+RETRY_MIN_DELAY = 1.0
+RETRY_MAX_DELAY = 60.0
+
+_pool = None
+_pool_pid = None
+_lock = threading.Lock()
+_retry_thread = None
+
+class SessionConnection(pooling.PooledMySQLConnection):
+    """A pooled connection that keeps its session when returned to the pool"""
+
+    def close(self):
+        timeouts.watchdog.returned(self)
+        cnx = self._cnx
+        try:
+            # Whatever the borrower left uncommitted, including the snapshot its reads began,
+            # must not carry over to the next request
+            cnx.rollback()
+        except mysql.connector.Error as e:
+            # A dead connection has nothing to roll back; raising here would hide the request's own
+            # error during teardown, and the pool reconnects it on the next checkout
+            print(f"Rollback on returning a connection failed: {e}")
+        finally:
+            self._cnx_pool.add_connection(cnx)
+            self._cnx = None
+
+class SessionPool(pooling.MySQLConnectionPool):
+    """Connection pool that rolls back instead of resetting sessions on return.
+
+    A session reset (COM_RESET_CONNECTION) would also deallocate the
+    session's prepared statements (statements.py) every time a request
+    finishes. The app keeps no other session state.
+    """
+
+    def __init__(self, **kwargs):
+        super().__init__(pool_reset_session=False, **kwargs)
+
+    def get_connection(self):
+        pooled = super().get_connection()
+        cnx, pooled._cnx = pooled._cnx, None
+        conn = SessionConnection(self, cnx)
+        # Leased to the current request's time budget, if it has one
+        budget = timeouts.watchdog.borrowed(
+            conn, functools.partial(timeouts.kill_query, self._cnx_config, cnx.connection_id))
+        try:
+            timeouts.limit_session(cnx, budget)
+        except mysql.connector.Error:
+            conn.close()
+            raise
+        return conn
+
+def _create_pool():
+    return SessionPool(pool_name=f'insurance_pool_{os.getpid()}', pool_size=POOL_SIZE, **db_config)
+
+def _retry_loop():
+    """Keep trying to build the pool, doubling the delay after each failure"""
+    global _pool, _pool_pid, _retry_thread
+    delay = RETRY_MIN_DELAY
+    while True:
+        time.sleep(delay)
+        try:
+            pool = _create_pool()
+        except mysql.connector.Error as e:
+            delay = min(delay * 2, RETRY_MAX_DELAY)
+            print(f"Database still unavailable ({e}), retrying in {delay:.0f}s")
+            continue
+        with _lock:
+            _pool, _pool_pid = pool, os.getpid()
+            _retry_thread = None
+        print("Database connection pool created")
+        return
+
+def _start_retry():
+    global _retry_thread
+    if _retry_thread is None:
+        _retry_thread = threading.Thread(target=_retry_loop, name='db-pool-retry', daemon=True)
+        _retry_thread.start()
+
+def get_pool():
+    """This process's pool, None while the database is unreachable"""
+    global _pool, _pool_pid
+    pid = os.getpid()
+    if _pool is not None and _pool_pid == pid:
+        return _pool
+    with _lock:
+        if _pool_pid != pid:
+            _pool = None
+        if _pool is None and _retry_thread is None:
+            try:
+                _pool, _pool_pid = _create_pool(), pid
+            except mysql.connector.Error as e:
+                print(f"Error creating connection pool: {e}")
+                _start_retry()
+        return _pool
+
+def get_connection():
+    """Get database connection from pool"""
+    if BACKEND == 'sqlite':
+        import sqlite_backend
+        conn = sqlite_backend.connect()
+        timeouts.watchdog.borrowed(conn, conn.kill_query)
+        return conn
+    pool = get_pool()
+    if pool:
+        return pool.get_connection()
+    return None
+
+def reset_after_fork():
+    """Forget any pool inherited from the parent process.
+
+    The inherited sockets belong to the parent, so they are dropped rather
+    than closed; closing them would end the parent's sessions too.
+    """
+    global _pool, _pool_pid, _lock, _retry_thread
+    _pool, _pool_pid = None, None
+    _lock = threading.Lock()
+    _retry_thread = None
+
+def warm_up():
+    """Create the pool and touch every connection in it so the first requests don't pay for it"""
+    if BACKEND == 'sqlite':
+        get_connection().close()
+        return 1
+    pool = get_pool()
+    if not pool:
+        return 0
+    conns = []
+    try:
+        for _ in range(POOL_SIZE):
+            conn = pool.get_connection()
+            conn.ping(reconnect=True)
+            conns.append(conn)
+    except mysql.connector.Error as e:
+        print(f"Connection pool warm-up stopped early: {e}")
+    finally:
+        for conn in conns:
+            conn.close()
+    return len(conns)
+
+def split_statements(sql):
+    """Split a mysql client script into statements, honouring DELIMITER lines"""
+    delimiter, current = ';', []
+    for line in sql.splitlines():
+        # A trailing comment would hide the delimiter
+        line = re.sub(r'\s--\s.*$', '', line)
+        stripped = line.strip()
+        if stripped.upper().startswith('DELIMITER '):
+            delimiter = stripped.split()[1]
+            continue
+        current.append(line)
+        if stripped.endswith(delimiter):
+            statement = '\n'.join(current).strip()[:-len(delimiter)].strip()
+            current = []
+            # Drop leading comment lines so the statement kind can be read
+            body = '\n'.join(l for l in statement.splitlines() if not l.strip().startswith('--')).strip()
+            if body:
+                yield body
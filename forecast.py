@@ -0,0 +1,312 @@
+#!/usr/bin/env python3
+"""
+Cash-Flow Forecast
+Projected premium inflows and maturity outflows per month for the next
+FORECAST_YEARS years, by plan and branch. Active policies are read from every
+shard in primary-key chunks and each chunk is projected with NumPy month
+arithmetic instead of a loop over policies: an installment falls due every
+MODE_MONTHS months from FUP until maturity (DOC plus Term years, as in
+schedule.py), and Sum_Assured is paid out in the maturity month. Installments
+due before the current month, and active policies already past maturity, are
+reported as overdue rather than projected.
+
+Usage:
+    python forecast.py --years 30 --by plan
+    python forecast.py --period month --out forecast.csv
+"""
+
+import argparse
+import csv
+import os
+import sys
+from datetime import date
+
+import report_cache
+import shards
+from schedule import MODE_MONTHS
+
+try:
+    import numpy as np
+except ImportError:  # the forecast is optional; the app runs without numpy
+    np = None
+
+FORECAST_YEARS = int(os.getenv('FORECAST_YEARS', 30))
+DEFAULT_CHUNK_SIZE = 50000
+EPOCH_ORDINAL = date(1970, 1, 1).toordinal()
+NAT = -2 ** 63  # int64 value of numpy's NaT
+
+# Report groupings: the (Plan_no, Branch_id) key parts kept by each
+GROUPINGS = {'plan': (0,), 'branch': (1,), 'plan_branch': (0, 1)}
+GROUP_COLUMNS = ('Plan_no', 'Branch_id')
+PERIODS = ('year', 'month')
+
+POLICY_QUERY = """SELECT p.Policy_no, p.Plan_no, a.Branch_id, p.Premium, p.DOC, p.FUP, p.Mode, p.Term, p.Sum_Assured
+                  FROM Policy p
+                  JOIN Agent a ON a.Agency_code = p.Agency_code
+                  WHERE p.Policy_no > %s AND p.Status = 1
+                  ORDER BY p.Policy_no LIMIT %s"""
+
+# Grids of cents (or counts) per group and month
+GRIDS = ('premium', 'installments', 'maturity', 'maturities')
+OVERDUE = ('premium', 'installments', 'maturity', 'maturities')
+
+class ForecastUnavailable(RuntimeError):
+    """numpy is not installed"""
+
+class Forecast:
+    """Projected cash flows per (Plan_no, Branch_id) group and month, from the first of start's month"""
+
+    def __init__(self, start, months):
+        self.start = np.datetime64(start, 'M')
+        self.months = months
+        self.groups = {}
+        self.grids = {name: np.zeros((0, months)) for name in GRIDS}
+        self.overdue = dict.fromkeys(OVERDUE, 0.0)
+        self.policies = 0
+        self.warnings = []
+
+    def group_ids(self, keys):
+        """Row index of each (plan, branch) key, adding rows for new ones"""
+        ids = np.fromiter((self.groups.setdefault(key, len(self.groups)) for key in keys), np.int64)
+        grown = len(self.groups) - len(self.grids['premium'])
+        if grown:
+            for name, grid in self.grids.items():
+                self.grids[name] = np.vstack([grid, np.zeros((grown, self.months))])
+        return ids
+
+    def add(self, other):
+        """Fold another forecast (e.g. another shard's) into this one"""
+        ids = self.group_ids(list(other.groups))
+        for name, grid in other.grids.items():
+            self.grids[name][ids] += grid
+        for name, value in other.overdue.items():
+            self.overdue[name] += value
+        self.policies += other.policies
+        self.warnings += other.warnings
+
+    def totals(self):
+        """Whole-company figures in rupees"""
+        return {
+            'policies': self.policies,
+            'premium_inflow': round(float(self.grids['premium'].sum()) / 100, 2),
+            'installments': int(self.grids['installments'].sum()),
+            'maturity_outflow': round(float(self.grids['maturity'].sum()) / 100, 2),
+            'maturities': int(self.grids['maturities'].sum()),
+            'overdue_premium': round(self.overdue['premium'] / 100, 2),
+            'overdue_installments': int(self.overdue['installments']),
+            'overdue_maturity': round(self.overdue['maturity'] / 100, 2),
+            'overdue_maturities': int(self.overdue['maturities']),
+        }
+
+    def rows(self, by=None, period='year'):
+        """Report rows per period (calendar year or month) and optionally plan and/or branch.
+
+        Groups with nothing due in a period are left out.
+        """
+        months = self.start + np.arange(self.months)
+        if period == 'year':
+            years = months.astype('datetime64[Y]')
+            buckets = (years - years[0]).astype(np.int64)
+            labels = np.datetime_as_string(np.unique(years), unit='Y').tolist()
+        else:
+            buckets = np.arange(self.months)
+            labels = np.datetime_as_string(months, unit='M').tolist()
+        parts = GROUPINGS.get(by, ())
+        keys = {}
+        group_rows = np.fromiter((keys.setdefault(tuple(key[i] for i in parts), len(keys))
+                                  for key in self.groups), np.int64, len(self.groups))
+        # Sum each grid into (report group, period) cells
+        cells = (group_rows[:, None] * len(labels) + buckets[None, :]).ravel()
+        size = max(len(keys), 1) * len(labels)
+        sums = {name: np.bincount(cells, weights=grid.ravel(), minlength=size).reshape(-1, len(labels))
+                for name, grid in self.grids.items()}
+
+        rows = []
+        names = list(keys) or [()]
+        for column, label in enumerate(labels):
+            for row, key in enumerate(names):
+                if parts and not (sums['installments'][row, column] or sums['maturities'][row, column]):
+                    continue
+                premium = round(float(sums['premium'][row, column]) / 100, 2)
+                maturity = round(float(sums['maturity'][row, column]) / 100, 2)
+                rows.append(dict(
+                    {'Period': label},
+                    **{GROUP_COLUMNS[i]: value for i, value in zip(parts, key)},
+                    Installments=int(sums['installments'][row, column]), Premium_Inflow=premium,
+                    Maturities=int(sums['maturities'][row, column]), Maturity_Outflow=maturity,
+                    Net_Flow=round(premium - maturity, 2)))
+        return rows
+
+    def write_csv(self, f, by='plan_branch', period='month'):
+        """Write rows() as CSV to an open text file"""
+        columns = ['Period'] + [GROUP_COLUMNS[i] for i in GROUPINGS.get(by, ())] + [
+            'Installments', 'Premium_Inflow', 'Maturities', 'Maturity_Outflow', 'Net_Flow']
+        writer = csv.DictWriter(f, columns)
+        writer.writeheader()
+        writer.writerows(self.rows(by, period))
+
+def days_in_month(months):
+    """Length of each datetime64[M] month in days"""
+    return ((months + 1).astype('datetime64[D]') - months.astype('datetime64[D]')).astype(np.int64)
+
+def drifted_day(month, day, step, steps):
+    """Day of month of the installment steps steps after (month, day).
+
+    Stepping through a shorter month clamps the day for good (Jan 31, Feb 28,
+    Mar 28, ...) like DATE_ADD. Month lengths repeat within four years, so
+    the first 48 steps decide it.
+    """
+    for k in range(1, 49):
+        day = np.minimum(day, days_in_month(month + np.minimum(k, steps) * step))
+    return day
+
+def month_parts(dates):
+    """Month number (datetime64[M]) and day of month of each date; NaT for missing dates"""
+    days = np.fromiter((d.toordinal() - EPOCH_ORDINAL if d else NAT for d in dates), np.int64,
+                       len(dates)).astype('datetime64[D]')
+    months = days.astype('datetime64[M]')
+    return months, (days - months.astype('datetime64[D]')).astype(np.int64) + 1
+
+def progression(first, stop, step, weights, groups, n_groups, months):
+    """Per group and month, weights summed over months first, first + step, ... before stop.
+
+    Only months 0 to months - 1 are kept. Each progression adds its weight at
+    its first month and takes it off again after its last one; a running sum
+    along every step-th month then spreads it over the months in between.
+    Also returns (count, weight) totals of the terms before month 0.
+    """
+    # Terms before month 0 are overdue; the first projected one is the first on or after it
+    before = np.maximum((np.minimum(stop, 0) - first + step - 1) // step, 0)
+    begin = first + np.maximum(-first + step - 1, 0) // step * step
+    count = np.maximum((np.minimum(stop, months) - begin + step - 1) // step, 0)
+    live = count > 0
+    width = months + step
+    base = groups[live] * width
+    diff = np.bincount(base + begin[live], weights=weights[live], minlength=n_groups * width)
+    diff -= np.bincount(base + begin[live] + count[live] * step, weights=weights[live], minlength=n_groups * width)
+    diff = diff.reshape(n_groups, width)
+    for offset in range(step):
+        diff[:, offset::step] = np.cumsum(diff[:, offset::step], axis=1)
+    return diff[:, :months], (int(before.sum()), float((before * weights).sum()))
+
+def project_chunk(forecast, rows):
+    """Add a chunk of POLICY_QUERY rows to a forecast"""
+    _, plans, branches, premiums, docs, fups, modes, terms, sums_assured = zip(*rows)
+    n = len(rows)
+    groups = forecast.group_ids(zip(plans, branches))
+    n_groups = len(forecast.groups)
+    premium = np.rint(np.fromiter((float(v) for v in premiums), np.float64, n) * 100)
+    sum_assured = np.rint(np.fromiter((float(v) for v in sums_assured), np.float64, n) * 100)
+    step = np.fromiter((MODE_MONTHS.get(mode, 0) for mode in modes), np.int64, n)
+    doc_month, doc_day = month_parts(docs)
+    fup_month, fup_day = month_parts(fups)
+
+    # Maturity: DOC plus Term years, the day clamped to the month's length like DATE_ADD
+    maturity_month = doc_month + np.fromiter(terms, np.int64, n) * 12
+    maturity = (maturity_month - forecast.start).astype(np.int64)
+    maturity_day = np.minimum(doc_day, days_in_month(maturity_month))
+
+    # An installment is due while its date is before maturity, so one falling in the
+    # maturity month counts only when its day comes before the maturity day. Days above
+    # 28 may have been clamped on the way there.
+    has_fup = ~np.isnat(fup_month) & (step > 0)
+    first = (fup_month - forecast.start).astype(np.int64)
+    due_day = fup_day.copy()
+    lands = has_fup & (fup_day > 28) & (maturity > first) & ((maturity - first) % np.maximum(step, 1) == 0)
+    if lands.any():
+        due_day[lands] = drifted_day(fup_month[lands], fup_day[lands], step[lands],
+                                     (maturity - first)[lands] // step[lands])
+    stop = maturity + (due_day < maturity_day)
+    ones = np.ones(n)
+    for months in set(MODE_MONTHS.values()):
+        mode = has_fup & (step == months)
+        if not mode.any():
+            continue
+        args = (first[mode], stop[mode], months)
+        amounts, (_, overdue) = progression(*args, premium[mode], groups[mode], n_groups, forecast.months)
+        counts, (installments, _) = progression(*args, ones[mode], groups[mode], n_groups, forecast.months)
+        forecast.grids['premium'] += amounts
+        forecast.grids['installments'] += counts
+        forecast.overdue['premium'] += overdue
+        forecast.overdue['installments'] += installments
+
+    due = (maturity >= 0) & (maturity < forecast.months)
+    cells = groups[due] * forecast.months + maturity[due]
+    size = n_groups * forecast.months
+    forecast.grids['maturity'] += np.bincount(cells, weights=sum_assured[due], minlength=size).reshape(n_groups, -1)
+    forecast.grids['maturities'] += np.bincount(cells, minlength=size).reshape(n_groups, -1)
+    past = maturity < 0
+    forecast.overdue['maturity'] += float(sum_assured[past].sum())
+    forecast.overdue['maturities'] += int(past.sum())
+    forecast.policies += n
+
+def project_shard(conn, start, months, chunk_size=DEFAULT_CHUNK_SIZE):
+    """Forecast of one shard's active policies, read in primary-key order chunk by chunk"""
+    forecast = Forecast(start, months)
+    cursor = conn.cursor()
+    try:
+        last = ''
+        while True:
+            cursor.execute(POLICY_QUERY, (last, chunk_size))
+            rows = cursor.fetchall()
+            if not rows:
+                return forecast
+            project_chunk(forecast, rows)
+            last = rows[-1][0]
+    finally:
+        cursor.close()
+
+def project(years=FORECAST_YEARS, start=None, chunk_size=DEFAULT_CHUNK_SIZE):
+    """Forecast over every shard from the current month; unreachable shards are listed in warnings"""
+    if np is None:
+        raise ForecastUnavailable('numpy is required for the cash-flow forecast (pip install numpy)')
+    start = start or date.today()
+    months = years * 12
+    forecast = Forecast(start, months)
+    for shard, result, error in shards.fan_out(lambda shard, conn: project_shard(conn, start, months, chunk_size)):
+        if error:
+            forecast.warnings.append(f'{shard.name} unavailable: {error}')
+        else:
+            forecast.add(result)
+    return forecast
+
+# Forecasts by horizon; the projection moves slowly, so an hour-old one is served while it refreshes
+cache = report_cache.ReportCache(ttl=int(os.getenv('FORECAST_CACHE_TTL', 3600)), max_stale=86400,
+                                 max_entries=4, cacheable=lambda forecast: not forecast.warnings)
+
+def main():
+    """Command line entry point"""
+    parser = argparse.ArgumentParser(description='Project premium inflows and maturity outflows')
+    parser.add_argument('--years', type=int, default=FORECAST_YEARS)
+    parser.add_argument('--by', choices=list(GROUPINGS))
+    parser.add_argument('--period', choices=PERIODS, default='year')
+    parser.add_argument('--chunk-size', type=int, default=DEFAULT_CHUNK_SIZE)
+    parser.add_argument('--out', help='Write the rows to this CSV file instead of printing them')
+    args = parser.parse_args()
+
+    try:
+        forecast = project(args.years, chunk_size=args.chunk_size)
+    except ForecastUnavailable as e:
+        print(f"✗ {e}")
+        return False
+    for warning in forecast.warnings:
+        print(f"✗ {warning}")
+    if args.out:
+        with open(args.out, 'w', newline='', encoding='utf-8') as f:
+            forecast.write_csv(f, args.by, args.period)
+    else:
+        group = [GROUP_COLUMNS[i] for i in GROUPINGS.get(args.by, ())]
+        print(''.join(f'{column:<12}' for column in ['Period'] + group)
+              + f"{'Premium in':>18}{'Maturities out':>18}{'Net':>18}")
+        for row in forecast.rows(args.by, args.period):
+            print(''.join(f'{row[column]:<12}' for column in ['Period'] + group)
+                  + f"{row['Premium_Inflow']:>18,.2f}{row['Maturity_Outflow']:>18,.2f}{row['Net_Flow']:>18,.2f}")
+    totals = forecast.totals()
+    print(f"✓ {totals['policies']:,} policies: ₹{totals['premium_inflow']:,.2f} premium in and "
+          f"₹{totals['maturity_outflow']:,.2f} maturities out over {args.years} years, "
+          f"₹{totals['overdue_premium']:,.2f} premium overdue"
+          + (f", written to {args.out}" if args.out else ''))
+    return not forecast.warnings
+
+if __name__ == '__main__':
+    sys.exit(0 if main() else 1)
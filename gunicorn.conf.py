@@ -0,0 +1,42 @@
+"""
+Gunicorn Configuration
+Loaded automatically by `gunicorn` from the project directory. The app is
+imported once in the master (preload) and every forked worker builds its own
+connection pool and warms up before it starts accepting requests.
+"""
+
+import multiprocessing
+import os
+
+bind = os.getenv('BIND', '0.0.0.0:5000')
+wsgi_app = 'app:app'
+preload_app = True
+
+# Threads share a worker's pool: keep threads + JOB_WORKERS below DB_POOL_SIZE, and
+# ADMISSION_HEAVY_SLOTS + ADMISSION_HEAVY_QUEUE below threads so payments always get one
+workers = int(os.getenv('WEB_CONCURRENCY', min(multiprocessing.cpu_count() * 2 + 1, 8)))
+worker_class = 'gthread'
+threads = int(os.getenv('GUNICORN_THREADS', 4))
+
+# Reports and imports run as background jobs, so requests should be short
+timeout = int(os.getenv('GUNICORN_TIMEOUT', 60))
+graceful_timeout = 30
+keepalive = 5
+
+accesslog = '-'
+errorlog = '-'
+
+def post_fork(server, worker):
+    """Drop the master's database state; each worker needs its own sockets"""
+    import db
+    db.reset_after_fork()
+
+def post_worker_init(worker):
+    """Create the pool, prime caches and compile templates before serving traffic"""
+    from app import create_app
+    create_app()
+
+def worker_exit(server, worker):
+    from app import audit, job_runner
+    job_runner.stop(wait=False)
+    audit.log.stop()
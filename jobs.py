@@ -0,0 +1,278 @@
+"""
+Background Jobs
+A small persistent job runner for work that outlives a request: long reports
+and bulk imports. Jobs live in the Job table so any worker process can pick
+them up, and a job whose worker stops heart-beating is queued again. A job
+kind can ask for failed attempts to be retried later rather than at once.
+"""
+
+import json
+import os
+import socket
+import threading
+import time
+import traceback
+from concurrent.futures import ThreadPoolExecutor
+
+import mysql.connector
+
+QUEUED, RUNNING, DONE, FAILED = 'queued', 'running', 'done', 'failed'
+
+# Longest a job registered with retry_seconds waits before its next attempt
+MAX_RETRY_SECONDS = 600
+
+class JobContext:
+    """What a job function sees of its own Job row"""
+
+    def __init__(self, runner, job):
+        self.runner = runner
+        self.job_id = job['Job_id']
+        self.kind = job['Kind']
+        self.owner = job['Owner']
+        self.params = json.loads(job['Params'] or '{}')
+        self.checkpoint = job['Checkpoint'] or 0
+        self.attempt = job['Attempts']
+        self.result_file = job['Result_path']
+        self._last_update = 0.0
+
+    def progress(self, done, total=None, message=None, force=False):
+        """Record progress, throttled to one write per second"""
+        now = time.monotonic()
+        if not force and now - self._last_update < 1.0:
+            return
+        self._last_update = now
+        fields = {'Progress': done}
+        if total is not None:
+            fields['Total'] = total
+        if message is not None:
+            fields['Message'] = message[:255]
+        self.runner.update(self.job_id, **fields)
+
+    def save_checkpoint(self, cursor, value):
+        """Store a resume point using the job's own cursor, so it commits with the work it describes"""
+        cursor.execute("UPDATE Job SET `Checkpoint` = %s, Heartbeat = NOW() WHERE Job_id = %s", (value, self.job_id))
+        self.checkpoint = value
+
+    def result_path(self, extension):
+        """Absolute path the job should write its downloadable result to"""
+        os.makedirs(self.runner.result_dir, exist_ok=True)
+        self.result_file = f'{self.kind}-{self.job_id}.{extension}'
+        return os.path.join(self.runner.result_dir, self.result_file)
+
+class JobRunner:
+    """Claims queued jobs from the Job table and runs them on a bounded thread pool"""
+
+    def __init__(self, get_connection, workers=2, poll_interval=2.0, stale_after=60,
+                 max_attempts=3, result_dir='jobs'):
+        self.get_connection = get_connection
+        self.workers = workers
+        self.poll_interval = poll_interval
+        self.stale_after = stale_after
+        self.max_attempts = max_attempts
+        self.result_dir = os.path.abspath(result_dir)
+        self.worker_id = f'{socket.gethostname()}:{os.getpid()}'
+
+        self.tasks = {}
+        self.retry_policies = {}
+        self._running = set()
+        self._lock = threading.Lock()
+        self._wakeup = threading.Event()
+        self._stopped = threading.Event()
+        self._executor = None
+        self._thread = None
+
+    def register(self, kind, fn, max_attempts=None, retry_seconds=0):
+        """Register fn(ctx, conn) as the handler for a job kind.
+
+        A job failing with a database error is retried up to max_attempts
+        (default: the runner's). With retry_seconds it is not claimed again
+        for that long after the first failure, doubling after each one.
+        """
+        self.tasks[kind] = fn
+        self.retry_policies[kind] = (max_attempts or self.max_attempts, retry_seconds)
+
+    #  LIFECYCLE
+
+    def start(self):
+        if self._thread and self._thread.is_alive():
+            return
+        self.worker_id = f'{socket.gethostname()}:{os.getpid()}'
+        self._stopped.clear()
+        self._executor = ThreadPoolExecutor(max_workers=self.workers, thread_name_prefix='job')
+        self._thread = threading.Thread(target=self._dispatch_loop, name='job-dispatcher', daemon=True)
+        self._thread.start()
+
+    def stop(self, wait=True):
+        self._stopped.set()
+        self._wakeup.set()
+        if self._executor:
+            self._executor.shutdown(wait=wait)
+
+    #  JOB TABLE
+
+    def _execute(self, query, params=(), fetch=None):
+        conn = self.get_connection()
+        if not conn:
+            return None
+        cursor = conn.cursor(dictionary=True)
+        try:
+            cursor.execute(query, params)
+            if fetch == 'one':
+                result = cursor.fetchone()
+            elif fetch == 'all':
+                result = cursor.fetchall()
+            else:
+                result = cursor.rowcount
+            conn.commit()
+            return result
+        finally:
+            cursor.close()
+            conn.close()
+
+    def submit(self, kind, params, owner):
+        """Queue a job and return its id"""
+        if kind not in self.tasks:
+            raise ValueError(f'Unknown job kind: {kind}')
+        conn = self.get_connection()
+        if not conn:
+            raise mysql.connector.Error('Database connection error')
+        cursor = conn.cursor()
+        try:
+            cursor.execute("INSERT INTO Job (Kind, Params, Owner, Status) VALUES (%s, %s, %s, %s)",
+                           (kind, json.dumps(params), owner, QUEUED))
+            job_id = cursor.lastrowid
+            conn.commit()
+        finally:
+            cursor.close()
+            conn.close()
+        self._wakeup.set()
+        return job_id
+
+    def get(self, job_id):
+        return self._execute("SELECT * FROM Job WHERE Job_id = %s", (job_id,), fetch='one')
+
+    def list_for(self, owner, limit=20):
+        return self._execute("SELECT * FROM Job WHERE Owner = %s ORDER BY Job_id DESC LIMIT %s",
+                             (owner, limit), fetch='all')
+
+    def update(self, job_id, **fields):
+        assignments = ', '.join(f'`{name}` = %s' for name in fields)
+        self._execute(f"UPDATE Job SET {assignments}, Heartbeat = NOW() WHERE Job_id = %s",
+                      (*fields.values(), job_id))
+
+    #  DISPATCH
+
+    def _dispatch_loop(self):
+        while not self._stopped.is_set():
+            try:
+                self._heartbeat()
+                self._requeue_stale()
+                while self._free_slots() and not self._stopped.is_set():
+                    job = self._claim()
+                    if not job:
+                        break
+                    with self._lock:
+                        self._running.add(job['Job_id'])
+                    self._executor.submit(self._run, job)
+            except mysql.connector.Error as e:
+                print(f"Job dispatcher error: {e}")
+            self._wakeup.wait(self.poll_interval)
+            self._wakeup.clear()
+
+    def _free_slots(self):
+        with self._lock:
+            return len(self._running) < self.workers
+
+    def _claim(self):
+        """Atomically take the oldest queued job, None if another worker got there first"""
+        job = self._execute("""SELECT Job_id FROM Job WHERE Status = %s AND (Run_after IS NULL OR Run_after <= NOW())
+                               ORDER BY Job_id LIMIT 1""", (QUEUED,), fetch='one')
+        if not job:
+            return None
+        claimed = self._execute(
+            """UPDATE Job SET Status = %s, Worker = %s, Attempts = Attempts + 1,
+               Started_at = NOW(), Heartbeat = NOW() WHERE Job_id = %s AND Status = %s""",
+            (RUNNING, self.worker_id, job['Job_id'], QUEUED))
+        if claimed != 1:
+            return None
+        return self.get(job['Job_id'])
+
+    def _heartbeat(self):
+        with self._lock:
+            running = list(self._running)
+        if running:
+            placeholders = ', '.join(['%s'] * len(running))
+            self._execute(f"UPDATE Job SET Heartbeat = NOW() WHERE Job_id IN ({placeholders})", running)
+
+    def _requeue_stale(self):
+        """Give jobs orphaned by a crashed or restarted worker another attempt"""
+        self._execute(
+            """UPDATE Job SET Status = %s, Worker = NULL, Message = 'Retrying after worker restart'
+               WHERE Status = %s AND Heartbeat < NOW() - INTERVAL %s SECOND AND Attempts < %s""",
+            (QUEUED, RUNNING, self.stale_after, self.max_attempts))
+        self._execute(
+            """UPDATE Job SET Status = %s, Finished_at = NOW(), Message = 'Gave up after repeated worker failures'
+               WHERE Status = %s AND Heartbeat < NOW() - INTERVAL %s SECOND AND Attempts >= %s""",
+            (FAILED, RUNNING, self.stale_after, self.max_attempts))
+
+    def _connect(self):
+        """A connection for a job, waiting out a short database outage; None if it lasts"""
+        delay = 1.0
+        deadline = time.monotonic() + self.stale_after / 2
+        while not self._stopped.is_set():
+            conn = self.get_connection()
+            if conn or time.monotonic() + delay > deadline:
+                return conn
+            self._stopped.wait(delay)
+            delay = min(delay * 2, 10.0)
+        return None
+
+    def _retry_later(self, job_id, seconds, error):
+        """Queue a failed job again, not to be claimed for another `seconds`"""
+        self._execute("""UPDATE Job SET Status = %s, Worker = NULL, Message = %s,
+                         Run_after = NOW() + INTERVAL %s SECOND, Heartbeat = NOW() WHERE Job_id = %s""",
+                      (QUEUED, f'Retrying in {seconds}s: {error}'[:255], seconds, job_id))
+
+    def _run(self, job):
+        ctx = JobContext(self, job)
+        conn = None
+        try:
+            conn = self._connect()
+            if not conn:
+                # The job never started: queue it again without using up an attempt
+                self.update(ctx.job_id, Status=QUEUED, Worker=None, Attempts=max(ctx.attempt - 1, 0),
+                            Message='Waiting for the database')
+                return
+            self.tasks[ctx.kind](ctx, conn)
+            self.update(ctx.job_id, Status=DONE, Result_path=ctx.result_file,
+                        Finished_at=time.strftime('%Y-%m-%d %H:%M:%S'))
+        except Exception as e:
+            traceback.print_exc()
+            max_attempts, retry_seconds = self.retry_policies.get(ctx.kind, (self.max_attempts, 0))
+            retry = isinstance(e, mysql.connector.Error) and ctx.attempt < max_attempts
+            if retry and retry_seconds:
+                self._retry_later(ctx.job_id, min(retry_seconds * 2 ** (ctx.attempt - 1), MAX_RETRY_SECONDS), e)
+            else:
+                self.update(ctx.job_id, Status=QUEUED if retry else FAILED, Message=str(e)[:255],
+                            Finished_at=None if retry else time.strftime('%Y-%m-%d %H:%M:%S'))
+        finally:
+            if conn:
+                conn.close()
+            with self._lock:
+                self._running.discard(ctx.job_id)
+            self._wakeup.set()
+
+def as_status(job):
+    """JSON-friendly view of a Job row for the polling endpoint"""
+    return {
+        'id': job['Job_id'],
+        'kind': job['Kind'],
+        'status': job['Status'],
+        'progress': job['Progress'],
+        'total': job['Total'],
+        'message': job['Message'],
+        'attempts': job['Attempts'],
+        'created_at': str(job['Created_at']) if job['Created_at'] else None,
+        'finished_at': str(job['Finished_at']) if job['Finished_at'] else None,
+        'has_result': bool(job['Result_path']),
+    }
@@ -0,0 +1,162 @@
+"""
+Live KPIs
+Admin dashboard counters held in memory per process: policies issued today,
+premium collected today, commission on today's policies and overdue
+policies. Write paths announce their changes through signals.py and the
+counters move with them, so open dashboards cost no queries. Every
+KPI_RECONCILE_SECONDS the counters are re-read from every shard, which also
+picks up writes made by other worker processes and rolls the day over.
+"""
+
+import json
+import os
+import threading
+import time
+from datetime import date, datetime
+
+import shards
+import signals
+from policy_rules import commission
+
+RECONCILE_SECONDS = int(os.getenv('KPI_RECONCILE_SECONDS', 30))
+# How soon a failed or day-old reconcile is tried again
+RETRY_SECONDS = 5
+
+FIELDS = ('policies_today', 'premium_today', 'commission_today', 'overdue')
+
+def read_counters(shard, conn, today):
+    """The KPI counters as stored on one shard"""
+    cursor = conn.cursor()
+    try:
+        cursor.execute("""SELECT COUNT(*), COALESCE(SUM(COM(Premium, Term)), 0)
+                          FROM Policy WHERE DOC = %s""", (today,))
+        policies, commissions = cursor.fetchone()
+        cursor.execute("""SELECT COALESCE(SUM(Amount), 0) FROM Payment
+                          WHERE Timestamp >= %s""", (datetime.combine(today, datetime.min.time()),))
+        premium = cursor.fetchone()[0]
+        cursor.execute("SELECT COUNT(*) FROM Policy WHERE FUP < %s AND Status = 1", (today,))
+        overdue = cursor.fetchone()[0]
+    finally:
+        cursor.close()
+    return {'policies_today': policies, 'premium_today': float(premium),
+            'commission_today': float(commissions), 'overdue': overdue}
+
+class KpiBoard:
+    """Counters plus a version number that streams wait on for changes"""
+
+    def __init__(self, reconcile_seconds=RECONCILE_SECONDS):
+        self.reconcile_seconds = reconcile_seconds
+        self.values = dict.fromkeys(FIELDS, 0)
+        self.day = None
+        self.version = 0
+        self.reconciled_at = None
+        self.stale = True
+        self._reconciled = float('-inf')
+        self.changed = threading.Condition()
+        self._reconciling = threading.Lock()
+
+    def current(self):
+        """A consistent copy of the counters"""
+        with self.changed:
+            return dict(self.values, day=str(self.day) if self.day else None, version=self.version,
+                        reconciled_at=self.reconciled_at, stale=self.stale)
+
+    def add(self, **deltas):
+        """Apply changes announced by a write path"""
+        with self.changed:
+            if self.day != date.today():
+                # First event of a new day: today's counters start over until the next reconcile
+                self.day = date.today()
+                self.values.update(policies_today=0, premium_today=0.0, commission_today=0.0)
+                self.stale = True
+            for field, delta in deltas.items():
+                self.values[field] = round(self.values[field] + delta, 2)
+            self.version += 1
+            self.changed.notify_all()
+
+    def due(self):
+        """True when the counters should be re-read from the database"""
+        elapsed = time.monotonic() - self._reconciled
+        if self.stale or self.day != date.today():
+            return elapsed >= RETRY_SECONDS
+        return elapsed >= self.reconcile_seconds
+
+    def reconcile(self):
+        """Re-read the counters from every shard; returns False if a shard failed.
+
+        Only one thread reconciles at a time, the others keep serving the
+        current counters. A write announced while the queries run may be
+        missing from the result until the next reconcile.
+        """
+        if not self._reconciling.acquire(blocking=False):
+            return True
+        try:
+            today = date.today()
+            totals = dict.fromkeys(FIELDS, 0)
+            failed = False
+            for shard, counters, error in shards.fan_out(lambda shard, conn: read_counters(shard, conn, today)):
+                if error:
+                    print(f"KPI reconcile on {shard.name} failed: {error}")
+                    failed = True
+                    continue
+                for field in FIELDS:
+                    totals[field] += counters[field]
+            with self.changed:
+                self._reconciled = time.monotonic()
+                if not failed:
+                    self.values = {field: round(value, 2) for field, value in totals.items()}
+                    self.day = today
+                    self.reconciled_at = datetime.now().strftime('%Y-%m-%d %H:%M:%S')
+                self.stale = failed
+                self.version += 1
+                self.changed.notify_all()
+            return not failed
+        finally:
+            self._reconciling.release()
+
+    def refresh(self):
+        """Reconcile if due, returns the current counters"""
+        if self.due():
+            self.reconcile()
+        return self.current()
+
+    def wait(self, version, timeout):
+        """Block until the counters move past version or timeout passes"""
+        with self.changed:
+            self.changed.wait_for(lambda: self.version != version, timeout)
+
+board = KpiBoard()
+
+@signals.policies_issued.connect
+def _on_policies_issued(agency_code, policies):
+    board.add(policies_today=len(policies),
+              commission_today=sum(commission(p['premium'], p['term']) for p in policies))
+
+@signals.payment_recorded.connect
+def _on_payment_recorded(agency_code, payment):
+    today = date.today()
+    cleared = payment.previous_fup < today and (payment.next_fup is None or payment.next_fup >= today)
+    board.add(premium_today=float(payment.amount), overdue=-1 if cleared else 0)
+
+def event(counters, retry=None):
+    """One Server-Sent Events message carrying the counters"""
+    message = f"retry: {retry}\n" if retry else ''
+    return message + f"event: kpi\nid: {counters['version']}\ndata: {json.dumps(counters)}\n\n"
+
+def stream(kpi_board, seconds, heartbeat):
+    """SSE messages for one dashboard: the counters now and whenever they change.
+
+    Ends after `seconds` so a worker thread is not held forever; the browser's
+    EventSource reconnects by itself. Comment lines keep idle proxies from
+    dropping the connection.
+    """
+    deadline = time.monotonic() + seconds
+    version = None
+    while time.monotonic() < deadline:
+        counters = kpi_board.refresh()
+        if counters['version'] != version:
+            version = counters['version']
+            yield event(counters)
+        else:
+            yield ': keep-alive\n\n'
+        kpi_board.wait(version, min(heartbeat, max(deadline - time.monotonic(), 0)))
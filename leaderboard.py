@@ -0,0 +1,197 @@
+"""
+Agent Leaderboard
+Top agents by commission and premium written over sliding windows (the
+last 7, 30 and 365 days). Each process keeps one bucket per day and agent,
+loaded from the business cube, and a running total per window that moves
+as policies are issued (signals.py) and as days leave the window. A top-N
+answer is a heap selection over one window's per-agent totals, cached until
+the totals change, so its cost does not grow with the number of policies.
+"""
+
+import heapq
+import os
+import threading
+import time
+from datetime import date, timedelta
+
+import mysql.connector
+
+import cube
+import shards
+import signals
+from policy_rules import commission
+
+WINDOWS = (7, 30, 365)
+METRICS = ('commission', 'premium')
+# Position of each metric in a [premium, commission] bucket or total
+TOTAL_FIELDS = {'premium': 0, 'commission': 1}
+DEFAULT_LIMIT = 10
+MAX_LIMIT = 100
+REFRESH_SECONDS = int(os.getenv('LEADERBOARD_REFRESH_SECONDS', 300))
+# How soon a failed reload is tried again
+RETRY_SECONDS = 30
+
+BUCKET_QUERY = """SELECT Day, Agency_code, SUM(Premium_Total), SUM(Commission_Total)
+                  FROM Business_Cube WHERE Day >= %s
+                  GROUP BY Day, Agency_code"""
+
+def load_buckets(shard, conn, since):
+    """Per-day, per-agent (premium, commission) from one shard's cube since a day"""
+    try:
+        cube.refresh(conn)
+    except mysql.connector.Error as e:
+        # The cube as it stands is still worth ranking
+        print(f"Cube refresh on {shard.name} failed: {e}")
+    cursor = conn.cursor()
+    try:
+        cursor.execute(BUCKET_QUERY, (since,))
+        return [(day, agent, float(premium), float(commissions)) for day, agent, premium, commissions in cursor]
+    finally:
+        cursor.close()
+
+def load_names(conn):
+    """Agent names keyed by Agency_code"""
+    cursor = conn.cursor()
+    try:
+        cursor.execute("SELECT Agency_code, Name FROM Agent")
+        return dict(cursor.fetchall())
+    finally:
+        cursor.close()
+
+class Leaderboard:
+    """Daily per-agent buckets and a running total per window"""
+
+    def __init__(self, windows=WINDOWS, refresh_seconds=REFRESH_SECONDS):
+        self.windows = tuple(sorted(windows))
+        self.refresh_seconds = refresh_seconds
+        self.lock = threading.Lock()
+        self._reloading = threading.Lock()
+        self.today = None
+        self.days = {}
+        self.totals = {window: {} for window in self.windows}
+        self.names = {}
+        self.loaded_at = None
+        self._loaded = float('-inf')
+        self._failed = False
+        self._top = {}
+
+    def _apply(self, day, agent, premium, commissions):
+        """Add an amount to every window that covers the day"""
+        age = (self.today - day).days
+        for window in self.windows:
+            if 0 <= age < window:
+                total = self.totals[window].setdefault(agent, [0.0, 0.0])
+                total[TOTAL_FIELDS['premium']] += premium
+                total[TOTAL_FIELDS['commission']] += commissions
+
+    def _advance(self, today):
+        """Move every window forward to end on `today`, subtracting the days that fall out"""
+        if self.today is not None and today > self.today:
+            for day, agents in list(self.days.items()):
+                before, after = (self.today - day).days, (today - day).days
+                for window in self.windows:
+                    if before < window <= after:
+                        totals = self.totals[window]
+                        for agent, (premium, commissions) in agents.items():
+                            total = totals[agent]
+                            total[TOTAL_FIELDS['premium']] -= premium
+                            total[TOTAL_FIELDS['commission']] -= commissions
+                            if all(abs(value) < 0.005 for value in total):
+                                del totals[agent]
+                if after >= self.windows[-1]:
+                    del self.days[day]
+            self._top.clear()
+        self.today = today
+
+    def load(self, rows, names, today):
+        """Replace all buckets with (day, agent, premium, commission) rows"""
+        with self.lock:
+            self.today = today
+            self.days = {}
+            self.totals = {window: {} for window in self.windows}
+            for day, agent, premium, commissions in rows:
+                bucket = self.days.setdefault(day, {}).setdefault(agent, [0.0, 0.0])
+                bucket[TOTAL_FIELDS['premium']] += premium
+                bucket[TOTAL_FIELDS['commission']] += commissions
+                self._apply(day, agent, premium, commissions)
+            self.names = names
+            self._top.clear()
+
+    def add(self, day, agent, premium, commissions):
+        """Count new business for an agent on a day"""
+        with self.lock:
+            self._advance(max(day, self.today or day))
+            bucket = self.days.setdefault(day, {}).setdefault(agent, [0.0, 0.0])
+            bucket[TOTAL_FIELDS['premium']] += premium
+            bucket[TOTAL_FIELDS['commission']] += commissions
+            self._apply(day, agent, premium, commissions)
+            self._top.clear()
+
+    def due(self):
+        """True when the buckets should be reloaded from the cube"""
+        elapsed = time.monotonic() - self._loaded
+        if self._failed or self.today != date.today():
+            return elapsed >= RETRY_SECONDS
+        return elapsed >= self.refresh_seconds
+
+    def reload(self):
+        """Reload buckets from every shard's cube; returns False if a shard failed.
+
+        Only one thread reloads at a time. Business announced while the
+        queries run may be missing until the next reload.
+        """
+        if not self._reloading.acquire(blocking=False):
+            return True
+        try:
+            today = date.today()
+            since = today - timedelta(days=self.windows[-1] - 1)
+            rows, failed = [], False
+            for shard, result, error in shards.fan_out(lambda shard, conn: load_buckets(shard, conn, since)):
+                if error:
+                    print(f"Leaderboard reload on {shard.name} failed: {error}")
+                    failed = True
+                    continue
+                rows.extend(result)
+            names = self.names
+            try:
+                conn = shards.connect(shards.SHARDS[0])
+                try:
+                    names = load_names(conn)
+                finally:
+                    conn.close()
+            except mysql.connector.Error as e:
+                print(f"Leaderboard agent names failed: {e}")
+                failed = True
+            if not failed:
+                self.load(rows, names, today)
+                self.loaded_at = time.strftime('%Y-%m-%d %H:%M:%S')
+            self._failed = failed
+            self._loaded = time.monotonic()
+            return not failed
+        finally:
+            self._reloading.release()
+
+    def top(self, window, metric='commission', limit=DEFAULT_LIMIT):
+        """The `limit` best agents in a window by a metric, as dicts ranked from 1"""
+        if self.due():
+            self.reload()
+        key = (window, metric, limit)
+        with self.lock:
+            self._advance(date.today())
+            ranked = self._top.get(key)
+            if ranked is None:
+                index = TOTAL_FIELDS[metric]
+                best = heapq.nlargest(limit, self.totals[window].items(), key=lambda item: item[1][index])
+                ranked = [{'rank': rank, 'agency_code': agent, 'name': self.names.get(agent, ''),
+                           'commission': round(total[TOTAL_FIELDS['commission']], 2),
+                           'premium': round(total[TOTAL_FIELDS['premium']], 2)}
+                          for rank, (agent, total) in enumerate(best, 1)]
+                self._top[key] = ranked
+            return ranked
+
+board = Leaderboard()
+
+@signals.policies_issued.connect
+def _on_policies_issued(agency_code, policies):
+    board.add(date.today(), agency_code, sum(float(p['premium']) for p in policies),
+              sum(commission(p['premium'], p['term']) for p in policies))
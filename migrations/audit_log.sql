@@ -0,0 +1,16 @@
+-- Migration for databases created before the audit log
+-- Usage: mysql -u root -p insurance_db < migrations/audit_log.sql
+
+CREATE TABLE IF NOT EXISTS Audit_Log (
+    Audit_id BIGINT AUTO_INCREMENT PRIMARY KEY,
+    Event_id CHAR(32) NOT NULL COMMENT 'Unique per event, so replays never record it twice',
+    Event VARCHAR(30) NOT NULL,
+    Actor VARCHAR(7) NOT NULL COMMENT 'Admin_id or Agency_code',
+    Subject VARCHAR(20) NOT NULL COMMENT 'Plan_no or Policy_no',
+    Details TEXT NOT NULL COMMENT 'JSON encoded event fields',
+    Occurred_at DATETIME(6) NOT NULL,
+    Logged_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
+    UNIQUE KEY uq_audit_event (Event_id),
+    INDEX idx_audit_subject (Subject, Occurred_at),
+    INDEX idx_audit_actor (Actor, Occurred_at)
+) ENGINE=InnoDB;
@@ -0,0 +1,27 @@
+-- Migration for databases created before the reporting cube
+-- Usage: mysql -u root -p insurance_db < migrations/business_cube.sql
+-- The cube is filled on the first business report request (or any cube.refresh call).
+
+CREATE TABLE IF NOT EXISTS Business_Cube (
+    Day DATE NOT NULL,
+    Branch_id VARCHAR(20) NOT NULL,
+    Admin_id CHAR(5) NOT NULL DEFAULT '',
+    Agency_code CHAR(7) NOT NULL,
+    Plan_no CHAR(3) NOT NULL,
+    Mode ENUM('Yearly', 'Half-yearly', 'Quarterly', 'Monthly') NOT NULL,
+    Policy_Count INT NOT NULL DEFAULT 0,
+    Premium_Total DECIMAL(16,2) NOT NULL DEFAULT 0,
+    Sum_Assured_Total DECIMAL(18,2) NOT NULL DEFAULT 0,
+    Commission_Total DECIMAL(16,2) NOT NULL DEFAULT 0,
+    PRIMARY KEY (Day, Agency_code, Plan_no, Mode),
+    INDEX idx_cube_branch (Branch_id, Day),
+    INDEX idx_cube_admin (Admin_id, Day),
+    INDEX idx_cube_agent (Agency_code, Day),
+    INDEX idx_cube_plan (Plan_no, Day)
+) ENGINE=InnoDB;
+
+CREATE TABLE IF NOT EXISTS Cube_State (
+    Cube VARCHAR(50) PRIMARY KEY,
+    Last_policy_no CHAR(9) NOT NULL DEFAULT '',
+    Refreshed_at DATETIME
+) ENGINE=InnoDB;
@@ -0,0 +1,6 @@
+-- Migration for databases created before the dashboard summary
+-- Usage: mysql -u root -p insurance_db < migrations/dashboard_summary.sql
+-- With sharding, run it on every shard database too.
+
+-- Covers the dashboard summary aggregates (summary.py), so they never read Policy rows
+CREATE INDEX idx_policy_agent_summary ON Policy(Agency_code, Status, FUP, Premium, Term);
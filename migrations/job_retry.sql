@@ -0,0 +1,5 @@
+-- Migration for databases created before jobs could be retried later
+-- Usage: mysql -u root -p insurance_db < migrations/job_retry.sql
+
+ALTER TABLE Job ADD COLUMN Run_after DATETIME
+    COMMENT 'Not claimed before this time, set when a failed job is retried later' AFTER Finished_at;
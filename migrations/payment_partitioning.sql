@@ -0,0 +1,70 @@
+-- Migration for databases created before Payment was partitioned
+-- Usage: mysql -u root -p insurance_db < migrations/payment_partitioning.sql
+
+-- Partitioned tables cannot have foreign keys: drop Payment -> Policy
+SELECT CONSTRAINT_NAME INTO @payment_fk
+FROM information_schema.REFERENTIAL_CONSTRAINTS
+WHERE CONSTRAINT_SCHEMA = DATABASE() AND TABLE_NAME = 'Payment' AND REFERENCED_TABLE_NAME = 'Policy'
+LIMIT 1;
+
+SET @drop_fk = IF(@payment_fk IS NULL, 'DO 0', CONCAT('ALTER TABLE Payment DROP FOREIGN KEY ', @payment_fk));
+PREPARE stmt FROM @drop_fk;
+EXECUTE stmt;
+DEALLOCATE PREPARE stmt;
+
+-- The partitioning column must be part of every unique key
+ALTER TABLE Payment DROP PRIMARY KEY, ADD PRIMARY KEY (Payment_id, Timestamp);
+
+ALTER TABLE Payment
+PARTITION BY RANGE (YEAR(Timestamp)) (
+    PARTITION p2022 VALUES LESS THAN (2023),
+    PARTITION p2023 VALUES LESS THAN (2024),
+    PARTITION p2024 VALUES LESS THAN (2025),
+    PARTITION p2025 VALUES LESS THAN (2026),
+    PARTITION p2026 VALUES LESS THAN (2027),
+    PARTITION p2027 VALUES LESS THAN (2028),
+    PARTITION pmax VALUES LESS THAN MAXVALUE
+);
+
+CREATE TABLE IF NOT EXISTS Policy_Archive (
+    Policy_no CHAR(9) PRIMARY KEY,
+    Plan_no CHAR(3) NOT NULL,
+    Agency_code CHAR(7) NOT NULL,
+    Premium DECIMAL(12,2) NOT NULL,
+    DOC DATE NOT NULL,
+    FUP DATE,
+    Status TINYINT DEFAULT 0,
+    Mode ENUM('Yearly', 'Half-yearly', 'Quarterly', 'Monthly') NOT NULL,
+    Term INT NOT NULL,
+    Sum_Assured DECIMAL(12,2) NOT NULL,
+    Created_at TIMESTAMP NULL,
+    Archived_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
+    INDEX idx_archive_agent (Agency_code),
+    INDEX idx_archive_doc (DOC)
+) ENGINE=InnoDB;
+
+CREATE TABLE IF NOT EXISTS Policy_Holder_Archive (
+    Policy_no CHAR(9) PRIMARY KEY,
+    Name VARCHAR(100) NOT NULL,
+    Address VARCHAR(255) NOT NULL,
+    City VARCHAR(50) NOT NULL,
+    State VARCHAR(50) NOT NULL,
+    Pincode VARCHAR(10) NOT NULL,
+    Nominee_Name VARCHAR(100) NOT NULL,
+    Nominee_Relation VARCHAR(50) NOT NULL,
+    Gender ENUM('Male', 'Female', 'Other') NOT NULL,
+    Occupation VARCHAR(100),
+    DOB DATE NOT NULL,
+    Education VARCHAR(100)
+) ENGINE=InnoDB;
+
+CREATE TABLE IF NOT EXISTS Payment_Archive (
+    Payment_id INT NOT NULL,
+    Policy_no CHAR(9) NOT NULL,
+    Payment_Mode VARCHAR(50) NOT NULL,
+    Timestamp DATETIME NOT NULL,
+    Amount DECIMAL(12,2) NOT NULL,
+    PRIMARY KEY (Payment_id, Timestamp),
+    INDEX idx_archive_policy (Policy_no),
+    INDEX idx_archive_timestamp (Timestamp)
+) ENGINE=InnoDB;
@@ -0,0 +1,11 @@
+-- Migration for databases created before payment idempotency keys
+-- Usage: mysql -u root -p insurance_db < migrations/payment_requests.sql
+
+CREATE TABLE IF NOT EXISTS Payment_Request (
+    Request_key VARCHAR(64) PRIMARY KEY,
+    Policy_no CHAR(9) NOT NULL,
+    Payment_id INT,
+    Created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
+    INDEX idx_request_policy (Policy_no),
+    INDEX idx_request_created (Created_at)
+) ENGINE=InnoDB;
@@ -0,0 +1,293 @@
+#!/usr/bin/env python3
+"""
+Premium Due Notices
+Prints a reminder for every active policy whose FUP falls within the next N
+days, company-wide. Due policies are read from every shard in (FUP,
+Policy_no) order, a batch at a time from the idx_policy_fup_status range.
+Worker processes render the notices from templates/premium_notice.html and
+write them to a directory, one file per policy under its due date, or into
+a single tar archive. A state file beside the output records how far each
+shard has got after every batch, so an interrupted run continues where it
+stopped instead of starting over.
+
+Usage:
+    python notices.py --days 30 --out notices
+    python notices.py --days 15 --archive notices.tar --workers 8
+"""
+
+import argparse
+import io
+import json
+import os
+import sys
+import tarfile
+import time
+from collections import deque
+from datetime import date, datetime, timedelta
+from multiprocessing import Pool
+
+import jinja2
+import mysql.connector
+
+import shards
+
+TEMPLATE_DIR = os.path.join(os.path.dirname(os.path.abspath(__file__)), 'templates')
+TEMPLATE = 'premium_notice.html'
+DEFAULT_DAYS = 30
+DEFAULT_BATCH_SIZE = 500
+# Batches handed to the pool ahead of the oldest unfinished one, per worker
+READ_AHEAD = 2
+
+DUE_QUERY = """SELECT p.Policy_no, p.FUP, p.Premium, p.Mode, p.Sum_Assured, pl.Name AS Plan_name,
+               ph.Name, ph.Address, ph.City, ph.State, ph.Pincode,
+               a.Name AS Agent_name, a.Mobile AS Agent_mobile
+               FROM Policy p
+               JOIN Policy_Holder ph ON ph.Policy_no = p.Policy_no
+               JOIN Plan pl ON pl.Plan_no = p.Plan_no
+               JOIN Agent a ON a.Agency_code = p.Agency_code
+               WHERE p.FUP >= %s AND p.FUP <= %s AND p.Status = 1
+               AND (p.FUP > %s OR (p.FUP = %s AND p.Policy_no > %s))
+               ORDER BY p.FUP, p.Policy_no LIMIT %s"""
+
+#  RENDERING (worker processes)
+
+_template = None
+_as_of = None
+
+def _init_worker(template_dir, template, as_of):
+    """Compile the notice template once per worker process"""
+    global _template, _as_of
+    env = jinja2.Environment(loader=jinja2.FileSystemLoader(template_dir), autoescape=True)
+    _template = env.get_template(template)
+    _as_of = as_of
+
+def notice_name(notice):
+    """Path of a notice inside the output: grouped by due date for printing"""
+    return f"{notice['FUP'].isoformat()}/{notice['Policy_no']}.html"
+
+def render_batch(notices, out_dir=None):
+    """Render a batch; written straight to out_dir, else returned as (name, bytes) pairs"""
+    rendered = [(notice_name(notice), _template.render(notice=notice, as_of=_as_of).encode('utf-8'))
+                for notice in notices]
+    if out_dir is None:
+        return rendered
+    for name, data in rendered:
+        path = os.path.join(out_dir, name)
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+        with open(path, 'wb') as f:
+            f.write(data)
+    return len(rendered)
+
+#  STATE
+
+class RunState:
+    """What a run has written so far, saved after every batch"""
+
+    def __init__(self, path, as_of, until):
+        self.path = path
+        self.as_of = as_of
+        self.until = until
+        self.positions = {}  # shard name -> (FUP, Policy_no) of its last written notice
+        self.written = 0
+        self.archive_offset = 0
+        self.resumed = False
+
+    @classmethod
+    def load(cls, path, as_of, until):
+        """The saved state of an interrupted run, or a fresh one"""
+        if not os.path.exists(path):
+            return cls(path, as_of, until)
+        with open(path, encoding='utf-8') as f:
+            saved = json.load(f)
+        # A resumed run keeps its original window, so no policy is missed or repeated
+        state = cls(path, date.fromisoformat(saved['as_of']), date.fromisoformat(saved['until']))
+        state.positions = {name: (date.fromisoformat(fup), policy_no)
+                           for name, (fup, policy_no) in saved['positions'].items()}
+        state.written = saved['written']
+        state.archive_offset = saved['archive_offset']
+        state.resumed = True
+        return state
+
+    def save(self):
+        """Replace the state file atomically"""
+        temp = self.path + '.tmp'
+        with open(temp, 'w', encoding='utf-8') as f:
+            json.dump({
+                'as_of': self.as_of.isoformat(),
+                'until': self.until.isoformat(),
+                'positions': {name: [fup.isoformat(), policy_no] for name, (fup, policy_no) in self.positions.items()},
+                'written': self.written,
+                'archive_offset': self.archive_offset,
+            }, f)
+            f.flush()
+            os.fsync(f.fileno())
+        os.replace(temp, self.path)
+
+    def clear(self):
+        """Forget a finished run"""
+        if os.path.exists(self.path):
+            os.remove(self.path)
+
+#  GENERATION
+
+def due_batches(conn, as_of, until, after=None, batch_size=DEFAULT_BATCH_SIZE):
+    """Yield batches of due notices in (FUP, Policy_no) order, starting after the given position"""
+    fup, policy_no = after or (as_of, '')
+    cursor = conn.cursor(dictionary=True)
+    try:
+        while True:
+            cursor.execute(DUE_QUERY, (as_of, until, fup, fup, policy_no, batch_size))
+            batch = cursor.fetchall()
+            if not batch:
+                return
+            yield batch
+            fup, policy_no = batch[-1]['FUP'], batch[-1]['Policy_no']
+            if len(batch) < batch_size:
+                return
+    finally:
+        cursor.close()
+
+class NoticeRun:
+    """One notice run: reads due batches, keeps the pool busy and records progress in order"""
+
+    def __init__(self, state, out_dir=None, archive=None, workers=1, batch_size=DEFAULT_BATCH_SIZE, progress=None):
+        self.state = state
+        self.out_dir = out_dir
+        self.archive = archive
+        self.workers = workers
+        self.batch_size = batch_size
+        self.progress = progress
+        self.written = 0
+        self.started = time.monotonic()
+        self._tar = None
+
+    @property
+    def rate(self):
+        """Notices written per second in this run"""
+        elapsed = time.monotonic() - self.started
+        return self.written / elapsed if elapsed else 0.0
+
+    def run(self):
+        """Generate every notice still to be written; returns the count written by this run"""
+        if self.archive:
+            self._open_archive()
+        else:
+            os.makedirs(self.out_dir, exist_ok=True)
+        initargs = (TEMPLATE_DIR, TEMPLATE, self.state.as_of)
+        try:
+            with Pool(self.workers, initializer=_init_worker, initargs=initargs) as pool:
+                for shard in shards.SHARDS:
+                    self._run_shard(pool, shard)
+            if self._tar:
+                self._tar.close()
+                self._tar.fileobj.close()
+                self._tar = None
+        finally:
+            if self._tar:
+                # Interrupted: leave the archive as it is; the next run cuts it back to the saved offset
+                self._tar.fileobj.close()
+        self.state.clear()
+        return self.written
+
+    def _run_shard(self, pool, shard):
+        pending = deque()
+        conn = shards.connect(shard)
+        try:
+            for batch in due_batches(conn, self.state.as_of, self.state.until,
+                                     self.state.positions.get(shard.name), self.batch_size):
+                last = (batch[-1]['FUP'], batch[-1]['Policy_no'])
+                pending.append((last, pool.apply_async(render_batch, (batch, self.out_dir))))
+                while len(pending) > self.workers * READ_AHEAD:
+                    self._finish(shard, *pending.popleft())
+        finally:
+            conn.close()
+        while pending:
+            self._finish(shard, *pending.popleft())
+
+    def _finish(self, shard, last, result):
+        """Wait for the oldest batch, write it if archiving, then save the position after it"""
+        result = result.get()
+        if self._tar:
+            for name, data in result:
+                info = tarfile.TarInfo(name)
+                info.size = len(data)
+                info.mtime = time.time()
+                self._tar.addfile(info, io.BytesIO(data))
+            self._tar.fileobj.flush()
+            os.fsync(self._tar.fileobj.fileno())
+            self.state.archive_offset = self._tar.offset
+            count = len(result)
+        else:
+            count = result
+        # Batches finish in the order they were read, so everything up to `last` is written
+        self.state.positions[shard.name] = last
+        self.state.written += count
+        self.state.save()
+        self.written += count
+        if self.progress:
+            self.progress(self)
+
+    def _open_archive(self):
+        """Open the archive for appending after the last batch a previous run completed"""
+        f = open(self.archive, 'r+b' if self.state.resumed and os.path.exists(self.archive) else 'wb')
+        f.seek(self.state.archive_offset)
+        f.truncate()
+        self._tar = tarfile.open(fileobj=f, mode='w')
+
+def state_path(out_dir=None, archive=None):
+    """Where a run writing to out_dir or archive keeps its state"""
+    return (archive if archive else os.path.join(out_dir, 'notices')) + '.state.json'
+
+def generate(out_dir=None, archive=None, days=DEFAULT_DAYS, as_of=None, workers=1,
+             batch_size=DEFAULT_BATCH_SIZE, progress=None):
+    """Write the notices due within days of as_of (default today), resuming an interrupted run"""
+    as_of = as_of or date.today()
+    if not archive:
+        os.makedirs(out_dir, exist_ok=True)
+    state = RunState.load(state_path(out_dir, archive), as_of, as_of + timedelta(days=days))
+    notice_run = NoticeRun(state, out_dir, archive, workers, batch_size, progress)
+    notice_run.run()
+    return notice_run
+
+def main():
+    """Command line entry point"""
+    parser = argparse.ArgumentParser(description='Generate premium due notices for policies due soon')
+    parser.add_argument('--days', type=int, default=DEFAULT_DAYS, help='Notices for FUPs within this many days')
+    parser.add_argument('--as-of', help='First due date covered (YYYY-MM-DD, default today)')
+    output = parser.add_mutually_exclusive_group()
+    output.add_argument('--out', default='notices', help='Directory to write notices to')
+    output.add_argument('--archive', help='Write every notice into this tar file instead')
+    parser.add_argument('--workers', type=int, default=os.cpu_count() or 1, help='Rendering processes')
+    parser.add_argument('--batch-size', type=int, default=DEFAULT_BATCH_SIZE)
+    args = parser.parse_args()
+
+    as_of = datetime.strptime(args.as_of, '%Y-%m-%d').date() if args.as_of else date.today()
+    last_report = [0.0]
+
+    def report(notice_run):
+        if time.monotonic() - last_report[0] >= 5:
+            last_report[0] = time.monotonic()
+            print(f"  ✓ {notice_run.state.written:,} notices written ({notice_run.rate:,.0f}/s)")
+
+    target = args.archive or args.out
+    if os.path.exists(state_path(args.out, args.archive)):
+        print(f"Resuming the interrupted run into {target}...")
+    else:
+        print(f"Generating notices due {as_of} to {as_of + timedelta(days=args.days)} into {target}...")
+    try:
+        notice_run = generate(None if args.archive else args.out, args.archive, args.days, as_of,
+                              args.workers, args.batch_size, report)
+    except mysql.connector.Error as e:
+        print(f"✗ Database error: {e} (run again to resume)")
+        return False
+    except KeyboardInterrupt:
+        print("✗ Interrupted (run again to resume)")
+        return False
+
+    state = notice_run.state
+    print(f"✓ {state.written:,} notices due {state.as_of} to {state.until} written to {target}, "
+          f"{notice_run.written:,} by this run at {notice_run.rate:,.0f} notices/s")
+    return True
+
+if __name__ == '__main__':
+    sys.exit(0 if main() else 1)
@@ -0,0 +1,115 @@
+"""
+Premium Payments
+Records a premium payment and advances the policy's FUP in one transaction.
+The Policy row is locked (SELECT ... FOR UPDATE) so concurrent payments for
+the same policy queue up instead of both advancing FUP from the same value.
+A client idempotency key makes a repeated submit return the payment that was
+already recorded, and deadlocks or lock-wait timeouts are retried.
+"""
+
+import random
+import time
+from collections import namedtuple
+from datetime import datetime
+
+import mysql.connector
+from mysql.connector import errorcode
+
+import signals
+import statements
+
+RETRYABLE = {errorcode.ER_LOCK_DEADLOCK, errorcode.ER_LOCK_WAIT_TIMEOUT}
+MAX_ATTEMPTS = 5
+RETRY_BASE_DELAY = 0.05
+
+# previous_fup is the installment the payment paid (None when answered from an idempotency key)
+Payment = namedtuple('Payment', 'payment_id policy_no amount previous_fup next_fup matured duplicate')
+
+class PaymentError(ValueError):
+    """A payment the policy cannot accept; the message is meant for the user.
+
+    `retry` is set when the payer can correct the form and submit again.
+    """
+
+    def __init__(self, message, category='danger', retry=False):
+        super().__init__(message)
+        self.category = category
+        self.retry = retry
+
+def _recorded(cursor, key, policy_no):
+    """The payment an idempotency key already produced"""
+    cursor.execute("""SELECT r.Policy_no, r.Payment_id, pm.Amount, p.FUP, p.Status
+                      FROM Payment_Request r
+                      LEFT JOIN Payment pm ON pm.Payment_id = r.Payment_id AND pm.Policy_no = r.Policy_no
+                      LEFT JOIN Policy p ON p.Policy_no = r.Policy_no
+                      WHERE r.Request_key = %s""", (key,))
+    row = cursor.fetchone()
+    if not row or row['Policy_no'] != policy_no:
+        raise PaymentError('This payment reference was already used for another policy')
+    return Payment(row['Payment_id'], policy_no, row['Amount'], None, row['FUP'], row['Status'] != 1, True)
+
+def _pay_once(conn, cursor, policy_no, agency_code, amount, mode, key, expected_fup):
+    conn.start_transaction()
+    try:
+        if key:
+            # Claim the key first: a concurrent submit with the same key waits here and then sees the duplicate
+            try:
+                cursor.execute("INSERT INTO Payment_Request (Request_key, Policy_no) VALUES (%s, %s)", (key, policy_no))
+            except mysql.connector.IntegrityError as e:
+                if e.errno != errorcode.ER_DUP_ENTRY:
+                    raise
+                conn.rollback()
+                payment = _recorded(cursor, key, policy_no)
+                # End the lookup's read transaction, so the connection can start the next payment
+                conn.commit()
+                return payment
+
+        policy = statements.fetch_one(conn, 'lock_policy', (policy_no,))
+        if not policy or policy['Agency_code'] != agency_code:
+            raise PaymentError('Policy not found')
+        if policy['FUP'] is None:
+            raise PaymentError('Policy is matured or inactive', 'warning')
+        if expected_fup and str(policy['FUP']) != str(expected_fup):
+            raise PaymentError(f"The installment due {expected_fup} has already been paid; "
+                               f"the next one is due {policy['FUP']}", 'warning')
+        if amount < policy['Premium']:
+            raise PaymentError(f"Payment amount must be at least {policy['Premium']}", retry=True)
+
+        payment_id = statements.execute(conn, 'insert_payment', (policy_no, mode, datetime.now(), amount))
+
+        # The row is locked, so SEL() steps from the FUP checked above
+        next_fup = statements.fetch_one(conn, 'next_fup', (policy_no,))['Next_FUP']
+        statements.execute(conn, 'advance_fup', (next_fup, 1 if next_fup else 0, policy_no))
+        if key:
+            cursor.execute("UPDATE Payment_Request SET Payment_id = %s WHERE Request_key = %s", (payment_id, key))
+        conn.commit()
+    except Exception:
+        conn.rollback()
+        raise
+    return Payment(payment_id, policy_no, amount, policy['FUP'], next_fup, next_fup is None, False)
+
+def record_payment(conn, policy_no, agency_code, amount, mode, key=None, expected_fup=None,
+                   max_attempts=MAX_ATTEMPTS):
+    """Record one premium payment, returns a Payment.
+
+    Raises PaymentError when the policy cannot take the payment and
+    mysql.connector.Error when the database keeps failing. `expected_fup` is
+    the due date the payer saw; if FUP has moved on since, the installment
+    was paid by someone else and the payment is refused.
+    """
+    cursor = conn.cursor(dictionary=True)
+    try:
+        for attempt in range(1, max_attempts + 1):
+            try:
+                payment = _pay_once(conn, cursor, policy_no, agency_code, amount, mode, key, expected_fup)
+                break
+            except mysql.connector.Error as e:
+                if e.errno not in RETRYABLE or attempt == max_attempts:
+                    raise
+                # Jittered backoff so the transactions that collided don't collide again
+                time.sleep(RETRY_BASE_DELAY * (2 ** (attempt - 1)) * random.uniform(0.5, 1.5))
+    finally:
+        cursor.close()
+    if not payment.duplicate:
+        signals.payment_recorded.send(agency_code, payment=payment)
+    return payment
@@ -0,0 +1,81 @@
+"""
+Policy Rules
+Plan validation, premium calculation and policy number allocation shared by
+the policy form and the bulk importer
+"""
+
+from datetime import datetime
+from decimal import ROUND_HALF_UP, Decimal
+
+POLICY_NO_START = 100000000
+
+# Share of premium × term paid as commission, as in the COM() stored function
+COMMISSION_RATE = 0.05
+
+def calculate_age(dob, today=None):
+    """Age in completed years on the given day"""
+    today = today or datetime.today()
+    return today.year - dob.year - ((today.month, today.day) < (dob.month, dob.day))
+
+def validate_policy(plan, age, term, sum_assured):
+    """Check an application against plan rules, returns a list of error messages"""
+    errors = []
+
+    # Age check
+    if age < plan['Min_Age'] or age > plan['Max_Age']:
+        errors.append(f"Age must be between {plan['Min_Age']} and {plan['Max_Age']}")
+
+    # Term check
+    if plan['T3'] and plan['T4']:  # Specific type
+        valid_terms = [plan['T1'], plan['T2'], plan['T3'], plan['T4']]
+        if term not in valid_terms:
+            errors.append(f"Term must be one of: {', '.join(map(str, valid_terms))}")
+    else:  # Range type
+        if term < plan['T1'] or term > plan['T2']:
+            errors.append(f"Term must be between {plan['T1']} and {plan['T2']}")
+
+    # Sum Assured check
+    if sum_assured < plan['Min_SA'] or sum_assured > plan['Max_SA']:
+        errors.append(f"Sum Assured must be between {plan['Min_SA']} and {plan['Max_SA']}")
+
+    # Maturity check
+    if age + term > plan['MMA']:
+        errors.append(f"Age + Term cannot exceed Maturity Age of {plan['MMA']}")
+
+    return errors
+
+def calculate_premium(sum_assured, term, mode):
+    """Installment premium for the payment mode (simplified)"""
+    premium = sum_assured / term
+    if mode == 'Half-yearly':
+        premium = premium / 2
+    elif mode == 'Quarterly':
+        premium = premium / 4
+    elif mode == 'Monthly':
+        premium = premium / 12
+    return premium
+
+def commission(premium, term):
+    """Agent commission on a policy, the same as COM(Premium, Term) (rounded half up)"""
+    return float((Decimal(str(premium)) * term * Decimal(str(COMMISSION_RATE))).quantize(Decimal('0.01'), ROUND_HALF_UP))
+
+def allocate_policy_numbers(cursor, count=1, start=POLICY_NO_START):
+    """Reserve a block of consecutive policy numbers inside the current transaction.
+
+    Policy numbers are zero-padded to 9 digits so the highest key is also the
+    last one in the primary key index. Locking it keeps concurrent issuers
+    from handing out the same block until this transaction ends. Archived
+    policies keep their numbers, so the archive is checked too. `start` is
+    the floor of the database's number block (see shards.py).
+    """
+    cursor.execute("SELECT Policy_no FROM Policy ORDER BY Policy_no DESC LIMIT 1 FOR UPDATE")
+    live = cursor.fetchone()
+    cursor.execute("SELECT MAX(Policy_no) AS Policy_no FROM Policy_Archive")
+    archived = cursor.fetchone()
+
+    last_no = start
+    for row in (live, archived):
+        value = (row['Policy_no'] if isinstance(row, dict) else row[0]) if row else None
+        if value:
+            last_no = max(last_no, int(value))
+    return [str(last_no + i).zfill(9) for i in range(1, count + 1)]
@@ -0,0 +1,422 @@
+#!/usr/bin/env python3
+"""
+Request Profiler
+On-demand profiling of chosen endpoints in production. An admin starts a
+run from /admin/profiling for some endpoints, the fraction of their requests
+to profile, a profiler and a time limit. The run is written to a control
+file in PROFILE_DIR that every app process polls, so all workers pick it up.
+Sampled requests are profiled either with cProfile or with a stack sampler
+thread that records where the request's thread is every PROFILE_SAMPLE_MS,
+which costs far less than tracing every call. Results are aggregated per
+endpoint in memory and written under PROFILE_DIR/<run>/ every few seconds:
+<endpoint>-<pid>.pstats for cProfile, <endpoint>-<pid>.collapsed (one
+"frame;frame;frame count" line per stack, the input of flamegraph.pl and
+speedscope) for the sampler. With no run active a request only pays one
+lookup in an empty dict.
+
+Usage:
+    python profiler.py                                          # list runs
+    python profiler.py 20261019-101500 --endpoint add_policy --top 30
+    python profiler.py 20261019-101500 --endpoint business_report --collapsed > stacks.txt
+"""
+
+import argparse
+import atexit
+import cProfile
+import glob
+import io
+import json
+import marshal
+import os
+import pstats
+import random
+import re
+import sys
+import threading
+import time
+from collections import Counter, namedtuple
+from datetime import datetime
+
+PROFILE_DIR = os.getenv('PROFILE_DIR', 'profiles')
+SAMPLE_MS = float(os.getenv('PROFILE_SAMPLE_MS', 5))
+POLL_SECONDS = 2.0
+MAX_MINUTES = 60
+MODES = ('sample', 'cprofile')
+CONTROL_FILE = 'control.json'
+RUN_FILE = 'run.json'
+RUN_ID = re.compile(r'^\d{8}-\d{6}$')
+SUFFIX = {'cprofile': '.pstats', 'sample': '.collapsed'}
+
+class Run(namedtuple('Run', 'id mode endpoints until')):
+    """A profiling run; endpoints: endpoint -> fraction of its requests profiled, until: end as a timestamp"""
+
+    @property
+    def ends(self):
+        return datetime.fromtimestamp(self.until).strftime('%Y-%m-%d %H:%M:%S')
+
+# What begin() hands the request, for end()
+Token = namedtuple('Token', 'key thread profile')
+
+def _write_atomic(path, data):
+    directory, name = os.path.split(path)
+    temp = os.path.join(directory, f'.{name}.{os.getpid()}.tmp')
+    with open(temp, 'wb') as f:
+        f.write(data)
+    os.replace(temp, path)
+
+def _read_run(path):
+    with open(path, encoding='utf-8') as f:
+        saved = json.load(f)
+    return Run(saved['id'], saved['mode'], saved['endpoints'], saved['until'])
+
+def _encode_run(run):
+    return json.dumps(run._asdict()).encode('utf-8')
+
+def _read_stacks(path):
+    stacks = Counter()
+    with open(path, encoding='utf-8') as f:
+        for line in f:
+            stack, _, count = line.rstrip('\n').rpartition(' ')
+            if stack:
+                stacks[stack] += int(count)
+    return stacks
+
+def _encode_stacks(stacks):
+    return ''.join(f'{stack} {count}\n' for stack, count in stacks.most_common()).encode('utf-8')
+
+def _frame_name(code):
+    return f"{os.path.basename(code.co_filename)}:{getattr(code, 'co_qualname', code.co_name)}"
+
+class RequestProfiler:
+    """The active run of this process: which requests to profile, and their aggregated results"""
+
+    def __init__(self, profile_dir=PROFILE_DIR, sample_ms=SAMPLE_MS, poll_seconds=POLL_SECONDS):
+        self.profile_dir = os.path.abspath(profile_dir)
+        self.sample_interval = sample_ms / 1000
+        self.poll_seconds = poll_seconds
+        self.run = None
+        # Endpoint -> fraction; empty unless a run is active, so the request hook is one dict lookup
+        self.targets = {}
+        self.profiled = 0
+        self.skipped = 0
+        self._pid = None
+        self._thread = None
+        self._stopped = threading.Event()
+        self._wake = threading.Event()
+        self._control_lock = threading.Lock()
+        self._control_mtime = None
+        # Only one request per process runs under cProfile at a time: from Python 3.12 it hooks the
+        # whole interpreter rather than one thread
+        self._cprofile_lock = threading.Lock()
+        self._active = {}  # thread id -> (run id, endpoint) of a request being sampled
+        self._finished = []  # (key, cProfile.Profile) waiting to be merged by the profiler thread
+        self._stats = {}  # (run id, endpoint) -> pstats.Stats
+        self._stacks = {}  # (run id, endpoint) -> Counter of collapsed stacks
+        self._dirty = set()
+
+    #  LIFECYCLE
+
+    def start(self):
+        """Start this process's profiler thread (again after a fork)"""
+        with self._control_lock:
+            if self._pid == os.getpid() and self._thread and self._thread.is_alive():
+                return
+            first = self._pid is None
+            self._pid = os.getpid()
+            self._active, self._finished, self._stats, self._stacks, self._dirty = {}, [], {}, {}, set()
+            self._stopped = threading.Event()
+            self._thread = threading.Thread(target=self._run, name='request-profiler', daemon=True)
+            self._thread.start()
+            if first:
+                atexit.register(self.stop)
+
+    def stop(self):
+        """Stop the profiler thread and write out what it has"""
+        if self._pid != os.getpid() or not self._thread:
+            return
+        self._stopped.set()
+        self._wake.set()
+        self._thread.join()
+        self.flush()
+
+    def _run(self):
+        next_poll = 0.0
+        while not self._stopped.is_set():
+            if time.monotonic() >= next_poll:
+                next_poll = time.monotonic() + self.poll_seconds
+                try:
+                    self.poll()
+                    self.flush()
+                except (OSError, ValueError) as e:
+                    print(f"Profiler update failed: {e}")
+            if self.run and self.run.mode == 'sample':
+                self._sample()
+                timeout = self.sample_interval
+            else:
+                timeout = max(0.0, next_poll - time.monotonic())
+            # Woken early when this process starts or stops a run
+            if self._wake.wait(timeout):
+                self._wake.clear()
+
+    #  CONTROL
+
+    @property
+    def control_path(self):
+        return os.path.join(self.profile_dir, CONTROL_FILE)
+
+    def start_run(self, endpoints, fraction, mode, minutes):
+        """Profile a fraction of the endpoints' requests in every process for some minutes"""
+        if not endpoints:
+            raise ValueError('Choose at least one endpoint to profile')
+        if not 0 < fraction <= 1:
+            raise ValueError('The fraction of requests profiled must be above 0 and at most 1')
+        if mode not in MODES:
+            raise ValueError(f"Unknown profiler '{mode}'")
+        if not 0 < minutes <= MAX_MINUTES:
+            raise ValueError(f'A run lasts from 1 to {MAX_MINUTES} minutes')
+        run = Run(datetime.now().strftime('%Y%m%d-%H%M%S'), mode,
+                  {endpoint: fraction for endpoint in endpoints}, time.time() + minutes * 60)
+        run_dir = os.path.join(self.profile_dir, run.id)
+        os.makedirs(run_dir, exist_ok=True)
+        _write_atomic(os.path.join(run_dir, RUN_FILE), _encode_run(run))
+        _write_atomic(self.control_path, _encode_run(run))
+        self.poll()
+        return run
+
+    def stop_run(self):
+        """End the active run in every process"""
+        self.poll()
+        run = self.run
+        try:
+            os.remove(self.control_path)
+        except FileNotFoundError:
+            pass
+        if run:
+            # Record when it really ended
+            _write_atomic(os.path.join(self.profile_dir, run.id, RUN_FILE), _encode_run(run._replace(until=time.time())))
+        self.poll()
+
+    def poll(self):
+        """Pick up a run started or stopped by any process, and end it once its time is up"""
+        with self._control_lock:
+            try:
+                mtime = os.stat(self.control_path).st_mtime_ns
+            except FileNotFoundError:
+                mtime = None
+            if mtime != self._control_mtime:
+                self._control_mtime = mtime
+                run = None
+                if mtime is not None:
+                    try:
+                        run = _read_run(self.control_path)
+                    except (OSError, ValueError, KeyError):
+                        run = None  # replaced or removed while being read; the next poll sees it
+                        self._control_mtime = None
+                self._activate(run)
+            if self.run and time.time() >= self.run.until:
+                self._activate(None)
+
+    def _activate(self, run):
+        if run and time.time() >= run.until:
+            run = None
+        # Stop sending requests to the old run before switching
+        self.targets = {}
+        self.run = run
+        if run:
+            self.targets = dict(run.endpoints)
+        self._wake.set()
+
+    #  REQUESTS
+
+    def begin(self, endpoint):
+        """Start profiling this request if it is sampled, returns a Token for end() or None"""
+        run = self.run
+        fraction = self.targets.get(endpoint)
+        if run is None or fraction is None or random.random() >= fraction:
+            return None
+        key = (run.id, endpoint)
+        if run.mode == 'cprofile':
+            if not self._cprofile_lock.acquire(blocking=False):
+                self.skipped += 1
+                return None
+            profile = cProfile.Profile()
+            profile.enable()
+            return Token(key, None, profile)
+        thread = threading.get_ident()
+        self._active[thread] = key
+        return Token(key, thread, None)
+
+    def end(self, token):
+        """Finish a profiled request; merging its results is left to the profiler thread"""
+        if token.profile:
+            token.profile.disable()
+            self._cprofile_lock.release()
+            with self._control_lock:
+                self._finished.append((token.key, token.profile))
+        else:
+            self._active.pop(token.thread, None)
+        self.profiled += 1
+
+    def _sample(self):
+        """Add the current stack of every request being sampled"""
+        if not self._active:
+            return
+        frames = sys._current_frames()
+        for thread, key in list(self._active.items()):
+            frame = frames.get(thread)
+            stack = []
+            while frame is not None:
+                stack.append(_frame_name(frame.f_code))
+                frame = frame.f_back
+            if stack:
+                self._stacks.setdefault(key, Counter())[';'.join(reversed(stack))] += 1
+                self._dirty.add(key)
+
+    #  RESULTS
+
+    def result_path(self, key, mode):
+        run_id, endpoint = key
+        return os.path.join(self.profile_dir, run_id, f'{endpoint}-{os.getpid()}{SUFFIX[mode]}')
+
+    def flush(self):
+        """Merge finished profiles and write every changed aggregate to its file"""
+        with self._control_lock:
+            finished, self._finished = self._finished, []
+        for key, profile in finished:
+            stats = self._stats.get(key)
+            if stats is None:
+                path = self.result_path(key, 'cprofile')
+                # Results that arrive after their run was dropped from memory are added to its file
+                stats = self._stats[key] = pstats.Stats(path) if os.path.exists(path) else pstats.Stats()
+            stats.add(profile)
+            self._dirty.add(key)
+        dirty, self._dirty = self._dirty, set()
+        for key in dirty:
+            if key in self._stats:
+                _write_atomic(self.result_path(key, 'cprofile'), marshal.dumps(self._stats[key].stats))
+            if key in self._stacks:
+                _write_atomic(self.result_path(key, 'sample'), _encode_stacks(self._stacks[key]))
+        # Only the active run's results, and those of requests still being sampled, stay in memory
+        current = self.run.id if self.run else None
+        active = set(self._active.values())
+        for results in (self._stats, self._stacks):
+            for key in [key for key in results if key[0] != current and key not in active]:
+                del results[key]
+
+requests = RequestProfiler()
+
+#  SAVED RUNS
+
+def runs(profile_dir=PROFILE_DIR):
+    """Saved runs, newest first, as (Run, {endpoint: [result files]})"""
+    found = []
+    for run_file in glob.glob(os.path.join(profile_dir, '*', RUN_FILE)):
+        try:
+            run = _read_run(run_file)
+        except (OSError, ValueError, KeyError):
+            continue
+        found.append((run, {endpoint: result_files(run.id, endpoint, profile_dir) for endpoint in run.endpoints}))
+    return sorted(found, key=lambda item: item[0].id, reverse=True)
+
+def load_run(run_id, profile_dir=PROFILE_DIR):
+    """A saved run, None if there is none"""
+    if not RUN_ID.match(run_id):
+        return None
+    try:
+        return _read_run(os.path.join(profile_dir, run_id, RUN_FILE))
+    except (OSError, ValueError, KeyError):
+        return None
+
+def result_files(run_id, endpoint, profile_dir=PROFILE_DIR):
+    """Every process's result file for an endpoint in a run"""
+    return sorted(glob.glob(os.path.join(glob.escape(os.path.join(profile_dir, run_id)),
+                                         f'{glob.escape(endpoint)}-[0-9]*.*')))
+
+def merged_stats(run_id, endpoint, profile_dir=PROFILE_DIR):
+    """The cProfile results of all processes as one pstats.Stats, None if there are none"""
+    files = [path for path in result_files(run_id, endpoint, profile_dir) if path.endswith('.pstats')]
+    return pstats.Stats(*files) if files else None
+
+def merged_stacks(run_id, endpoint, profile_dir=PROFILE_DIR):
+    """The sampled stacks of all processes added together"""
+    stacks = Counter()
+    for path in result_files(run_id, endpoint, profile_dir):
+        if path.endswith('.collapsed'):
+            stacks.update(_read_stacks(path))
+    return stacks
+
+def export(run, endpoint, profile_dir=PROFILE_DIR):
+    """(file name, bytes) of an endpoint's merged results: a pstats dump or collapsed stacks"""
+    name = f'{run.id}-{endpoint}{SUFFIX[run.mode]}'
+    if run.mode == 'cprofile':
+        stats = merged_stats(run.id, endpoint, profile_dir)
+        return name, marshal.dumps(stats.stats if stats else {})
+    return name, _encode_stacks(merged_stacks(run.id, endpoint, profile_dir))
+
+def summary(run, endpoint, top=30, profile_dir=PROFILE_DIR):
+    """Readable summary of an endpoint's merged results"""
+    out = io.StringIO()
+    if run.mode == 'cprofile':
+        stats = merged_stats(run.id, endpoint, profile_dir)
+        if not stats:
+            return 'No requests profiled yet.\n'
+        stats.stream = out
+        stats.strip_dirs().sort_stats('cumulative').print_stats(top)
+        return out.getvalue()
+    stacks = merged_stacks(run.id, endpoint, profile_dir)
+    total = sum(stacks.values())
+    if not total:
+        return 'No samples yet.\n'
+    inclusive, own = Counter(), Counter()
+    for stack, count in stacks.items():
+        frames = stack.split(';')
+        own[frames[-1]] += count
+        for frame in set(frames):
+            inclusive[frame] += count
+    out.write(f'{total:,} samples of {endpoint} (one every {SAMPLE_MS:g} ms per request)\n')
+    for title, counts in (('Most time in the function or below it', inclusive), ('Most time in the function itself', own)):
+        out.write(f'\n{title}:\n{"samples":>10} {"share":>7}  function\n')
+        for frame, count in counts.most_common(top):
+            out.write(f'{count:>10,} {count / total:>7.1%}  {frame}\n')
+    return out.getvalue()
+
+def main():
+    """Command line entry point"""
+    parser = argparse.ArgumentParser(description='Show the results of request profiling runs')
+    parser.add_argument('run', nargs='?', help='Run id (default: list runs)')
+    parser.add_argument('--endpoint', help='Endpoint to show (default: every endpoint of the run)')
+    parser.add_argument('--top', type=int, default=30, help='Functions listed')
+    parser.add_argument('--collapsed', action='store_true', help='Print merged collapsed stacks for flamegraph.pl')
+    parser.add_argument('--dir', default=PROFILE_DIR, help='Profile directory')
+    args = parser.parse_args()
+
+    if not args.run:
+        saved = runs(args.dir)
+        if not saved:
+            print(f"No profiling runs in {args.dir}")
+        for run, files in saved:
+            print(f"{run.id}  {run.mode:<9} until {run.ends}  "
+                  + ', '.join(f"{endpoint} ({len(paths)} processes)" for endpoint, paths in files.items()))
+        return True
+
+    run = load_run(args.run, args.dir)
+    if not run:
+        print(f"✗ No profiling run {args.run} in {args.dir}")
+        return False
+    endpoints = [args.endpoint] if args.endpoint else list(run.endpoints)
+    for endpoint in endpoints:
+        if endpoint not in run.endpoints:
+            print(f"✗ Run {run.id} did not profile {endpoint}")
+            return False
+        if args.collapsed:
+            if run.mode != 'sample':
+                print("✗ Collapsed stacks come from sampling runs; this run used cProfile")
+                return False
+            sys.stdout.write(_encode_stacks(merged_stacks(run.id, endpoint, args.dir)).decode('utf-8'))
+        else:
+            print(f"== {endpoint} ==")
+            print(summary(run, endpoint, args.top, args.dir))
+    return True
+
+if __name__ == '__main__':
+    sys.exit(0 if main() else 1)
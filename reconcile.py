@@ -0,0 +1,220 @@
+#!/usr/bin/env python3
+"""
+Arrears Reconciliation
+Checks recorded payments against each policy's installment schedule. Policy
+and Payment are streamed in Policy_no order and merge-joined, so memory use
+stays flat however large the book is. Every shard is reconciled, in ranges
+of policy numbers that parallel worker processes can take; a shard that
+cannot be reached is reported rather than skipped silently.
+"""
+
+import argparse
+import csv
+import os
+import shutil
+import sys
+import tempfile
+import time
+from bisect import bisect_left, bisect_right
+from datetime import date, datetime
+from decimal import Decimal
+from multiprocessing import Pool
+
+import mysql.connector
+
+import shards
+from schedule import due_dates
+
+COLUMNS = [
+    'Policy_no', 'Agency_code', 'Mode', 'DOC', 'Term', 'Premium', 'Installments_total',
+    'Installments_due', 'Installments_paid', 'Amount_paid', 'Arrears_count', 'Arrears_amount',
+    'Expected_FUP', 'Recorded_FUP', 'Issues'
+]
+
+POLICY_QUERY = """SELECT Policy_no, Agency_code, DOC, Mode, Term, Premium, FUP, Status
+                  FROM Policy WHERE Policy_no >= %s AND Policy_no < %s ORDER BY Policy_no"""
+
+PAYMENT_QUERY = """SELECT Policy_no, COUNT(*), SUM(Amount)
+                   FROM Payment WHERE Policy_no >= %s AND Policy_no < %s
+                   GROUP BY Policy_no ORDER BY Policy_no"""
+
+def reconcile_policy(policy, paid_count, paid_amount, as_of):
+    """Compare one policy with its payments, returns a report row or None if it reconciles"""
+    policy_no, agency_code, doc, mode, term, premium, fup, status = policy
+    # The calendar starts at the first FUP the policy was issued with, not at DOC
+    dates = due_dates(doc, mode, term)
+    due_count = bisect_right(dates, as_of)
+    expected_fup = dates[paid_count] if paid_count < len(dates) else None
+    # Installments the recorded FUP has moved past; counted, so a FUP a few days off the calendar still agrees
+    fup_paid = len(dates) if fup is None else bisect_left(dates, fup)
+
+    issues = []
+    arrears = max(due_count - paid_count, 0)
+    if arrears:
+        issues.append('arrears')
+    if paid_count > len(dates):
+        issues.append('overpaid')
+    if fup_paid != min(paid_count, len(dates)):
+        issues.append('fup_mismatch')
+    if (expected_fup is None) != (status == 0):
+        issues.append('status_mismatch')
+    if not issues:
+        return None
+
+    return {
+        'Policy_no': policy_no,
+        'Agency_code': agency_code,
+        'Mode': mode,
+        'DOC': doc,
+        'Term': term,
+        'Premium': premium,
+        'Installments_total': len(dates),
+        'Installments_due': due_count,
+        'Installments_paid': paid_count,
+        'Amount_paid': paid_amount,
+        'Arrears_count': arrears,
+        'Arrears_amount': premium * arrears,
+        'Expected_FUP': expected_fup,
+        'Recorded_FUP': fup,
+        'Issues': ' '.join(issues),
+    }
+
+def merge_join(policies, payments):
+    """Pair each policy with its (count, amount) payment totals; both inputs are sorted by Policy_no"""
+    payment = next(payments, None)
+    for policy in policies:
+        while payment is not None and payment[0] < policy[0]:
+            payment = next(payments, None)
+        if payment is not None and payment[0] == policy[0]:
+            yield policy, payment[1], payment[2] or Decimal('0')
+        else:
+            yield policy, 0, Decimal('0')
+
+def stream(cursor, query, params, batch_size=1000):
+    """Iterate an unbuffered result set a batch at a time"""
+    cursor.execute(query, params)
+    while True:
+        rows = cursor.fetchmany(batch_size)
+        if not rows:
+            return
+        yield from rows
+
+def reconcile_range(config, lo, hi, as_of, writer):
+    """Reconcile a shard's policies with lo <= Policy_no < hi, writing mismatches. Returns summary counts."""
+    # One connection per stream: an unbuffered result set occupies its connection until read
+    policy_conn = mysql.connector.connect(**config)
+    payment_conn = mysql.connector.connect(**config)
+    summary = {'policies': 0, 'arrears': 0, 'arrears_amount': Decimal('0'), 'overpaid': 0,
+               'fup_mismatch': 0, 'status_mismatch': 0}
+    try:
+        policies = stream(policy_conn.cursor(), POLICY_QUERY, (lo, hi))
+        payments = stream(payment_conn.cursor(), PAYMENT_QUERY, (lo, hi))
+        for policy, paid_count, paid_amount in merge_join(policies, payments):
+            summary['policies'] += 1
+            row = reconcile_policy(policy, paid_count, paid_amount, as_of)
+            if row is None:
+                continue
+            for issue in row['Issues'].split():
+                summary[issue] += 1
+            summary['arrears_amount'] += row['Arrears_amount']
+            writer.writerow(row)
+    finally:
+        policy_conn.close()
+        payment_conn.close()
+    return summary
+
+def policy_ranges(config, workers):
+    """Split a shard's live policy numbers into contiguous [lo, hi) ranges, one per worker"""
+    conn = mysql.connector.connect(**config)
+    cursor = conn.cursor()
+    cursor.execute("SELECT MIN(Policy_no), MAX(Policy_no) FROM Policy")
+    first, last = cursor.fetchone()
+    cursor.close()
+    conn.close()
+    if first is None:
+        return []
+
+    first, last = int(first), int(last) + 1
+    step = max((last - first + workers - 1) // workers, 1)
+    bounds = list(range(first, last, step)) + [last]
+    return [(str(lo).zfill(9), str(hi).zfill(9)) for lo, hi in zip(bounds, bounds[1:])]
+
+def _reconcile_part(args):
+    """Worker process entry point: reconcile one range into its own part file.
+
+    Returns (shard name, part path, summary, error); a database error is
+    returned as text so the other ranges carry on.
+    """
+    name, config, lo, hi, as_of, part_path = args
+    try:
+        with open(part_path, 'w', newline='', encoding='utf-8') as f:
+            summary = reconcile_range(config, lo, hi, as_of, csv.DictWriter(f, fieldnames=COLUMNS))
+    except mysql.connector.Error as e:
+        return name, part_path, None, str(e)
+    return name, part_path, summary, None
+
+def reconcile(output_path, as_of=None, workers=1):
+    """Reconcile every shard into output_path, returns (combined summary, warnings for unreachable shards)"""
+    as_of = as_of or date.today()
+    part_dir = tempfile.mkdtemp(prefix='reconcile-')
+    tasks, warnings = [], []
+    for shard in shards.SHARDS:
+        try:
+            ranges = policy_ranges(shard.config, workers)
+        except mysql.connector.Error as e:
+            warnings.append(f'{shard.name} unavailable: {e}')
+            continue
+        tasks += [(shard.name, shard.config, lo, hi, as_of, os.path.join(part_dir, f'part-{len(tasks) + i:04d}.csv'))
+                  for i, (lo, hi) in enumerate(ranges)]
+
+    try:
+        if workers > 1 and len(tasks) > 1:
+            with Pool(min(workers, len(tasks))) as pool:
+                results = pool.map(_reconcile_part, tasks)
+        else:
+            results = [_reconcile_part(task) for task in tasks]
+
+        # Parts are in shard, then Policy_no order, so concatenating them keeps each shard's rows sorted
+        totals = {}
+        failed = set()
+        with open(output_path, 'w', newline='', encoding='utf-8') as out:
+            csv.DictWriter(out, fieldnames=COLUMNS).writeheader()
+            for name, part_path, summary, error in results:
+                if error:
+                    if name not in failed:
+                        failed.add(name)
+                        warnings.append(f'{name} unavailable: {error}')
+                    continue
+                with open(part_path, newline='', encoding='utf-8') as part:
+                    shutil.copyfileobj(part, out)
+                for key, value in summary.items():
+                    totals[key] = totals.get(key, 0) + value
+    finally:
+        shutil.rmtree(part_dir, ignore_errors=True)
+    return totals, warnings
+
+def main():
+    """Command line entry point"""
+    parser = argparse.ArgumentParser(description='Reconcile recorded payments against policy schedules')
+    parser.add_argument('--output', default='reconciliation.csv', help='Where to write mismatched policies')
+    parser.add_argument('--as-of', help='Reconcile as of this date (YYYY-MM-DD, default today)')
+    parser.add_argument('--workers', type=int, default=os.cpu_count() or 1,
+                        help='Worker processes, each reconciling a range of policy numbers')
+    args = parser.parse_args()
+
+    as_of = datetime.strptime(args.as_of, '%Y-%m-%d').date() if args.as_of else date.today()
+    started = time.monotonic()
+    print(f"Reconciling payments as of {as_of} on {len(shards.SHARDS)} shard(s) with {args.workers} worker(s)...")
+    totals, warnings = reconcile(args.output, as_of, args.workers)
+    for warning in warnings:
+        print(f"  ✗ {warning}")
+
+    print(f"  ✓ {totals.get('policies', 0)} policies checked in {time.monotonic() - started:.1f}s")
+    print(f"  ✓ {totals.get('arrears', 0)} in arrears (₹{totals.get('arrears_amount', 0):,.2f} outstanding)")
+    print(f"  ✓ {totals.get('overpaid', 0)} overpaid")
+    print(f"  ✓ {totals.get('fup_mismatch', 0)} FUP mismatches, {totals.get('status_mismatch', 0)} status mismatches")
+    print(f"Details written to {args.output}")
+    return not warnings
+
+if __name__ == '__main__':
+    sys.exit(0 if main() else 1)
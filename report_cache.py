@@ -0,0 +1,142 @@
+"""
+Report Cache
+Per-process cache of business report results, keyed by the normalized
+report slice. Results change only when policies are issued, so an entry is
+fresh for REPORT_CACHE_TTL seconds or until a policy is issued (signals.py),
+whichever comes first. A stale entry is still served straight away while one
+background refresh recomputes it; only entries older than
+REPORT_CACHE_MAX_STALE make the request wait. Whatever the number of
+simultaneous requests for a slice, one computation runs for it
+(single-flight) and the others wait for its result. The least recently used
+entries are evicted beyond REPORT_CACHE_SIZE.
+"""
+
+import os
+import threading
+import time
+from collections import OrderedDict, namedtuple
+from concurrent.futures import Future, ThreadPoolExecutor
+
+import signals
+
+TTL_SECONDS = int(os.getenv('REPORT_CACHE_TTL', 60))
+MAX_STALE_SECONDS = int(os.getenv('REPORT_CACHE_MAX_STALE', 600))
+MAX_ENTRIES = int(os.getenv('REPORT_CACHE_SIZE', 256))
+REFRESH_WORKERS = 2
+
+Entry = namedtuple('Entry', 'value computed generation computed_at')
+
+class ReportCache:
+    """LRU map of computed results with stale-while-revalidate and single-flight"""
+
+    def __init__(self, ttl=TTL_SECONDS, max_stale=MAX_STALE_SECONDS, max_entries=MAX_ENTRIES,
+                 cacheable=None):
+        self.ttl = ttl
+        self.max_stale = max_stale
+        self.max_entries = max_entries
+        # Results the predicate rejects (e.g. incomplete ones) are returned but not kept
+        self.cacheable = cacheable or (lambda value: True)
+        self.generation = 0
+        self.entries = OrderedDict()
+        self.stats = dict.fromkeys(('hits', 'stale_hits', 'misses', 'refreshes', 'evictions'), 0)
+        self._inflight = {}
+        self._lock = threading.Lock()
+        self._executor = None
+        self._pid = None
+
+    def invalidate(self):
+        """Mark every entry stale; they are still served while they refresh"""
+        with self._lock:
+            self.generation += 1
+
+    def discard(self, key):
+        """Forget one entry, so the next get() computes it afresh instead of serving it stale"""
+        with self._lock:
+            self.entries.pop(key, None)
+            # A computation already running may have read the data before the change: not kept
+            self._inflight.pop(key, None)
+
+    def keys(self):
+        with self._lock:
+            return list(self.entries)
+
+    def _is_fresh(self, entry, now):
+        return entry.generation == self.generation and now - entry.computed < self.ttl
+
+    def get(self, key, compute):
+        """(value, computed_at) for key, calling compute() on a miss or in the background when stale"""
+        now = time.monotonic()
+        with self._lock:
+            entry = self.entries.get(key)
+            if entry:
+                self.entries.move_to_end(key)
+                if self._is_fresh(entry, now):
+                    self.stats['hits'] += 1
+                    return entry.value, entry.computed_at
+                if now - entry.computed < self.max_stale:
+                    self.stats['stale_hits'] += 1
+                    if key not in self._inflight:
+                        self.stats['refreshes'] += 1
+                        future = self._inflight[key] = Future()
+                        self._refresh_executor().submit(self._compute, key, compute, future)
+                    return entry.value, entry.computed_at
+            self.stats['misses'] += 1
+            future = self._inflight.get(key)
+            leader = future is None
+            if leader:
+                future = self._inflight[key] = Future()
+        if leader:
+            self._compute(key, compute, future)
+        entry = future.result()
+        return entry.value, entry.computed_at
+
+    def _compute(self, key, compute, future):
+        """Run compute() once for everyone waiting on the key and store the result"""
+        with self._lock:
+            generation = self.generation
+        try:
+            value = compute()
+        except BaseException as e:
+            with self._lock:
+                if self._inflight.get(key) is future:
+                    del self._inflight[key]
+            future.set_exception(e)
+            if not isinstance(e, Exception):
+                raise
+            return
+        # An invalidation during compute() leaves the entry stale, so it is refreshed again
+        entry = Entry(value, time.monotonic(), generation, time.strftime('%Y-%m-%d %H:%M:%S'))
+        with self._lock:
+            # Discarded while computing: the caller still gets the value, the cache does not keep it
+            if self._inflight.get(key) is future:
+                del self._inflight[key]
+                if self.cacheable(value):
+                    self.entries[key] = entry
+                    self.entries.move_to_end(key)
+                    while len(self.entries) > self.max_entries:
+                        self.entries.popitem(last=False)
+                        self.stats['evictions'] += 1
+        future.set_result(entry)
+
+    def _refresh_executor(self):
+        # Threads do not survive a fork, so each process starts its own
+        if self._pid != os.getpid():
+            self._pid = os.getpid()
+            self._executor = ThreadPoolExecutor(max_workers=REFRESH_WORKERS, thread_name_prefix='report-cache')
+        return self._executor
+
+    def metrics(self):
+        with self._lock:
+            return dict(self.stats, entries=len(self.entries), refreshing=len(self._inflight))
+
+def slice_key(slice_):
+    """Hashable cache key of a cube.parse_slice() result"""
+    return (slice_['level'], slice_['group'], slice_['start'], slice_['end'],
+            tuple(sorted(slice_['filters'].items())))
+
+# Business report slices: (rows, warnings); a slice missing a shard is not kept
+business = ReportCache(cacheable=lambda result: not result[1])
+
+@signals.policies_issued.connect
+def _on_policies_issued(agency_code, policies):
+    business.invalidate()
@@ -0,0 +1,81 @@
+"""
+Reports
+Report queries shared by the report pages and the background report jobs
+"""
+
+import csv
+
+import mysql.connector
+
+import cube
+import shards
+
+PAYMENT_HISTORY_QUERY = """SELECT pm.Payment_id, pm.Policy_no, ph.Name as Holder_Name, pm.Amount,
+                           pm.Payment_Mode, pm.Timestamp, p.Premium
+                           FROM {payment} pm
+                           JOIN {policy} p ON pm.Policy_no = p.Policy_no
+                           JOIN {holder} ph ON p.Policy_no = ph.Policy_no
+                           WHERE p.Agency_code = %s AND pm.Timestamp >= %s AND pm.Timestamp < %s"""
+
+def payment_history(cursor, agency_code, start, end, include_archive=False):
+    """An agent's payments with start <= Timestamp < end, newest first.
+
+    The Timestamp range lets MySQL prune the yearly Payment partitions; the
+    archive tables are only read when include_archive is set.
+    """
+    query = PAYMENT_HISTORY_QUERY.format(payment='Payment', policy='Policy', holder='Policy_Holder')
+    params = [agency_code, start, end]
+    if include_archive:
+        query += " UNION ALL " + PAYMENT_HISTORY_QUERY.format(
+            payment='Payment_Archive', policy='Policy_Archive', holder='Policy_Holder_Archive')
+        params += [agency_code, start, end]
+    cursor.execute(query + " ORDER BY Timestamp DESC", params)
+    return cursor.fetchall()
+
+def business_slice(slice_):
+    """Refresh and query the business cube on every shard, returns (rows, warnings).
+
+    A shard whose refresh fails is still queried as it is; a shard that
+    cannot be queried at all is left out and reported in the warnings.
+    """
+    def query_shard(shard, conn):
+        warning = None
+        try:
+            cube.refresh(conn)
+        except mysql.connector.Error as e:
+            warning = f'{shard.name} may be missing the newest policies: {e}'
+        cursor = conn.cursor(dictionary=True)
+        try:
+            return cube.query(cursor, **slice_), warning
+        finally:
+            cursor.close()
+
+    parts, warnings = [], []
+    for shard, result, error in shards.fan_out(query_shard):
+        if error:
+            warnings.append(f'{shard.name} unavailable: {error}')
+            continue
+        data, warning = result
+        parts.append(data)
+        if warning:
+            warnings.append(warning)
+    return cube.merge(parts), warnings
+
+def business_report_job(ctx, conn):
+    """Background job: write a business cube slice to a CSV for download"""
+    slice_ = cube.parse_slice(ctx.params)
+    ctx.progress(0, message=f"Aggregating {slice_['level']} report", force=True)
+    data, warnings = business_slice(slice_)
+    # An export must be complete, unlike the page which can show what it has
+    if warnings:
+        raise mysql.connector.Error('; '.join(warnings))
+
+    with open(ctx.result_path('csv'), 'w', newline='', encoding='utf-8') as f:
+        writer = csv.writer(f)
+        group = slice_['group']
+        writer.writerow(['Period'] + ([cube.DIMENSIONS[group]] if group else [])
+                        + ['Policy_Count', 'Premium_Total', 'Total_Commission'])
+        for row in data:
+            writer.writerow([row['Period']] + ([row['Dimension']] if group else [])
+                            + [row['Policy_Count'], row['Premium_Total'] or 0, row['Total_Commission'] or 0])
+    ctx.progress(len(data), len(data), f'{len(data)} rows', force=True)
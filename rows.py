@@ -0,0 +1,96 @@
+"""
+Row Records
+Compact rows for large list views. Result rows are mapped onto a namedtuple
+class per query shape (the tuple of column names), so each row costs one
+tuple instead of a dict repeating every key. Records support attribute
+access in templates just like dictionary rows. Large pages can stream
+records straight from an unbuffered cursor while the template renders.
+"""
+
+from collections import namedtuple
+from functools import lru_cache
+
+BATCH_SIZE = 500
+
+@lru_cache(maxsize=256)
+def record_type(columns):
+    """The namedtuple class for a tuple of column names, shared by every query of that shape"""
+    return namedtuple('Record', columns, rename=True)
+
+def iter_records(cursor, batch_size=BATCH_SIZE):
+    """Yield records from an executed (non-dictionary) cursor a batch at a time"""
+    make = record_type(tuple(cursor.column_names))._make
+    while True:
+        rows = cursor.fetchmany(batch_size)
+        if not rows:
+            return
+        for row in rows:
+            yield make(row)
+
+def fetch_records(cursor):
+    """All remaining rows of an executed cursor as a list of records"""
+    make = record_type(tuple(cursor.column_names))._make
+    return [make(row) for row in cursor.fetchall()]
+
+def stream_records(conn, query, params=(), batch_size=BATCH_SIZE):
+    """Run a query on an unbuffered cursor and return a RecordStream over its rows.
+
+    The query is executed before returning, so errors surface before a
+    streamed response starts. The stream owns conn from here on.
+    """
+    cursor = conn.cursor()
+    try:
+        cursor.execute(query, params)
+    except Exception:
+        cursor.close()
+        conn.close()
+        raise
+    return RecordStream(conn, cursor, batch_size)
+
+class RecordStream:
+    """Records read lazily from an executed cursor; closes the connection when done.
+
+    close() is safe to call at any point, e.g. when the client disconnects
+    before the page finished rendering.
+    """
+
+    def __init__(self, conn, cursor, batch_size=BATCH_SIZE):
+        self.conn = conn
+        self.cursor = cursor
+        self.batch_size = batch_size
+
+    def __iter__(self):
+        try:
+            yield from iter_records(self.cursor, self.batch_size)
+        finally:
+            self.close()
+
+    def close(self):
+        if self.conn is None:
+            return
+        conn, cursor, self.conn, self.cursor = self.conn, self.cursor, None, None
+        try:
+            if conn.unread_result:
+                conn.consume_results()
+            cursor.close()
+        finally:
+            conn.close()
+
+class RunningTotal:
+    """Wraps a record iterator and sums one field as the rows go by"""
+
+    def __init__(self, records, field):
+        self.records = records
+        self.field = field
+        self.total = 0
+        self.count = 0
+
+    def __iter__(self):
+        for record in self.records:
+            self.total += getattr(record, self.field) or 0
+            self.count += 1
+            yield record
+
+    def close(self):
+        if hasattr(self.records, 'close'):
+            self.records.close()
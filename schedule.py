@@ -0,0 +1,91 @@
+"""
+Premium Schedules
+Installment due dates for a policy, generated the same way the SEL() stored
+function advances FUP: step by the payment mode's interval with MySQL's
+DATE_ADD month arithmetic and stop before the maturity date. Policies issued
+by the app start with their first FUP FIRST_DUE_DAYS after DOC.
+"""
+
+import calendar
+from bisect import bisect_left
+from datetime import date, timedelta
+from functools import lru_cache
+from itertools import islice
+
+MODE_MONTHS = {'Yearly': 12, 'Half-yearly': 6, 'Quarterly': 3, 'Monthly': 1}
+
+# Days from DOC to the first installment of a policy issued from the form or a bulk import
+FIRST_DUE_DAYS = 30
+
+# Policies sold on the same day with the same mode and term share one schedule
+SCHEDULE_CACHE_SIZE = 4096
+
+def add_months(d, months):
+    """d plus a number of months, clamped to the month's last day like MySQL's DATE_ADD"""
+    month_index = d.month - 1 + months
+    year, month = d.year + month_index // 12, month_index % 12 + 1
+    return date(year, month, min(d.day, calendar.monthrange(year, month)[1]))
+
+def first_due(doc):
+    """The first FUP of a policy issued on doc"""
+    return doc + timedelta(days=FIRST_DUE_DAYS)
+
+def maturity_date(doc, term):
+    """DATE_ADD(DOC, INTERVAL Term YEAR)"""
+    return add_months(doc, term * 12)
+
+def installments(doc, mode, term, start=None):
+    """Lazily yield due dates from start (default DOC) up to, but not including, maturity"""
+    maturity = maturity_date(doc, term)
+    step = MODE_MONTHS[mode]
+    due = start or doc
+    while due < maturity:
+        yield due
+        due = add_months(due, step)
+
+@lru_cache(maxsize=SCHEDULE_CACHE_SIZE)
+def due_dates(doc, mode, term):
+    """The installments a policy issued on doc is billed for, from its first FUP, memoized per (DOC, Mode, Term)"""
+    return tuple(installments(doc, mode, term, start=first_due(doc)))
+
+def upcoming(doc, mode, term, fup, limit=None):
+    """Due dates from the current FUP onward, the dates SEL() would step FUP through.
+
+    When FUP lies on the cached due_dates() calendar, as it does for every
+    policy issued by the app, the calendar is sliced; otherwise (e.g. a FUP
+    edited by hand) the dates are generated lazily from FUP itself.
+    """
+    if fup is None:
+        return iter(())
+    full = due_dates(doc, mode, term)
+    i = bisect_left(full, fup)
+    if i < len(full) and full[i] == fup:
+        dates = iter(full[i:])
+    else:
+        dates = installments(doc, mode, term, start=fup)
+    return islice(dates, limit)
+
+def remaining(doc, mode, term, fup):
+    """Number of installments still to be paid"""
+    if fup is None:
+        return 0
+    full = due_dates(doc, mode, term)
+    i = bisect_left(full, fup)
+    if i < len(full) and full[i] == fup:
+        return len(full) - i
+    return sum(1 for _ in installments(doc, mode, term, start=fup))
+
+def policy_schedule(policy, limit=None):
+    """Upcoming installments of a Policy row as dicts for templates and the API"""
+    doc, mode, term, fup = policy['DOC'], policy['Mode'], policy['Term'], policy['FUP']
+    return {
+        'policy_no': policy['Policy_no'],
+        'mode': mode,
+        'premium': policy['Premium'],
+        'maturity_date': maturity_date(doc, term),
+        'remaining': remaining(doc, mode, term, fup),
+        'installments': [
+            {'number': n, 'due_date': due, 'amount': policy['Premium']}
+            for n, due in enumerate(upcoming(doc, mode, term, fup, limit), start=1)
+        ],
+    }
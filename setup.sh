@@ -146,7 +146,7 @@ echo "  Agent  - User ID: 1000001, Password: agent123"
 echo ""
 echo "To start the application:"
 echo "  Development: python app.py"
-echo "  Production:  gunicorn -w 4 -b 0.0.0.0:5000 app:app"
+echo "  Production:  gunicorn   (settings in gunicorn.conf.py)"
 echo ""
 echo "Access the application at: http://localhost:5000"
 echo ""
@@ -0,0 +1,219 @@
+"""
+Shards
+Policy data split across MySQL databases by Agency_code range. Agents only
+ever see their own policies, so agent routes talk to the one shard holding
+them; admin pages fan out to every shard in parallel and merge the results.
+
+Every shard is a full copy of the schema. Reference tables (Admin, Agent,
+Plan) are written to every shard so foreign keys and report joins stay
+local; a copy that does not reach a shard is retried as a background job.
+Logins and the Job table live on the home database (DB_NAME).
+Without DB_SHARDS the home database is the only shard.
+"""
+
+import os
+import threading
+from bisect import bisect_right
+from collections import namedtuple
+from concurrent.futures import ThreadPoolExecutor
+
+import mysql.connector
+
+import db
+import timeouts
+from policy_rules import POLICY_NO_START
+
+# Each shard issues policy numbers from its own block, so numbers stay unique across shards
+POLICY_BLOCK = 100000000
+MAX_SHARDS = 9
+
+# Reference tables copied to every shard, with their primary keys
+REFERENCE_TABLES = {'Admin': 'Admin_id', 'Agent': 'Agency_code', 'Plan': 'Plan_no'}
+# A copy job that cannot reach its shard waits this long before trying again, doubling each time
+COPY_RETRY_SECONDS = int(os.getenv('SHARD_COPY_RETRY_SECONDS', 10))
+COPY_ATTEMPTS = int(os.getenv('SHARD_COPY_ATTEMPTS', 12))
+
+Shard = namedtuple('Shard', 'name first_code config policy_start')
+
+def parse_shards(spec):
+    """Shards from a DB_SHARDS value such as '1000001=insurance_a,1500000=dbhost:3306/insurance_b'.
+
+    Each entry names the lowest agency code the shard holds. Policy number
+    blocks follow the order of the entries, so new shards must be appended.
+    """
+    if spec and db.BACKEND == 'sqlite':
+        raise ValueError('DB_SHARDS needs the MySQL backend')
+    if not spec:
+        return [Shard(db.db_config['database'], '0000000', dict(db.db_config), POLICY_NO_START)]
+
+    entries = [item.strip() for item in spec.split(',') if item.strip()]
+    if len(entries) > MAX_SHARDS:
+        raise ValueError(f'At most {MAX_SHARDS} shards fit in 9-digit policy numbers')
+    shards = []
+    for index, item in enumerate(entries):
+        first_code, _, target = item.partition('=')
+        location, _, database = target.rpartition('/')
+        config = dict(db.db_config, database=database)
+        if location:
+            host, _, port = location.partition(':')
+            config['host'] = host
+            if port:
+                config['port'] = int(port)
+        shards.append(Shard(target, first_code.strip().zfill(7), config, POLICY_NO_START + index * POLICY_BLOCK))
+    return sorted(shards, key=lambda shard: shard.first_code)
+
+SHARDS = parse_shards(os.getenv('DB_SHARDS'))
+_first_codes = [shard.first_code for shard in SHARDS]
+
+_pools = {}
+_pools_pid = None
+_lock = threading.Lock()
+
+def is_home(shard):
+    """True if the shard is the home database, which uses the main pool"""
+    home = db.db_config
+    return (shard.config['database'] == home['database'] and shard.config['host'] == home['host']
+            and shard.config.get('port', 3306) == home.get('port', 3306))
+
+def shard_for(agency_code):
+    """The shard holding an agent's policies"""
+    return SHARDS[max(bisect_right(_first_codes, agency_code) - 1, 0)]
+
+def connect(shard):
+    """A pooled connection to a shard; raises mysql.connector.Error if it is unreachable"""
+    if is_home(shard):
+        conn = db.get_connection()
+        if not conn:
+            raise mysql.connector.Error('Database connection error')
+        return conn
+
+    global _pools_pid
+    with _lock:
+        # Pools are per process, like the main pool
+        if _pools_pid != os.getpid():
+            _pools.clear()
+            _pools_pid = os.getpid()
+        pool = _pools.get(shard.name)
+        if pool is None:
+            pool = db.SessionPool(pool_name=f'shard_{SHARDS.index(shard)}_{os.getpid()}',
+                                  pool_size=db.POOL_SIZE, **shard.config)
+            _pools[shard.name] = pool
+    return pool.get_connection()
+
+def get_connection(agency_code):
+    """Connection to the shard holding an agent's policies"""
+    return connect(shard_for(agency_code))
+
+def fan_out(fn, targets=None):
+    """Run fn(shard, conn) on every shard in parallel.
+
+    Returns (shard, result, error) per shard in shard order; a shard that
+    fails reports its mysql.connector.Error instead of failing the rest.
+    """
+    targets = SHARDS if targets is None else targets
+    # The worker threads borrow their connections under the caller's time budget
+    budget = timeouts.watchdog.current()
+
+    def run(shard):
+        previous = timeouts.watchdog.attach(budget)
+        try:
+            conn = connect(shard)
+        except mysql.connector.Error as e:
+            return shard, None, e
+        else:
+            try:
+                return shard, fn(shard, conn), None
+            except mysql.connector.Error as e:
+                return shard, None, e
+            finally:
+                conn.close()
+        finally:
+            timeouts.watchdog.attach(previous)
+
+    if len(targets) <= 1:
+        return [run(shard) for shard in targets]
+    with ThreadPoolExecutor(max_workers=len(targets), thread_name_prefix='shard') as pool:
+        return list(pool.map(run, targets))
+
+def read_reference(conn, table, key):
+    """A reference-data row as a dict, None if the database does not have it"""
+    cursor = conn.cursor(dictionary=True)
+    try:
+        cursor.execute(f"SELECT * FROM {table} WHERE {REFERENCE_TABLES[table]} = %s", (key,))
+        return cursor.fetchone()
+    finally:
+        cursor.close()
+
+def _write_reference(conn, table, row):
+    """Insert or overwrite a reference-data row, so copying it again is harmless"""
+    columns = list(row)
+    updates = ', '.join(f"{column} = VALUES({column})" for column in columns)
+    cursor = conn.cursor()
+    try:
+        cursor.execute(f"""INSERT INTO {table} ({', '.join(columns)}) VALUES ({', '.join(['%s'] * len(columns))})
+                           ON DUPLICATE KEY UPDATE {updates}""", [row[column] for column in columns])
+        conn.commit()
+    except mysql.connector.Error:
+        conn.rollback()
+        raise
+    finally:
+        cursor.close()
+
+def broadcast(table, key):
+    """Copy a reference-data row, as committed on the home database, to every other shard.
+
+    Returns (shard, error) for each shard it did not reach; the caller
+    queues a copy_job for those so they catch up.
+    """
+    targets = [shard for shard in SHARDS if not is_home(shard)]
+    if not targets:
+        return []
+    home = db.get_connection()
+    if not home:
+        return [(shard, mysql.connector.Error('Database connection error')) for shard in targets]
+    try:
+        row = read_reference(home, table, key)
+        home.commit()
+    finally:
+        home.close()
+    if row is None:
+        return []
+    results = fan_out(lambda shard, conn: _write_reference(conn, table, row), targets)
+    return [(shard, error) for shard, _, error in results if error]
+
+def copy_job(ctx, conn):
+    """Job handler: copy a reference-data row from the home database (conn) to a shard that missed it.
+
+    The row is read when the job runs, so a later edit is copied too. An
+    unreachable shard raises, and the job runner tries again later
+    (registered with COPY_ATTEMPTS and COPY_RETRY_SECONDS).
+    """
+    shard = next((shard for shard in SHARDS if shard.name == ctx.params['shard']), None)
+    if shard is None:
+        return  # no longer in DB_SHARDS
+    row = read_reference(conn, ctx.params['table'], ctx.params['key'])
+    conn.commit()
+    if row is None:
+        return  # deleted since
+    target = connect(shard)
+    try:
+        _write_reference(target, ctx.params['table'], row)
+    finally:
+        target.close()
+    ctx.progress(1, 1, f"{ctx.params['table']} {ctx.params['key']} copied to {shard.name}", force=True)
+
+def missing_references(shard, conn, references):
+    """The (table, key) references a shard has not received although the home database has them"""
+    if is_home(shard):
+        return []
+    absent = [(table, key) for table, key in references if read_reference(conn, table, key) is None]
+    if not absent:
+        return []
+    home = db.get_connection()
+    if not home:
+        raise mysql.connector.Error('Database connection error')
+    try:
+        return [(table, key) for table, key in absent if read_reference(home, table, key) is not None]
+    finally:
+        home.commit()
+        home.close()
@@ -0,0 +1,17 @@
+"""
+Signals
+Application write events. Modules that change policy data announce it here
+after their transaction commits, so in-memory views (live KPIs, leaderboards)
+can follow along without querying the database. Receivers run in the
+writer's thread and must be quick; the sender is the agent's Agency_code.
+"""
+
+from blinker import Namespace
+
+_signals = Namespace()
+
+# policies: list of dicts with policy_no, premium and term, all issued today
+policies_issued = _signals.signal('policies-issued')
+
+# payment: the payments.Payment just recorded (never a repeated submit)
+payment_recorded = _signals.signal('payment-recorded')
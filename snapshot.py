@@ -0,0 +1,208 @@
+#!/usr/bin/env python3
+"""
+Analytics Snapshot
+Exports Policy, Payment, Plan and Agent into column files that analytics.py
+memory-maps, so analytical scans run on NumPy arrays instead of the live
+MySQL tables. Every column is a .npy file: numbers as they are, dates as
+int32 days since 1970-01-01, timestamps as int64 seconds, policy numbers as
+int64 and other strings dictionary-encoded as int32 codes. Rows are streamed
+out of MySQL a chunk at a time inside one consistent-snapshot transaction
+per shard, and a finished snapshot is published by renaming it into place
+and repointing the `current` link.
+
+Usage:
+    python snapshot.py --out snapshots --chunk-size 50000
+"""
+
+import argparse
+import json
+import os
+import shutil
+import sys
+import time
+from datetime import date, datetime
+
+import mysql.connector
+
+import shards
+
+try:
+    import numpy as np
+    from numpy.lib.format import open_memmap
+except ImportError:  # analytics snapshots are optional; the app runs without numpy
+    np = None
+
+SNAPSHOT_DIR = os.getenv('ANALYTICS_DIR', 'snapshots')
+CURRENT = 'current'
+DEFAULT_CHUNK_SIZE = 50000
+KEEP = 2
+
+# Stored value for a NULL date
+DATE_NULL = -2 ** 31
+EPOCH = date(1970, 1, 1)
+EPOCH_ORDINAL = EPOCH.toordinal()
+EPOCH_DATETIME = datetime(1970, 1, 1)
+
+KIND_DTYPES = {
+    'key': 'int64',       # digit strings such as Policy_no
+    'text': 'int32',      # codes into the column's dictionary
+    'date': 'int32',      # days since 1970-01-01, DATE_NULL for NULL
+    'datetime': 'int64',  # seconds since 1970-01-01 00:00:00
+    'int': 'int32',
+    'float': 'float64',
+}
+
+# Exported tables: (source table, replicated on every shard, [(column, kind)])
+TABLES = {
+    'policy': ('Policy', False, [
+        ('Policy_no', 'key'), ('Plan_no', 'text'), ('Agency_code', 'text'), ('Premium', 'float'),
+        ('DOC', 'date'), ('FUP', 'date'), ('Status', 'int'), ('Mode', 'text'), ('Term', 'int'),
+        ('Sum_Assured', 'float'),
+    ]),
+    'payment': ('Payment', False, [
+        ('Payment_id', 'int'), ('Policy_no', 'key'), ('Payment_Mode', 'text'), ('Timestamp', 'datetime'),
+        ('Amount', 'float'),
+    ]),
+    'plan': ('Plan', True, [('Plan_no', 'text'), ('Name', 'text'), ('MMA', 'int')]),
+    'agent': ('Agent', True, [('Agency_code', 'text'), ('Admin_id', 'text'), ('Branch_id', 'text')]),
+}
+
+def encode(values, kind, dictionary=None):
+    """One chunk of a column's values as a NumPy array of its stored type"""
+    count = len(values)
+    if kind == 'key':
+        return np.fromiter((int(v) for v in values), np.int64, count)
+    if kind == 'text':
+        # Dictionaries are shared by every column of the same name, so codes join across tables
+        return np.fromiter((dictionary.setdefault(v or '', len(dictionary)) for v in values), np.int32, count)
+    if kind == 'date':
+        return np.fromiter((v.toordinal() - EPOCH_ORDINAL if v else DATE_NULL for v in values), np.int32, count)
+    if kind == 'datetime':
+        return np.fromiter((int((v - EPOCH_DATETIME).total_seconds()) for v in values), np.int64, count)
+    if kind == 'int':
+        return np.fromiter((int(v or 0) for v in values), np.int32, count)
+    return np.fromiter((float(v or 0) for v in values), np.float64, count)
+
+def export_table(path, sources, table, columns, dictionaries, chunk_size, progress=None):
+    """Stream one table from every source connection into column files, returns the row count"""
+    names = ', '.join(column for column, _ in columns)
+    counts = []
+    for conn in sources:
+        cursor = conn.cursor()
+        cursor.execute(f"SELECT COUNT(*) FROM {table}")
+        counts.append(cursor.fetchone()[0])
+        cursor.close()
+    total = sum(counts)
+
+    arrays = {column: open_memmap(os.path.join(path, f'{table}.{column}.npy'), mode='w+',
+                                  dtype=KIND_DTYPES[kind], shape=(total,))
+              for column, kind in columns}
+    offset = 0
+    for conn, expected in zip(sources, counts):
+        end = offset + expected
+        cursor = conn.cursor()
+        cursor.execute(f"SELECT {names} FROM {table}")
+        while True:
+            rows = cursor.fetchmany(chunk_size)
+            if not rows:
+                break
+            if offset + len(rows) > end:
+                raise RuntimeError(f'{table} changed during the export')
+            for index, (column, kind) in enumerate(columns):
+                values = [row[index] for row in rows]
+                arrays[column][offset:offset + len(rows)] = encode(values, kind, dictionaries.setdefault(column, {}))
+            offset += len(rows)
+            if progress:
+                progress(table, offset, total)
+        cursor.close()
+        if offset != end:
+            raise RuntimeError(f'{table} changed during the export')
+    for array in arrays.values():
+        array.flush()
+    return total
+
+def export(out_dir=SNAPSHOT_DIR, chunk_size=DEFAULT_CHUNK_SIZE, progress=None, keep=KEEP):
+    """Write a new snapshot under out_dir and make it current, returns its path"""
+    if np is None:
+        raise RuntimeError('numpy is required for analytics snapshots (pip install numpy)')
+    os.makedirs(out_dir, exist_ok=True)
+    name = datetime.now().strftime('%Y%m%d%H%M%S')
+    target = os.path.join(out_dir, name)
+    work = target + '.tmp'
+    os.makedirs(work)
+
+    # One consistent read view per shard, so counts and rows agree
+    connections = [mysql.connector.connect(**shard.config) for shard in shards.SHARDS]
+    started = time.monotonic()
+    try:
+        for conn in connections:
+            conn.start_transaction(consistent_snapshot=True, readonly=True)
+        dictionaries, tables = {}, {}
+        for key, (table, replicated, columns) in TABLES.items():
+            sources = connections[:1] if replicated else connections
+            rows = export_table(work, sources, table, columns, dictionaries, chunk_size, progress)
+            tables[key] = {
+                'table': table,
+                'rows': rows,
+                'columns': {column: {'kind': kind, 'file': f'{table}.{column}.npy'} for column, kind in columns},
+            }
+        for conn in connections:
+            conn.rollback()
+    except Exception:
+        shutil.rmtree(work, ignore_errors=True)
+        raise
+    finally:
+        for conn in connections:
+            conn.close()
+
+    with open(os.path.join(work, 'dictionaries.json'), 'w', encoding='utf-8') as f:
+        # Codes are list positions
+        json.dump({column: list(values) for column, values in dictionaries.items()}, f)
+    with open(os.path.join(work, 'manifest.json'), 'w', encoding='utf-8') as f:
+        json.dump({'created': datetime.now().strftime('%Y-%m-%d %H:%M:%S'),
+                   'shards': [shard.name for shard in shards.SHARDS],
+                   'seconds': round(time.monotonic() - started, 2),
+                   'tables': tables}, f, indent=2)
+    os.rename(work, target)
+
+    # Readers resolve the link once per open, so switching it never exposes a half-written snapshot
+    link = os.path.join(out_dir, CURRENT)
+    os.symlink(name, link + '.new')
+    os.replace(link + '.new', link)
+    prune(out_dir, keep)
+    return target
+
+def prune(out_dir, keep=KEEP):
+    """Delete all but the newest `keep` snapshots (processes still mapping them keep their pages)"""
+    names = sorted(name for name in os.listdir(out_dir) if name.isdigit())
+    for name in names[:-keep] if keep else []:
+        shutil.rmtree(os.path.join(out_dir, name), ignore_errors=True)
+
+def main():
+    """Command line entry point"""
+    parser = argparse.ArgumentParser(description='Export an analytics snapshot of the policy book')
+    parser.add_argument('--out', default=SNAPSHOT_DIR, help='Snapshot directory (default: ANALYTICS_DIR)')
+    parser.add_argument('--chunk-size', type=int, default=DEFAULT_CHUNK_SIZE)
+    parser.add_argument('--keep', type=int, default=KEEP, help='Snapshots to keep')
+    args = parser.parse_args()
+
+    last = {}
+
+    def progress(table, done, total):
+        if last.get(table) is None or done - last[table] >= args.chunk_size * 10 or done == total:
+            last[table] = done
+            print(f"  {table}: {done:,}/{total:,}")
+
+    try:
+        path = export(args.out, args.chunk_size, progress, args.keep)
+    except (mysql.connector.Error, RuntimeError) as e:
+        print(f"✗ Export failed: {e}")
+        return False
+    with open(os.path.join(path, 'manifest.json'), encoding='utf-8') as f:
+        manifest = json.load(f)
+    rows = ', '.join(f"{info['rows']:,} {name}" for name, info in manifest['tables'].items())
+    print(f"✓ Snapshot {path} ({rows}) in {manifest['seconds']}s")
+    return True
+
+if __name__ == '__main__':
+    sys.exit(0 if main() else 1)
@@ -0,0 +1,430 @@
+"""
+SQLite Backend
+Runs the app on SQLite (in memory or in a file) instead of MySQL, so tests,
+profiles and benchmarks need no database server. Connections mimic the part
+of mysql-connector the app uses; MySQL-only SQL (DATE_FORMAT, YEAR, CAST ...
+AS UNSIGNED, ON DUPLICATE KEY UPDATE, FOR UPDATE, NOW() +/- INTERVAL) is
+translated as statements are executed, COM() and SEL() are registered as
+Python functions, and sqlite3 errors are raised as the matching
+mysql.connector errors so existing handlers keep working.
+
+All connections share one sqlite3 handle. As with mysql-connector and
+autocommit off, every statement opens a transaction that lasts until
+commit() or rollback(), so start_transaction() after a SELECT raises
+"Transaction already in progress". Transactions that write, or were started
+explicitly, take a process-wide lock, which stands in for InnoDB row locks:
+writers are serialised and SELECT ... FOR UPDATE becomes a plain SELECT. Meant for a single process
+(flask run, tests, benchmarks), not for forked gunicorn workers.
+"""
+
+import os
+import re
+import sqlite3
+import threading
+from datetime import date, datetime, timedelta
+from decimal import Decimal
+from functools import lru_cache
+
+import mysql.connector
+from mysql.connector import errorcode
+
+import timeouts
+from policy_rules import commission
+from schedule import MODE_MONTHS, add_months, maturity_date
+
+SETUP_FILE = os.path.join(os.path.dirname(os.path.abspath(__file__)), 'database_setup.sql')
+
+#  SQL TRANSLATION
+
+_ON_DUPLICATE = re.compile(r'ON\s+DUPLICATE\s+KEY\s+UPDATE', re.I)
+_STATEMENT_RULES = [
+    (re.compile(r'%s'), '?'),
+    (re.compile(r'\s+FOR\s+UPDATE\b', re.I), ''),
+    (re.compile(r'CAST\(([^()]+?)\s+AS\s+UNSIGNED\)', re.I), r'CAST(\1 AS INTEGER)'),
+    (re.compile(r'NOW\(\)\s*-\s*INTERVAL\s+(\?|\d+)\s+(\w+)', re.I), r"DATE_SUB(NOW(), \1, '\2')"),
+    (re.compile(r'NOW\(\)\s*\+\s*INTERVAL\s+(\?|\d+)\s+(\w+)', re.I), r"DATE_ADD(NOW(), \1, '\2')"),
+    (re.compile(r'DATE_ADD\(([^,()]+),\s*INTERVAL\s+(\?|\d+)\s+(\w+)\)', re.I), r"DATE_ADD(\1, \2, '\3')"),
+    # SEL() returns a date; the column name hint lets sqlite3 convert it like a DATE column
+    (re.compile(r'\b(SEL\([^()]*\))\s+AS\s+(\w+)', re.I), r'\1 AS "\2 [DATE]"'),
+]
+
+@lru_cache(maxsize=1024)
+def translate(sql):
+    """A MySQL statement (with %s placeholders) rewritten for SQLite"""
+    for pattern, replacement in _STATEMENT_RULES:
+        sql = pattern.sub(replacement, sql)
+    match = _ON_DUPLICATE.search(sql)
+    if match:
+        updates = re.sub(r'\bVALUES\((\w+)\)', r'excluded.\1', sql[match.end():])
+        sql = sql[:match.start()] + 'ON CONFLICT DO UPDATE SET' + updates
+    return sql
+
+_SKIPPED_DDL = ('DROP DATABASE', 'CREATE DATABASE', 'USE ', 'CREATE FUNCTION', 'GRANT', 'FLUSH')
+_COLUMN_RULES = [
+    (re.compile(r"\s+COMMENT\s+'[^']*'", re.I), ''),
+    (re.compile(r'\bENUM\([^)]*\)', re.I), 'TEXT'),
+    (re.compile(r'\s+ON\s+UPDATE\s+CURRENT_TIMESTAMP', re.I), ''),
+    # SQLite's CURRENT_TIMESTAMP is UTC, MySQL's is the session's local time like NOW()
+    (re.compile(r'\bDEFAULT\s+CURRENT_TIMESTAMP\b', re.I), "DEFAULT (datetime('now', 'localtime'))"),
+    (re.compile(r'\s+UNSIGNED\b', re.I), ''),
+]
+
+def _split_definitions(text):
+    """Top-level comma separated items of the parenthesised CREATE TABLE body that text starts
+    with; anything after its closing parenthesis (ENGINE=..., PARTITION BY ...) is dropped"""
+    items, depth, quoted, current = [], 0, False, []
+    for char in text:
+        if char == "'":
+            quoted = not quoted
+        elif not quoted and char == ')' and depth == 0:
+            break
+        elif not quoted and char == ',' and depth == 0:
+            items.append(''.join(current).strip())
+            current = []
+            continue
+        elif not quoted:
+            depth += (char == '(') - (char == ')')
+        current.append(char)
+    items.append(''.join(current).strip())
+    return [item for item in items if item]
+
+def translate_ddl(statement):
+    """SQLite statements for one statement of database_setup.sql ([] to skip it)"""
+    upper = statement.upper()
+    if upper.startswith(_SKIPPED_DDL):
+        return []
+    if not upper.startswith('CREATE TABLE'):
+        return [statement]
+
+    head, _, body = statement.partition('(')
+    table = head.split()[-1]
+    columns, indexes, auto_increment = [], [], None
+    for item in _split_definitions(body):
+        keyword = item.split()[0].upper()
+        if keyword in ('INDEX', 'KEY'):
+            name, _, cols = item.split(None, 1)[1].partition(' ')
+            # MySQL index names are per table, SQLite's per schema
+            indexes.append(f"CREATE INDEX {table}_{name} ON {table} {cols.strip()}")
+            continue
+        if keyword == 'UNIQUE' and item.split()[1].upper() in ('KEY', 'INDEX'):
+            columns.append('UNIQUE ' + item[item.index('('):])
+            continue
+        for pattern, replacement in _COLUMN_RULES:
+            item = pattern.sub(replacement, item)
+        if re.search(r'\bAUTO_INCREMENT\b', item, re.I):
+            auto_increment = item.split()[0]
+            item = f"{auto_increment} INTEGER PRIMARY KEY AUTOINCREMENT"
+        columns.append(item)
+    if auto_increment:
+        # SQLite only auto-increments a lone INTEGER PRIMARY KEY (Payment's key includes Timestamp)
+        columns = [c for c in columns if not c.upper().startswith('PRIMARY KEY')]
+    return [f"{head}(\n    " + ',\n    '.join(columns) + "\n)"] + indexes
+
+#  FUNCTIONS
+
+_DATE_FORMATS = {'%i': '%M', '%s': '%S', '%M': '%B', '%W': '%A', '%e': '%d', '%c': '%m', '%h': '%I'}
+
+def _as_datetime(value):
+    if value is None:
+        return None
+    text = str(value)
+    return datetime.fromisoformat(text) if len(text) > 10 else datetime.fromisoformat(text + ' 00:00:00')
+
+def _date_format(value, fmt):
+    moment = _as_datetime(value)
+    if moment is None:
+        return None
+    return moment.strftime(re.sub(r'%.', lambda m: _DATE_FORMATS.get(m.group(), m.group()), fmt))
+
+_INTERVAL_UNITS = {'SECOND': 'seconds', 'MINUTE': 'minutes', 'HOUR': 'hours', 'DAY': 'days', 'WEEK': 'weeks'}
+
+def _shift(value, amount, unit, sign):
+    moment = _as_datetime(value)
+    if moment is None or amount is None:
+        return None
+    unit = unit.upper()
+    if unit in ('MONTH', 'YEAR'):
+        shifted = add_months(moment.date(), sign * int(amount) * (12 if unit == 'YEAR' else 1))
+        return shifted.isoformat() if len(str(value)) <= 10 else datetime.combine(shifted, moment.time()).isoformat(' ')
+    shifted = moment + sign * timedelta(**{_INTERVAL_UNITS[unit]: float(amount)})
+    return shifted.isoformat(' ', 'seconds')
+
+def _greatest(*values):
+    return None if any(v is None for v in values) else max(values)
+
+def _least(*values):
+    return None if any(v is None for v in values) else min(values)
+
+def _sel(database):
+    def sel(policy_no):
+        """Python port of the SEL() stored function: the due date after the current FUP"""
+        row = database.execute("SELECT FUP, Mode, DOC, Term FROM Policy WHERE Policy_no = ?",
+                               (policy_no,)).fetchone()
+        if not row or row[0] is None:
+            return None
+        fup, mode, doc, term = row
+        maturity = maturity_date(doc, term)
+        if fup >= maturity or mode not in MODE_MONTHS:
+            return None
+        next_due = add_months(fup, MODE_MONTHS[mode])
+        return None if next_due >= maturity else next_due.isoformat()
+    return sel
+
+def register_functions(database):
+    """MySQL built-ins the app's SQL uses, plus the COM() and SEL() stored functions"""
+    functions = [
+        ('YEAR', 1, lambda v: int(str(v)[:4]) if v else None, True),
+        ('MONTH', 1, lambda v: int(str(v)[5:7]) if v else None, True),
+        ('DATE_FORMAT', 2, _date_format, True),
+        ('DATE_ADD', 3, lambda v, n, unit: _shift(v, n, unit, 1), True),
+        ('DATE_SUB', 3, lambda v, n, unit: _shift(v, n, unit, -1), True),
+        ('GREATEST', -1, _greatest, True),
+        ('LEAST', -1, _least, True),
+        ('CONCAT', -1, lambda *v: None if None in v else ''.join(map(str, v)), True),
+        ('NOW', 0, lambda: datetime.now().isoformat(' ', 'seconds'), False),
+        ('CURDATE', 0, lambda: date.today().isoformat(), False),
+        ('GET_LOCK', 2, lambda name, timeout: 1, False),
+        ('RELEASE_LOCK', 1, lambda name: 1, False),
+        ('COM', 2, lambda premium, term: commission(premium, term) if premium is not None else None, True),
+        ('SEL', 1, _sel(database), False),
+    ]
+    for name, args, function, deterministic in functions:
+        database.create_function(name, args, function, deterministic=deterministic)
+
+#  TYPES AND ERRORS
+
+def _decimal(raw):
+    # Every DECIMAL column in the schema has two decimal places
+    return Decimal(raw.decode()).quantize(Decimal('0.01'))
+
+def _datetime(raw):
+    return datetime.fromisoformat(raw.decode())
+
+sqlite3.register_converter('DATE', lambda raw: date.fromisoformat(raw.decode()[:10]))
+sqlite3.register_converter('DATETIME', _datetime)
+sqlite3.register_converter('TIMESTAMP', _datetime)
+sqlite3.register_converter('DECIMAL', _decimal)
+
+def _adapt(value):
+    if isinstance(value, datetime):
+        return value.isoformat(' ')
+    if isinstance(value, date):
+        return value.isoformat()
+    if isinstance(value, Decimal):
+        return float(value)
+    return value
+
+def _error(e):
+    """The mysql.connector error a MySQL server would have raised"""
+    message = str(e)
+    if isinstance(e, sqlite3.IntegrityError):
+        errno = errorcode.ER_DUP_ENTRY if 'UNIQUE' in message else errorcode.ER_NO_REFERENCED_ROW_2
+        return mysql.connector.IntegrityError(msg=message, errno=errno)
+    if isinstance(e, sqlite3.OperationalError) and 'locked' in message:
+        return mysql.connector.OperationalError(msg=message, errno=errorcode.ER_LOCK_WAIT_TIMEOUT)
+    if isinstance(e, sqlite3.OperationalError) and 'interrupted' in message:
+        return mysql.connector.DatabaseError(msg='Query execution was interrupted', errno=errorcode.ER_QUERY_INTERRUPTED)
+    if isinstance(e, sqlite3.ProgrammingError):
+        return mysql.connector.ProgrammingError(msg=message)
+    return mysql.connector.DatabaseError(msg=message)
+
+#  CONNECTIONS
+
+class Cursor:
+    """The mysql-connector cursor interface over a sqlite3 cursor"""
+
+    def __init__(self, connection, dictionary=False):
+        self._connection = connection
+        self._dictionary = dictionary
+        self._cursor = None
+        self.rowcount = -1
+        self.lastrowid = None
+
+    def _begin_implicit(self, sql):
+        # mysql-connector does not autocommit: any statement opens a transaction that lasts until commit()
+        # or rollback(). Reads take no lock; the first write takes it, as start_transaction() does
+        if sql.lstrip().upper().startswith(('SELECT', 'WITH', 'EXPLAIN')):
+            self._connection.in_transaction = True
+        elif not self._connection.locked:
+            self._connection.begin()
+
+    def execute(self, operation, params=None):
+        sql = translate(operation)
+        self._begin_implicit(sql)
+        with self._connection.lock:
+            self._connection.executing = True
+            try:
+                self._cursor = self._connection.database.execute(sql, [_adapt(p) for p in params or ()])
+            except sqlite3.Error as e:
+                raise _error(e) from e
+            finally:
+                self._connection.executing = False
+        self.rowcount = self._cursor.rowcount
+        self.lastrowid = self._cursor.lastrowid
+
+    def executemany(self, operation, seq_params):
+        sql = translate(operation)
+        self._begin_implicit(sql)
+        with self._connection.lock:
+            self._connection.executing = True
+            try:
+                self._cursor = self._connection.database.executemany(
+                    sql, [[_adapt(p) for p in params] for params in seq_params])
+            except sqlite3.Error as e:
+                raise _error(e) from e
+            finally:
+                self._connection.executing = False
+        self.rowcount = self._cursor.rowcount
+        self.lastrowid = self._cursor.lastrowid
+
+    @property
+    def description(self):
+        return self._cursor.description if self._cursor else None
+
+    @property
+    def column_names(self):
+        return tuple(column[0] for column in self.description or ())
+
+    @property
+    def with_rows(self):
+        return self.description is not None
+
+    def _row(self, row):
+        if row is None or not self._dictionary:
+            return row
+        return dict(zip(self.column_names, row))
+
+    def fetchone(self):
+        return self._row(self._cursor.fetchone()) if self.with_rows else None
+
+    def fetchmany(self, size=1):
+        return [self._row(row) for row in self._cursor.fetchmany(size)] if self.with_rows else []
+
+    def fetchall(self):
+        return [self._row(row) for row in self._cursor.fetchall()] if self.with_rows else []
+
+    def __iter__(self):
+        return iter(self.fetchone, None)
+
+    def close(self):
+        if self._cursor:
+            self._cursor.close()
+            self._cursor = None
+
+class Connection:
+    """The mysql-connector connection interface over the shared sqlite3 handle"""
+
+    unread_result = False
+
+    def __init__(self, database, lock):
+        self.database = database
+        self.lock = lock
+        self.in_transaction = False
+        self.locked = False  # the transaction holds the lock (it wrote, or was started explicitly)
+        self.executing = False
+        self._closed = False
+
+    def cursor(self, dictionary=False, buffered=None, raw=None, prepared=None):
+        return Cursor(self, dictionary)
+
+    def start_transaction(self, consistent_snapshot=False, isolation_level=None, readonly=None):
+        # As with mysql-connector, this includes the transaction an earlier SELECT opened
+        if self.in_transaction:
+            raise mysql.connector.ProgrammingError(msg='Transaction already in progress')
+        self.begin()
+
+    def begin(self):
+        """Take the lock for this connection's transaction"""
+        # Held until commit or rollback: other threads' statements wait, as on locked InnoDB rows
+        self.lock.acquire()
+        try:
+            self.database.execute('BEGIN IMMEDIATE')
+        except sqlite3.Error as e:
+            self.lock.release()
+            raise _error(e) from e
+        self.in_transaction = self.locked = True
+
+    def _end(self, statement):
+        if not self.locked:
+            # Nothing was written: only the read transaction ends
+            self.in_transaction = False
+            return
+        try:
+            self.database.execute(statement)
+        except sqlite3.Error as e:
+            raise _error(e) from e
+        finally:
+            self.in_transaction = self.locked = False
+            self.lock.release()
+
+    def commit(self):
+        self._end('COMMIT')
+
+    def rollback(self):
+        self._end('ROLLBACK')
+
+    def consume_results(self):
+        pass
+
+    def ping(self, reconnect=False, attempts=1, delay=0):
+        pass
+
+    def is_connected(self):
+        return not self._closed
+
+    def kill_query(self):
+        """KILL QUERY: interrupt this connection's statement, if it is the one running on the handle"""
+        # Statements run under the lock, so only this connection's can be running while it executes
+        if self.executing:
+            self.database.interrupt()
+
+    def close(self):
+        timeouts.watchdog.returned(self)
+        # Like returning a pooled MySQL connection: an open transaction is rolled back
+        self.rollback()
+        self._closed = True
+
+def open_database(path=':memory:', schema=SETUP_FILE):
+    """A sqlite3 handle with the MySQL functions registered and, if it is empty, the app schema loaded"""
+    database = sqlite3.connect(path, check_same_thread=False, isolation_level=None,
+                               detect_types=sqlite3.PARSE_DECLTYPES | sqlite3.PARSE_COLNAMES)
+    register_functions(database)
+    database.execute('PRAGMA foreign_keys = ON')
+    if path != ':memory:':
+        database.execute('PRAGMA journal_mode = WAL')
+    has_tables = database.execute("SELECT COUNT(*) FROM sqlite_master WHERE type = 'table'").fetchone()[0]
+    if schema and not has_tables:
+        load_schema(database, schema)
+    return database
+
+def load_schema(database, path=SETUP_FILE):
+    """Create the app's tables, views, indexes and sample rows from the MySQL setup script"""
+    from db import split_statements
+
+    with open(path, encoding='utf-8') as f:
+        script = f.read()
+    database.execute('BEGIN')
+    for statement in split_statements(script):
+        for translated in translate_ddl(statement):
+            database.execute(translated)
+    database.execute('COMMIT')
+
+_database = None
+_lock = threading.RLock()
+
+def connect(path=None):
+    """A connection to this process's SQLite database (DB_SQLITE_PATH, default in memory)"""
+    global _database
+    with _lock:
+        if _database is None:
+            _database = open_database(path or os.getenv('DB_SQLITE_PATH', ':memory:'))
+    return Connection(_database, _lock)
+
+def reset():
+    """Drop this process's database, e.g. between benchmark runs or after a fork"""
+    global _database, _lock
+    with _lock:
+        if _database is not None:
+            _database.close()
+        _database = None
+    _lock = threading.RLock()
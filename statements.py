@@ -0,0 +1,65 @@
+"""
+Prepared Statements
+The statements run on every login, payment and new policy, prepared once
+per MySQL session with prepared cursors instead of being sent as text and
+parsed again on each call. The cursors are kept on the pooled connection
+underneath, and the pools (db.SessionPool) keep a connection's session
+when it is returned, so one statement stays prepared for every request the
+connection serves. A connection that reconnects gets a new session and
+prepares its statements again.
+
+DB_PREPARED_STATEMENTS=0 runs the same statements as plain text queries,
+e.g. to compare the two with Debugging_tools/prepared_benchmark.py.
+"""
+
+import os
+
+PREPARED = os.getenv('DB_PREPARED_STATEMENTS', '1') != '0'
+
+# Prepared cursors only reuse a statement when given the very same string, so callers pass names
+STATEMENTS = {
+    'admin_login': "SELECT Admin_id as id, Name, Password, 'admin' as role FROM Admin WHERE Admin_id = %s",
+    'agent_login': "SELECT Agency_code as id, Name, Password, 'agent' as role FROM Agent WHERE Agency_code = %s",
+    'lock_policy': "SELECT Agency_code, Premium, FUP FROM Policy WHERE Policy_no = %s FOR UPDATE",
+    'insert_payment': """INSERT INTO Payment (Policy_no, Payment_Mode, Timestamp, Amount)
+                         VALUES (%s, %s, %s, %s)""",
+    'next_fup': "SELECT SEL(%s) AS Next_FUP",
+    'advance_fup': "UPDATE Policy SET FUP = %s, Status = %s WHERE Policy_no = %s",
+    'plan': "SELECT * FROM Plan WHERE Plan_no = %s",
+}
+
+def _cursor(conn, name):
+    """This session's prepared cursor for a statement, created on first use"""
+    cnx = getattr(conn, '_cnx', conn)  # the connection a pooled connection wraps
+    session_id = getattr(cnx, 'connection_id', None)
+    cached = getattr(cnx, '_prepared_cursors', None)
+    if cached is None or cached[0] != session_id:
+        # A reconnect lost the old session's statements with it
+        cached = cnx._prepared_cursors = (session_id, {})
+    cursor = cached[1].get(name)
+    if cursor is None:
+        cursor = cached[1][name] = cnx.cursor(prepared=True, dictionary=True)
+    return cursor
+
+def _run(conn, name, params):
+    """Execute a statement, returns (rows, lastrowid)"""
+    if not PREPARED:
+        cursor = conn.cursor(dictionary=True)
+        try:
+            cursor.execute(STATEMENTS[name], params)
+            return (cursor.fetchall() if cursor.with_rows else []), cursor.lastrowid
+        finally:
+            cursor.close()
+    cursor = _cursor(conn, name)
+    cursor.execute(STATEMENTS[name], params)
+    # Prepared cursors are unbuffered: read the whole result so the session is free again
+    return (cursor.fetchall() if cursor.with_rows else []), cursor.lastrowid
+
+def fetch_one(conn, name, params):
+    """First row of a registered SELECT as a dict, None if there is none"""
+    rows, _ = _run(conn, name, params)
+    return rows[0] if rows else None
+
+def execute(conn, name, params):
+    """Run a registered INSERT or UPDATE, returns the inserted row's id"""
+    return _run(conn, name, params)[1]
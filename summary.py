@@ -0,0 +1,157 @@
+"""
+Dashboard Summary
+The numbers on an agent's or admin's dashboard: policies by status, premium
+due this month, overdue policies and commission, for the agent's own
+policies or those of every agent an admin manages. Each comes from a single
+aggregate query per role that the idx_policy_agent_summary covering index
+(Agency_code, Status, FUP, Premium, Term) answers without reading Policy
+rows. Results are cached per user for DASHBOARD_CACHE_TTL seconds. A policy
+issued or a payment recorded (signals.py) drops the cached summaries it
+changes and touches the agent and admin stamp files in DASHBOARD_STAMP_DIR.
+Every other process sees the stamp move on its next lookup and drops its
+cached summaries of that kind, so the next dashboard shows the change
+whichever worker handled the write.
+"""
+
+import os
+import threading
+import time
+from datetime import date
+
+import report_cache
+import shards
+import signals
+
+CACHE_TTL = int(os.getenv('DASHBOARD_CACHE_TTL', 300))
+CACHE_SIZE = int(os.getenv('DASHBOARD_CACHE_SIZE', 1024))
+STAMP_DIR = os.getenv('DASHBOARD_STAMP_DIR', 'dashboard_stamps')
+# One stamp file per kind of summary
+SUMMARIES = ('agent', 'admin')
+
+FIELDS = ('active', 'inactive', 'due_count', 'due_premium', 'overdue', 'commission')
+
+# Premium due this month counts each active policy's next installment if it falls in the month
+SUMMARY_COLUMNS = """COALESCE(SUM(CASE WHEN p.Status = 1 THEN 1 ELSE 0 END), 0) AS active,
+                     COALESCE(SUM(CASE WHEN p.Status = 1 THEN 0 ELSE 1 END), 0) AS inactive,
+                     COALESCE(SUM(CASE WHEN p.Status = 1 AND p.FUP >= %s AND p.FUP < %s THEN 1 ELSE 0 END), 0) AS due_count,
+                     COALESCE(SUM(CASE WHEN p.Status = 1 AND p.FUP >= %s AND p.FUP < %s THEN p.Premium ELSE 0 END), 0) AS due_premium,
+                     COALESCE(SUM(CASE WHEN p.Status = 1 AND p.FUP < %s THEN 1 ELSE 0 END), 0) AS overdue,
+                     COALESCE(SUM(COM(p.Premium, p.Term)), 0) AS commission"""
+
+AGENT_QUERY = "SELECT " + SUMMARY_COLUMNS + """
+                  FROM Policy p WHERE p.Agency_code = %s"""
+
+# Agent rows are copied to every shard, so each shard sums its own policies of the admin's agents
+ADMIN_QUERY = "SELECT " + SUMMARY_COLUMNS + """
+                  FROM Agent a JOIN Policy p ON p.Agency_code = a.Agency_code
+                  WHERE a.Admin_id = %s"""
+
+def month_bounds(today):
+    """First day of today's month and of the next one"""
+    start = today.replace(day=1)
+    return start, (start.replace(year=start.year + 1, month=1) if start.month == 12
+                   else start.replace(month=start.month + 1))
+
+def read_summary(conn, role, user_id, today):
+    """A user's summary as stored on one database"""
+    start, end = month_bounds(today)
+    cursor = conn.cursor(dictionary=True)
+    try:
+        cursor.execute(ADMIN_QUERY if role == 'admin' else AGENT_QUERY, (start, end, start, end, today, user_id))
+        row = cursor.fetchone()
+    finally:
+        cursor.close()
+    return {'active': int(row['active']), 'inactive': int(row['inactive']), 'due_count': int(row['due_count']),
+            'due_premium': float(row['due_premium']), 'overdue': int(row['overdue']),
+            'commission': float(row['commission'])}
+
+def agent_summary(agency_code):
+    """(summary, warnings) of an agent's policies, read from the agent's shard"""
+    conn = shards.get_connection(agency_code)
+    try:
+        return read_summary(conn, 'agent', agency_code, date.today()), []
+    finally:
+        conn.close()
+
+def admin_summary(admin_id):
+    """(summary, warnings) of the policies of every agent an admin manages, summed over the shards"""
+    today = date.today()
+    totals = dict.fromkeys(FIELDS, 0)
+    warnings = []
+    for shard, counts, error in shards.fan_out(lambda shard, conn: read_summary(conn, 'admin', admin_id, today)):
+        if error:
+            warnings.append(f'{shard.name}: {error}')
+            continue
+        for field in FIELDS:
+            totals[field] += counts[field]
+    totals['due_premium'] = round(totals['due_premium'], 2)
+    totals['commission'] = round(totals['commission'], 2)
+    return totals, warnings
+
+# (role, user_id) -> (summary, warnings); a summary missing a shard is not kept
+cache = report_cache.ReportCache(ttl=CACHE_TTL, max_stale=CACHE_TTL * 4, max_entries=CACHE_SIZE,
+                                 cacheable=lambda result: not result[1])
+
+# Summary name -> stamp last seen by this process; the names are fixed, so it never grows
+_seen = dict.fromkeys(SUMMARIES)
+_seen_lock = threading.Lock()
+
+def _stamp_path(name):
+    return os.path.join(STAMP_DIR, name)
+
+def _stamp(name):
+    """When any process last changed summaries of a kind, None if none has"""
+    try:
+        return os.stat(_stamp_path(name)).st_mtime_ns
+    except OSError:
+        return None
+
+def _touch(name):
+    path = _stamp_path(name)
+    try:
+        os.makedirs(STAMP_DIR, exist_ok=True)
+        with open(path, 'a'):
+            pass
+        now = time.time_ns()
+        os.utime(path, ns=(now, now))
+    except OSError as e:
+        # Other processes then show the change once their cached summary expires
+        print(f"Dashboard stamp {path} not updated: {e}")
+
+def _drop(name):
+    for key in cache.keys():
+        if key[0] == name:
+            cache.discard(key)
+
+def _check_stamp(name):
+    """Drop this process's cached summaries of a kind if another process has changed them since"""
+    stamp = _stamp(name)
+    with _seen_lock:
+        if _seen[name] == stamp:
+            return
+        _seen[name] = stamp
+    _drop(name)
+
+def for_user(role, user_id):
+    """((summary, warnings), computed_at) for a dashboard, from the cache when it is current"""
+    name = 'admin' if role == 'admin' else 'agent'
+    # Checked before computing, so a write made while the summary is computed moves the stamp on again
+    _check_stamp(name)
+    if name == 'admin':
+        return cache.get((name, user_id), lambda: admin_summary(user_id))
+    return cache.get((name, user_id), lambda: agent_summary(user_id))
+
+def _changed(agency_code):
+    cache.discard(('agent', agency_code))
+    # The sender's admin is not known here; admin summaries are cheap to recompute
+    _drop('admin')
+    for name in SUMMARIES:
+        _touch(name)
+
+@signals.policies_issued.connect
+def _on_policies_issued(agency_code, policies):
+    _changed(agency_code)
+
+@signals.payment_recorded.connect
+def _on_payment_recorded(agency_code, payment):
+    _changed(agency_code)
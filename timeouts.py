@@ -0,0 +1,278 @@
+"""
+Statement Timeouts
+Per-route time budgets for database work. A request gets a deadline when it
+is admitted (configured_budgets(), read from the environment on first use),
+and every pooled connection it borrows, including those fan_out borrows for
+it on other threads, is leased to it. A watchdog thread sends KILL QUERY, on
+a connection of its own, for each leased connection of a request past its
+deadline; the statement fails with "Query execution was interrupted" and the
+user gets the timeout page. Connections also carry MAX_EXECUTION_TIME
+slightly above their request's budget, so the server stops runaway SELECTs
+itself when the watchdog cannot get a connection in. Connections a request
+never returned are closed, and so go back to their pool, when it ends.
+Kills, timed-out requests and leaked connections are counted per route for
+/api/metrics.
+"""
+
+import os
+import threading
+import time
+from collections import namedtuple
+
+import mysql.connector
+from mysql.connector import errorcode
+
+# Server-side limit on a single SELECT, past the request's budget, for when the watchdog cannot connect
+SERVER_GRACE_SECONDS = 2.0
+TICK_SECONDS = 0.25
+KILL_CONNECT_TIMEOUT = 5
+
+def parse_budgets(spec):
+    """Endpoint -> seconds from 'endpoint=seconds,...' (STATEMENT_TIMEOUTS)"""
+    budgets = {}
+    for item in (spec or '').split(','):
+        if item.strip():
+            endpoint, _, seconds = item.partition('=')
+            budgets[endpoint.strip()] = float(seconds)
+    return budgets
+
+# Endpoints whose statements get STATEMENT_TIMEOUT_HEAVY seconds in all
+HEAVY_ROUTES = (
+    'business_report', 'forecast_report', 'export_forecast', 'commission_report', 'payment_history',
+    'policies', 'payments',  # streamed: the budget covers sending the whole list
+    'agent_leaderboard', 'api_leaderboard', 'import_policies',
+)
+
+def default_seconds():
+    """Seconds the statements of an endpoint without a budget of its own may run (STATEMENT_TIMEOUT)"""
+    return float(os.getenv('STATEMENT_TIMEOUT', 15))
+
+def configured_budgets():
+    """Endpoint -> seconds its statements may run in all, read from the environment"""
+    heavy = float(os.getenv('STATEMENT_TIMEOUT_HEAVY', 60))
+    return {'login': 5, **dict.fromkeys(HEAVY_ROUTES, heavy), **parse_budgets(os.getenv('STATEMENT_TIMEOUTS'))}
+
+# No budget: static files, and the KPI stream, which stays open far longer than any budget
+EXEMPT = {'static', 'kpi_stream'}
+
+# The errors of a statement stopped by KILL QUERY or by MAX_EXECUTION_TIME
+TIMEOUT_ERRNOS = (errorcode.ER_QUERY_INTERRUPTED, errorcode.ER_QUERY_TIMEOUT)
+
+Counts = namedtuple('Counts', 'timed_out killed leaked')
+
+def is_timeout(error):
+    """True for the error of a statement stopped for running out of time"""
+    return isinstance(error, mysql.connector.Error) and error.errno in TIMEOUT_ERRNOS
+
+def kill_query(config, connection_id):
+    """Stop the statement running on a MySQL connection, from a connection of our own"""
+    conn = mysql.connector.connect(connection_timeout=KILL_CONNECT_TIMEOUT, **config)
+    try:
+        cursor = conn.cursor()
+        cursor.execute(f'KILL QUERY {int(connection_id)}')
+        cursor.close()
+    finally:
+        conn.close()
+
+class Lease:
+    """A connection borrowed by a budgeted request"""
+
+    def __init__(self, conn, kill):
+        self.conn = conn
+        self.kill = kill
+        self.killed = False
+        self.returned = False
+        # Held while a kill is sent, so the connection cannot go back to the pool mid-kill
+        self.lock = threading.Lock()
+
+class Budget:
+    """One request's deadline and the connections leased to it"""
+
+    def __init__(self, route, seconds):
+        self.route = route
+        self.seconds = seconds
+        self.deadline = time.monotonic() + seconds
+        self.leases = {}  # id(conn) -> Lease
+        self.timed_out = False  # a statement was stopped
+        self.reported = False  # the request was answered with the timeout page
+        self.ended = False
+
+    @property
+    def server_limit_ms(self):
+        return int((self.seconds + SERVER_GRACE_SECONDS) * 1000)
+
+class Watchdog:
+    """Budgets of the requests in flight in this process, and the thread that enforces them"""
+
+    def __init__(self, budgets=None, default=None, exempt=EXEMPT, tick=TICK_SECONDS):
+        # Read from the environment on first use, once the app has loaded .env
+        self.budgets = budgets
+        self.default = default
+        self.exempt = exempt
+        self.tick = tick
+        self.active = set()
+        self.counts = {}  # route -> Counts
+        self._leases = {}  # id(conn) -> (Budget, Lease)
+        self._local = threading.local()
+        self._lock = threading.Lock()
+        self._pid = None
+        self._thread = None
+
+    def start(self):
+        """Start this process's watchdog thread (again after a fork)"""
+        with self._lock:
+            if self._pid == os.getpid() and self._thread and self._thread.is_alive():
+                return
+            self._pid = os.getpid()
+            self.configure()
+            self.active, self._leases = set(), {}
+            self._thread = threading.Thread(target=self._run, name='statement-watchdog', daemon=True)
+            self._thread.start()
+
+    #  REQUESTS
+
+    def configure(self):
+        """Load the budgets from the environment unless they were given"""
+        if self.budgets is None:
+            self.budgets = configured_budgets()
+        if self.default is None:
+            self.default = default_seconds()
+
+    def budget_for(self, endpoint):
+        """Seconds an endpoint's statements may run, None if it has no budget"""
+        if endpoint is None or endpoint in self.exempt:
+            return None
+        if self.budgets is None or self.default is None:
+            self.configure()
+        return self.budgets.get(endpoint, self.default)
+
+    def begin(self, endpoint):
+        """Start the current request's budget, returns it (None for exempt endpoints)"""
+        seconds = self.budget_for(endpoint)
+        if seconds is None:
+            return None
+        budget = Budget(endpoint, seconds)
+        with self._lock:
+            self.active.add(budget)
+        self._local.budget = budget
+        return budget
+
+    def current(self):
+        """The budget of the request this thread is working for, if any"""
+        return getattr(self._local, 'budget', None)
+
+    def attach(self, budget):
+        """Work for a request on another thread (e.g. fan_out); returns what the thread had before"""
+        previous = self.current()
+        self._local.budget = budget
+        return previous
+
+    def detach(self):
+        """The request is done with this thread; connections it still holds stay leased"""
+        self._local.budget = None
+
+    def end(self, budget):
+        """The request has finished: close the connections it never returned and forget it"""
+        with self._lock:
+            if budget.ended:
+                return
+            budget.ended = True
+            self.active.discard(budget)
+            leaked = [lease for lease in budget.leases.values() if not lease.returned]
+        for lease in leaked:
+            try:
+                lease.conn.close()
+            except mysql.connector.Error as e:
+                print(f"Closing a connection left open by {budget.route} failed: {e}")
+        if leaked:
+            self._count(budget.route, leaked=len(leaked))
+
+    def report(self, budget):
+        """Count a request answered with the timeout page"""
+        if budget and not budget.reported:
+            budget.reported = True
+            self._count(budget.route, timed_out=1)
+
+    #  CONNECTIONS (called by the pools)
+
+    def borrowed(self, conn, kill):
+        """Lease a connection just taken from a pool to the current request, if it has a budget"""
+        budget = self.current()
+        if budget is None or budget.ended:
+            return None
+        lease = Lease(conn, kill)
+        with self._lock:
+            budget.leases[id(conn)] = lease
+            self._leases[id(conn)] = (budget, lease)
+        return budget
+
+    def returned(self, conn):
+        """The connection is going back to its pool: no kill may reach it from now on"""
+        with self._lock:
+            leased = self._leases.pop(id(conn), None)
+        if leased is None:
+            return
+        budget, lease = leased
+        with lease.lock:
+            lease.returned = True
+        with self._lock:
+            budget.leases.pop(id(conn), None)
+
+    #  WATCHDOG
+
+    def _run(self):
+        while True:
+            time.sleep(self.tick)
+            now = time.monotonic()
+            with self._lock:
+                due = [(budget, lease) for budget in self.active if now >= budget.deadline
+                       for lease in budget.leases.values() if not lease.killed and not lease.returned]
+            for budget, lease in due:
+                self._kill(budget, lease)
+
+    def _kill(self, budget, lease):
+        with lease.lock:
+            if lease.returned or lease.killed:
+                return
+            lease.killed = True
+            budget.timed_out = True
+            try:
+                lease.kill()
+            except mysql.connector.Error as e:
+                # The server's MAX_EXECUTION_TIME still stops a SELECT shortly after
+                print(f"Could not stop a statement of {budget.route} after {budget.seconds:g}s: {e}")
+                return
+        self._count(budget.route, killed=1)
+
+    #  METRICS
+
+    def _count(self, route, timed_out=0, killed=0, leaked=0):
+        with self._lock:
+            counts = self.counts.get(route, Counts(0, 0, 0))
+            self.counts[route] = Counts(counts.timed_out + timed_out, counts.killed + killed,
+                                        counts.leaked + leaked)
+
+    def metrics(self):
+        """Per-route timeout counts for this process"""
+        with self._lock:
+            return {
+                'pid': os.getpid(),
+                'in_flight': len(self.active),
+                'routes': {route: counts._asdict() for route, counts in sorted(self.counts.items())},
+            }
+
+def limit_session(cnx, budget):
+    """Set a MySQL session's MAX_EXECUTION_TIME for its borrower, only when it changes"""
+    wanted = budget.server_limit_ms if budget else 0
+    session_id = cnx.connection_id
+    # Kept on the connection object, whose session outlives the borrow (db.SessionPool)
+    if getattr(cnx, '_max_execution_time', None) == (session_id, wanted):
+        return
+    cursor = cnx.cursor()
+    try:
+        cursor.execute('SET SESSION max_execution_time = %s', (wanted,))
+    finally:
+        cursor.close()
+    cnx._max_execution_time = (session_id, wanted)
+
+watchdog = Watchdog()